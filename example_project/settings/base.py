@@ -211,6 +211,14 @@ LOGGING = {
 # pagination related settings
 PAGINATION_DEFAULT_WINDOW = 2
 
+# Speakers' images are fetched in a background thread once they have been
+# saved. Set this to False to fetch them straight after saving instead, in the
+# request or command that saved them. Either way, running
+# "./manage.py sayit_fetch_speaker_images" regularly, e.g. from cron, catches
+# any that failed; its --refresh option also checks whether images already
+# fetched have changed.
+SPEAKER_IMAGES_IN_BACKGROUND = True
+
 APPEND_SLASH = False
 
 # Select2
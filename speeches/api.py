@@ -21,7 +21,7 @@ class SectionResource(NamespacedModelResource):
     class Meta:
         queryset = Section.objects.all()
         resource_name = 'section'
-        excludes = []
+        excludes = ['tree_path', 'subtree_speech_count', 'subtree_speech_min', 'position', 'slug_path', 'content_hash']
         allowed_methods = ['get']
         authentication = Authentication()
         authorization = ReadOnlyAuthorization()
@@ -40,7 +40,7 @@ class SpeakerResource(NamespacedModelResource):
     class Meta:
         queryset = Speaker.objects.all()
         resource_name = 'speaker'
-        excludes = []
+        excludes = ['image_cache_url', 'image_etag', 'image_hash']
         allowed_methods = ['get']
         authentication = Authentication()
         authorization = ReadOnlyAuthorization()
@@ -67,7 +67,7 @@ class SpeechResource(NamespacedModelResource):
     class Meta:
         queryset = Speech.objects.filter(public=True)
         resource_name = 'speech'
-        excludes = ['celery_task_id', 'public']
+        excludes = ['celery_task_id', 'public', 'position']
         allowed_methods = ['get', 'post']
         authentication = Authentication()
         authorization = ReadOnlyAuthorization()
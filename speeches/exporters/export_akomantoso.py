@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import io
+
+import bleach
+from django_bleach.utils import get_bleach_default_options
+from lxml import etree
+import lxml.html
+
+from speeches.models import Speech, Speaker
+
+
+class ExportAkomaNtoso(object):
+    """A Section and everything within it as an Akoma Ntoso document,
+    iterated over as chunks of bytes. The contents are written out as they
+    are fetched, so the whole document is never in memory at once."""
+
+    # How many items of the section's contents to fetch, and write, at once
+    chunk_size = 100
+
+    def __init__(self, section, request, server_name=None):
+        self.section = section
+        self.request = request
+        self.server_name = server_name or request.META.get('SERVER_NAME')
+
+    def speakers(self):
+        """The speakers of the visible speeches within the section."""
+        speeches = Speech.objects.filter(
+            section__tree_path__startswith=self.section.tree_path).visible(self.request)
+        return Speaker.objects.filter(id__in=speeches.values('speaker')).order_by('name', 'id')
+
+    def __iter__(self):
+        buf = io.BytesIO()
+
+        def written():
+            xf.flush()
+            data = buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            return data
+
+        with etree.xmlfile(buf, encoding='utf-8') as xf:
+            xf.write_declaration()
+            with xf.element('akomaNtoso'), xf.element('debate'):
+                with xf.element('meta'), xf.element('references'):
+                    for speaker in self.speakers():
+                        xf.write(etree.Element('TLCPerson', {
+                            'href': '/ontology/person/%s/%s' % (self.server_name, speaker.slug),
+                            'id': speaker.slug,
+                            'showAs': speaker.name,
+                            }))
+                if self.section.start_date:
+                    with xf.element('preface'), xf.element('p'):
+                        date = self.section.start_date.isoformat()
+                        self.write_element(xf, 'docDate', date, {'date': date})
+                yield written()
+
+                with xf.element('debateBody'):
+                    # The elements of the sections currently open. The tree
+                    # can hold copies of a section, without IDs, where its
+                    # contents are interleaved with others', so the nesting
+                    # comes from the level of each item rather than its parent.
+                    open_sections = []
+                    self.open_section(xf, self.section, open_sections)
+
+                    nodes = self.section.iter_descendants_tree_with_speeches(
+                        self.request, all_speeches=True, chunk_size=self.chunk_size)
+                    for i, (node, attrs) in enumerate(nodes, 1):
+                        while len(open_sections) > attrs['level']:
+                            self.close_section(open_sections)
+                        if isinstance(node, Speech):
+                            self.write_speech(xf, node)
+                        else:
+                            self.open_section(xf, node, open_sections)
+                        if i % self.chunk_size == 0:
+                            yield written()
+
+                    while open_sections:
+                        self.close_section(open_sections)
+        yield buf.getvalue()
+
+    def open_section(self, xf, section, open_sections):
+        element = xf.element('debateSection')
+        element.__enter__()
+        open_sections.append(element)
+        self.write_headings(xf, section)
+
+    def close_section(self, open_sections):
+        element = open_sections.pop()
+        element.__exit__(None, None, None)
+
+    def write_headings(self, xf, obj):
+        for tag in ('num', 'heading', 'subheading'):
+            value = getattr(obj, tag)
+            if value:
+                self.write_element(xf, tag, value)
+
+    def write_element(self, xf, tag, text, attrib=None):
+        element = etree.Element(tag, attrib or {})
+        element.text = text
+        xf.write(element)
+
+    def write_speech(self, xf, speech):
+        if speech.speaker or speech.speaker_display:
+            attrib = {'by': '#%s' % speech.speaker.slug if speech.speaker else ''}
+            if speech.start_date:
+                attrib['startTime'] = self.format_datetime(speech.start_date, speech.start_time)
+            if speech.end_date:
+                attrib['endTime'] = self.format_datetime(speech.end_date, speech.end_time)
+            with xf.element(speech.type, attrib):
+                self.write_headings(xf, speech)
+                if speech.speaker_display:
+                    self.write_element(xf, 'from', speech.speaker_display)
+                self.write_text(xf, speech.text)
+        else:
+            with xf.element(speech.type):
+                self.write_text(xf, speech.text)
+
+    def format_datetime(self, date, time):
+        if time is None:
+            return date.isoformat()
+        return datetime.datetime.combine(date, time).isoformat()
+
+    def write_text(self, xf, text):
+        # The text is HTML, so is cleaned and parsed as that before being
+        # written out as XML.
+        text = bleach.clean(text, **get_bleach_default_options())
+        fragment = lxml.html.fragment_fromstring(text, create_parent='div')
+        if fragment.text:
+            xf.write(fragment.text)
+        for child in fragment:
+            xf.write(child)
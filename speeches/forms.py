@@ -659,6 +659,7 @@ class AkomaNtosoImportForm(forms.Form):
                     ('skip', _('Skip them - keep them exactly as they are')),
                     ('replace', _('Replace them - throw away the existing data and use the new')),
                     ('merge', _('Merge the new data into the existing sections - things in both will be duplicated')),
+                    ('update', _('Update them - keep the sections that are unchanged, and replace the rest')),
                     ),
                 widget=forms.RadioSelect(),
                 )
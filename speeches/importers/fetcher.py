@@ -0,0 +1,144 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from six.moves import queue
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Fetcher(object):
+    """Fetches URLs over a pooled HTTP session, retrying with backoff on
+    connection errors and server errors, and optionally keeping what it
+    fetched in cache_dir so that running an import again does not need to
+    fetch it again."""
+
+    def __init__(self, cache_dir=None, prefetch=2, retries=3, backoff_factor=0.5, timeout=60, verify=True):
+        self.cache_dir = cache_dir
+        self.prefetch = prefetch
+        self.timeout = timeout
+        self.verify = verify
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_maxsize=prefetch + 1,
+            max_retries=Retry(
+                total=retries, backoff_factor=backoff_factor,
+                status_forcelist=(429, 500, 502, 503, 504),
+                raise_on_status=False,
+            ),
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def cache_path(self, url):
+        if self.cache_dir:
+            return os.path.join(self.cache_dir, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def request(self, url):
+        logger.debug('Fetching %s', url)
+        response = self.session.get(url, timeout=self.timeout, verify=self.verify, stream=True)
+        response.raise_for_status()
+        return response
+
+    def download(self, url, fp, chunk_size=65536):
+        """Write the body at url into the file fp, a chunk at a time."""
+        path = self.cache_path(url)
+        if path and os.path.exists(path):
+            with open(path, 'rb') as cached:
+                shutil.copyfileobj(cached, fp, chunk_size)
+            return
+
+        start = fp.tell()
+        for chunk in self.request(url).iter_content(chunk_size):
+            fp.write(chunk)
+        if path:
+            fp.seek(start)
+            with self.cache_file(path) as cached:
+                shutil.copyfileobj(fp, cached, chunk_size)
+
+    def get(self, url):
+        """The body at url, as bytes."""
+        path = self.cache_path(url)
+        if path and os.path.exists(path):
+            with open(path, 'rb') as cached:
+                return cached.read()
+
+        content = self.request(url).content
+        if path:
+            with self.cache_file(path) as cached:
+                cached.write(content)
+        return content
+
+    @contextmanager
+    def cache_file(self, path):
+        """A file to write to path through, which only appears there once
+        it has all been written."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                yield fp
+        except:
+            os.remove(tmp_path)
+            raise
+        os.rename(tmp_path, path)
+
+    def pages(self, url, next_url):
+        """Yield the body of the page at url, then of each page after it,
+        next_url being called with the body of each page to find the URL
+        of the next one, or None if it is the last. Up to prefetch pages
+        are fetched in the background ahead of the one being dealt with."""
+        if not self.prefetch:
+            while url:
+                content = self.get(url)
+                url = next_url(content)
+                yield content
+            return
+
+        pages = queue.Queue(self.prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def fetch(url):
+            try:
+                while url:
+                    content = self.get(url)
+                    url = next_url(content)
+                    if not put((content, None)):
+                        return
+                put((None, None))
+            except Exception as e:
+                put((None, e))
+
+        thread = threading.Thread(target=fetch, args=(url,))
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                content, error = pages.get()
+                if error is not None:
+                    raise error
+                if content is None:
+                    return
+                yield content
+        finally:
+            stop.set()
+            thread.join()
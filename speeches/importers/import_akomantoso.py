@@ -1,32 +1,290 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
+import json
 import logging
+import os
+import tempfile
 
 from dateutil import parser as dateutil
 from lxml import etree
 from lxml import objectify
 import requests
+import six
 
 from speeches.importers.import_base import ImporterBase
 from speeches.models import Section, Speech, Speaker
 
 logger = logging.getLogger(__name__)
 
+HEADING_TAGS = ('num', 'heading', 'subheading')
+
+SECTION_TAGS = (
+    'debateSection', 'administrationOfOath', 'rollCall',
+    'prayers', 'oralStatements', 'writtenStatements',
+    'personalStatements', 'ministerialStatements',
+    'resolutions', 'nationalInterest', 'declarationOfVote',
+    'communication', 'petitions', 'papers', 'noticesOfMotion',
+    'questions', 'address', 'proceduralMotions',
+    'pointOfOrder', 'adjournment',
+    )
+
+
+class ContentHash(object):
+    """A hash of an element's content, built up from the end events of it
+    and its descendants in document order, so that it can be worked out
+    while streaming, discarding each element once it has been hashed."""
+
+    def __init__(self):
+        self.sha1 = hashlib.sha1()
+
+    def end(self, element):
+        # By its end, an element's text and its children's tails are complete
+        if not isinstance(element.tag, six.string_types):
+            return
+        children = element.iterchildren(tag=etree.Element)
+        parts = [element.tag, sorted(element.attrib.items()), element.text, [c.tail for c in children]]
+        self.sha1.update(json.dumps(parts).encode('utf-8'))
+
+    def hexdigest(self):
+        return self.sha1.hexdigest()
+
+
+def hash_element(element):
+    content_hash = ContentHash()
+    for event, descendant in etree.iterwalk(element, events=('end',)):
+        content_hash.end(descendant)
+    return content_hash.hexdigest()
+
+
+class StreamFrame(object):
+    """An element of the debate body that sections are made from while
+    streaming, and the Section made for it once its headings are known."""
+
+    def __init__(self, element, parent=None, section=None):
+        self.element = element
+        self.parent = parent
+        self.section = section
+        self.made = parent is None
+        self.skipped = False
+
 
 class ImportAkomaNtoso(ImporterBase):
     start_date = None
+    stream_chunk_size = 64 * 1024
+    # When updating, a temporary copy of the document being imported
+    spool = None
+
+    def __init__(self, stream=False, **kwargs):
+        super(ImportAkomaNtoso, self).__init__(**kwargs)
+        self.stream = stream
 
     def import_document(self, document_path):
-        if document_path.startswith('http'):
-            self.xml = objectify.fromstring(requests.get(document_path, verify=self.verify).content)
+        # When updating, the hashes of the document and of its top level
+        # sections, to compare with those recorded by previous imports, and
+        # the document's own section, if it has one.
+        self.document_hash = self.section_hashes = None
+        self.document_section = None
+        if self.clobber != 'update':
+            return self.import_source(document_path)
+
+        # The document is read through once into a temporary file, hashing
+        # it on the way, so later passes over it need not fetch it again.
+        spool = tempfile.TemporaryFile()
+        try:
+            self.document_hash = self.spool_document(document_path, spool)
+            self.spool = spool
+            if Section.objects.for_instance(self.instance).filter(
+                    parent=None, content_hash=self.document_hash).exists():
+                logger.info('Skipping unchanged %s' % document_path)
+                return self.stats
+            if self.stream:
+                self.section_hashes = iter(self.stream_section_hashes(document_path))
+            return self.import_source(document_path)
+        finally:
+            self.spool = None
+            spool.close()
+
+    def import_source(self, document_path):
+        if self.stream:
+            self.stream_document(document_path)
         else:
-            self.xml = objectify.parse(document_path).getroot()
-        self.ns = self.xml.nsmap.get(None, None)
-        return self.parse_document()
+            if self.spool is not None:
+                self.spool.seek(0)
+                self.xml = objectify.parse(self.spool).getroot()
+            elif document_path.startswith('http'):
+                content = requests.get(document_path, verify=self.verify).content
+                self.metrics.bytes_read += len(content)
+                self.xml = objectify.fromstring(content)
+            else:
+                self.metrics.bytes_read += os.path.getsize(document_path)
+                self.xml = objectify.parse(document_path).getroot()
+            self.ns = self.xml.nsmap.get(None, None)
+            if self.clobber == 'update':
+                self.section_hashes = iter([
+                    hash_element(child) for child in self.xml.debate.debateBody.iterchildren()
+                    if self.get_tag(child) in SECTION_TAGS])
+            self.parse_document()
+        self.finish()
+
+        if self.clobber == 'update' and self.document_section is not None:
+            # Remove what has gone from the document since it was last imported
+            self.delete_sections(list(self.document_section.children.exclude(
+                id__in=self.kept_section_ids | self.imported_section_ids)))
+        return self.stats
 
     def parse_document(self):
-        self.stats = {Speaker: 0}
         debate = self.xml.debate
+        section = self.parse_preface(debate)
+        if section is False:
+            return self.stats
+
+        self.visit(debate.debateBody, section)
+        return self.stats
+
+    def read_document(self, document_path):
+        if self.spool is not None:
+            # Already read (and counted) once, into the spool
+            self.spool.seek(0)
+            for chunk in iter(lambda: self.spool.read(self.stream_chunk_size), b''):
+                yield chunk
+        elif document_path.startswith('http'):
+            resp = requests.get(document_path, verify=self.verify, stream=True)
+            for chunk in resp.iter_content(self.stream_chunk_size):
+                self.metrics.bytes_read += len(chunk)
+                yield chunk
+        else:
+            with open(document_path, 'rb') as fp:
+                for chunk in iter(lambda: fp.read(self.stream_chunk_size), b''):
+                    self.metrics.bytes_read += len(chunk)
+                    yield chunk
+
+    def spool_document(self, document_path, spool):
+        """Copy the document into the file spool, returning its hash."""
+        sha1 = hashlib.sha1()
+        for chunk in self.read_document(document_path):
+            sha1.update(chunk)
+            spool.write(chunk)
+        return sha1.hexdigest()
+
+    def stream_section_hashes(self, document_path):
+        """Return the content hashes of the document's top level sections,
+        reading it through once without importing anything."""
+        parser = etree.XMLPullParser(events=('start', 'end'), remove_blank_text=True)
+        hashes = []
+        body = content_hash = None
+        for chunk in self.read_document(document_path):
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if body is None:
+                    if event == 'start' and self.get_tag(element) == 'debateBody':
+                        body = element
+                    continue
+                if event == 'start':
+                    if element.getparent() is body and self.get_tag(element) in SECTION_TAGS:
+                        content_hash = ContentHash()
+                    continue
+                if element is body:
+                    return hashes
+
+                if content_hash is not None:
+                    content_hash.end(element)
+                    # Its children have been hashed, so are no longer needed
+                    for child in list(element):
+                        element.remove(child)
+                if element.getparent() is body:
+                    if content_hash is not None:
+                        hashes.append(content_hash.hexdigest())
+                        content_hash = None
+                    self.release(element)
+        return hashes
+
+    def next_section_hash(self):
+        if self.section_hashes is None:
+            return ''
+        return next(self.section_hashes)
+
+    def stream_document(self, document_path):
+        """Import the document while it is being parsed, making each section
+        once its headings have been read and each speech once it has ended,
+        and then discarding them, so that only the preface and the elements
+        currently open are ever held in memory."""
+        parser = etree.XMLPullParser(events=('start', 'end'), remove_blank_text=True)
+        parser.set_element_class_lookup(objectify.ObjectifyElementClassLookup())
+
+        frames = None
+        for chunk in self.read_document(document_path):
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if frames is None:
+                    # Everything before the debate body has been read when it starts
+                    if event == 'start' and self.get_tag(element) == 'debateBody':
+                        debate = element.getparent()
+                        self.ns = debate.nsmap.get(None, None)
+                        section = self.parse_preface(debate)
+                        if section is False:
+                            return self.stats
+                        frames = [StreamFrame(element, section=section)]
+                    continue
+
+                frame = frames[-1]
+                if event == 'end' and element is frame.element:
+                    self.make_frame_section(frame)
+                    frames.pop()
+                    if not frames:
+                        return self.stats
+                    self.release(element)
+                    continue
+
+                if element.getparent() is not frame.element:
+                    continue
+                if self.get_tag(element) in HEADING_TAGS:
+                    # these are needed for the section, and are released with the next child
+                    continue
+
+                if event == 'start':
+                    self.make_frame_section(frame)
+                    if self.get_tag(element) in SECTION_TAGS:
+                        frames.append(StreamFrame(element, parent=frame))
+                else:
+                    if not frame.skipped:
+                        self.visit_child(element, frame.section)
+                    self.release(element)
+
+        parser.close()
+        return self.stats
+
+    def make_frame_section(self, frame):
+        if frame.made:
+            return
+        frame.made = True
+        if frame.parent.skipped:
+            frame.skipped = True
+            return
+
+        headings = self.construct_heading(frame.element)
+        top_level = frame.parent.parent is None
+        frame.section = self.make_section(
+            parent=frame.parent.section,
+            start_date=self.start_date,
+            content_hash=self.next_section_hash() if top_level else '',
+            **headings
+        )
+        if not frame.section:
+            frame.skipped = True
+
+    def release(self, element):
+        # Free a handled element, and anything before it in its parent
+        element.clear()
+        parent = element.getparent()
+        while element.getprevious() is not None:
+            parent.remove(element.getprevious())
+
+    def parse_preface(self, debate):
+        """Create the speakers and the top level section from the parts of
+        the debate before its body. Returns the section (None if the debate
+        has no title), or False if the whole debate is to be skipped."""
+        self.stats = {Speaker: 0}
 
         if self.ns:
             people = debate.findall(
@@ -37,13 +295,12 @@ class ImportAkomaNtoso(ImporterBase):
             people = debate.findall('meta/references/TLCPerson')
         if people is None:
             people = []
+        self.lock_speaker_identifiers([person.get('href') for person in people])
         for person in people:
             id = person.get('id')
             href = person.get('href')
-            try:
-                speaker = Speaker.objects.get(
-                    instance=self.instance, identifiers__identifier=href)
-            except Speaker.DoesNotExist:
+            speaker = self.speaker_resolver.get(href)
+            if speaker is None:
                 name = person.get('showAs')
                 if not name:
                     raise Exception("TLCPerson '%s' is missing showAs" % href)
@@ -51,9 +308,11 @@ class ImportAkomaNtoso(ImporterBase):
                 self.stats[Speaker] += 1
 
                 if self.commit:
-                    speaker.save()
-                    speaker.identifiers.create(
-                        identifier=href, scheme='Akoma Ntoso import')
+                    with self.metrics.writing():
+                        speaker.save()
+                        speaker.identifiers.create(
+                            identifier=href, scheme='Akoma Ntoso import')
+                self.speaker_resolver.add(href, speaker)
 
             self.speakers[id] = speaker
 
@@ -89,6 +348,10 @@ class ImportAkomaNtoso(ImporterBase):
             source_url = source_url.get('href')
 
         self.imported_section_ids = set()
+        # When updating, previously imported sections left as they were,
+        # and the document's own section if it was already there.
+        self.kept_section_ids = set()
+        self.document_section = None
 
         section = None
         if docTitle:
@@ -101,13 +364,13 @@ class ImportAkomaNtoso(ImporterBase):
                 'session': session or '',
             }
 
-            section = self.make_section(source_url=source_url or '', **kwargs)
+            section = self.make_section(
+                source_url=source_url or '', content_hash=self.document_hash or '', **kwargs)
 
             if not section:
-                return self.stats
+                return False
 
-        self.visit(debate.debateBody, section)
-        return self.stats
+        return section
 
     def get_preface_tag(self, debate, tag):
         if self.ns:
@@ -117,21 +380,26 @@ class ImportAkomaNtoso(ImporterBase):
         if tag:
             return tag[0]
 
-    def make_section(self, source_url='', **kwargs):
+    def make_section(self, source_url='', content_hash='', **kwargs):
+        if self.clobber == 'update':
+            # Only sections at the top of the document are compared with
+            # what is there; anything below them is new.
+            if content_hash:
+                return self.update_section(source_url, content_hash, **kwargs)
         # If the importer has no opinion on clobbering, just import the section,
         # potentially creating a duplicate section.
-        if self.clobber:
+        elif self.clobber:
             qs = Section.objects.for_instance(self.instance).filter(**kwargs)
             if qs:
                 if self.clobber == 'replace':
                     logger.info('Replacing %s' % kwargs.get('heading'))
                     # Delete old sections, unless they are from this import
+                    old_sections = []
                     for section in qs:
                         if section.id in self.imported_section_ids:
                             break
-                        for speech in section.descendant_speeches():
-                            speech.delete()
-                        section.delete()
+                        old_sections.append(section)
+                    self.delete_sections(old_sections)
                 elif self.clobber == 'merge':
                     # Return (any of) existing section(s), unless it is from this import
                     section = qs[0]
@@ -146,7 +414,37 @@ class ImportAkomaNtoso(ImporterBase):
             else:
                 logger.info('Importing %s' % kwargs.get('heading'))
 
-        section = self.make(Section, source_url=source_url, **kwargs)
+        section = self.make(Section, source_url=source_url, content_hash=content_hash, **kwargs)
+        self.imported_section_ids.add(section.id)
+        return section
+
+    def update_section(self, source_url, content_hash, **kwargs):
+        existing = Section.objects.for_instance(self.instance).filter(parent=kwargs['parent']).exclude(
+            id__in=self.imported_section_ids | self.kept_section_ids)
+
+        if content_hash == self.document_hash:
+            # The document's own section. The document has changed, or it
+            # would have been skipped, so anything directly in the section
+            # is imported again, and its top level sections compared.
+            section = existing.filter(**kwargs).first()
+            if section:
+                logger.info('Updating %s' % kwargs.get('heading'))
+                self.delete_speeches(section)
+                Section.objects.filter(id=section.id).update(content_hash=content_hash)
+                self.document_section = section
+                return section
+        else:
+            section = existing.filter(content_hash=content_hash, start_date=kwargs.get('start_date')).first()
+            if section:
+                logger.info('Unchanged %s' % kwargs.get('heading'))
+                self.kept_section_ids.add(section.id)
+                return None
+            old_sections = list(existing.filter(**kwargs))
+            if old_sections:
+                logger.info('Replacing %s' % kwargs.get('heading'))
+                self.delete_sections(old_sections)
+
+        section = self.make(Section, source_url=source_url, content_hash=content_hash, **kwargs)
         self.imported_section_ids.add(section.id)
         return section
 
@@ -164,7 +462,7 @@ class ImportAkomaNtoso(ImporterBase):
 
     def construct_heading(self, node):
         headings = {}
-        for tag in ('num', 'heading', 'subheading'):
+        for tag in HEADING_TAGS:
             if hasattr(node, tag):
                 headings[tag] = getattr(node, tag).text
         return headings
@@ -173,6 +471,10 @@ class ImportAkomaNtoso(ImporterBase):
         if not time:
             return (None, None)
         dt = dateutil.parse(time)
+        # Just a date says nothing about the time, not that it was midnight,
+        # so gives no start time (as the exporter writes a speech without one)
+        if len(time) == len('YYYY-MM-DD'):
+            return dt.date(), None
         return dt.date(), dt.time()
 
     def get_speaker(self, child):
@@ -200,61 +502,61 @@ class ImportAkomaNtoso(ImporterBase):
         return False
 
     def visit(self, node, section):
+        top_level = self.get_tag(node) == 'debateBody'
         for child in node.iterchildren():
             tagname = self.get_tag(child)
-            if tagname in ('num', 'heading', 'subheading'):
+            if tagname in HEADING_TAGS:
                 # this will already have been extracted
                 continue
-            if tagname in (
-                    'debateSection', 'administrationOfOath', 'rollCall',
-                    'prayers', 'oralStatements', 'writtenStatements',
-                    'personalStatements', 'ministerialStatements',
-                    'resolutions', 'nationalInterest', 'declarationOfVote',
-                    'communication', 'petitions', 'papers', 'noticesOfMotion',
-                    'questions', 'address', 'proceduralMotions',
-                    'pointOfOrder', 'adjournment',
-                    ):
+            if tagname in SECTION_TAGS:
                 headings = self.construct_heading(child)
                 childSection = self.make_section(
                     parent=section,
                     start_date=self.start_date,
+                    content_hash=self.next_section_hash() if top_level else '',
                     **headings
                 )
                 if childSection:
                     self.visit(child, childSection)
-            elif tagname in ('speech', 'question', 'answer'):
-                headings = self.construct_heading(child)
-                text = self.get_text(child)
-                start_date, start_time = self.construct_datetime(child.get('startTime'))
-                end_date, end_time = self.construct_datetime(child.get('endTime'))
-                speaker, display_name = self.get_speaker(child)
-                self.make(
-                    Speech,
-                    section=section,
-                    start_date=start_date or self.start_date,
-                    start_time=start_time,
-                    end_date=end_date,
-                    end_time=end_time,
-                    text=text,
-                    speaker=speaker,
-                    speaker_display=display_name,
-                    type=tagname,
-                    **headings
-                    )
-            elif tagname in ('scene', 'narrative', 'summary', 'other'):
-                text = self.get_text(child)
-
-                self.make(
-                    Speech,
-                    section=section,
-                    start_date=self.start_date,
-                    text=text,
-                    type=tagname,
-                    )
             else:
-                success = self.handle_tag(child, section)
-                if not success:
-                    logger.error(
-                        '%s unrecognised, "%s" - %s' %
-                        (child.tag, child, self.get_text(child))
-                        )
+                self.visit_child(child, section)
+
+    def visit_child(self, child, section):
+        """Import a child of a section that isn't itself a section."""
+        tagname = self.get_tag(child)
+        if tagname in ('speech', 'question', 'answer'):
+            headings = self.construct_heading(child)
+            text = self.get_text(child)
+            start_date, start_time = self.construct_datetime(child.get('startTime'))
+            end_date, end_time = self.construct_datetime(child.get('endTime'))
+            speaker, display_name = self.get_speaker(child)
+            self.make(
+                Speech,
+                section=section,
+                start_date=start_date or self.start_date,
+                start_time=start_time,
+                end_date=end_date,
+                end_time=end_time,
+                text=text,
+                speaker=speaker,
+                speaker_display=display_name,
+                type=tagname,
+                **headings
+                )
+        elif tagname in ('scene', 'narrative', 'summary', 'other'):
+            text = self.get_text(child)
+
+            self.make(
+                Speech,
+                section=section,
+                start_date=self.start_date,
+                text=text,
+                type=tagname,
+                )
+        else:
+            success = self.handle_tag(child, section)
+            if not success:
+                logger.error(
+                    '%s unrecognised, "%s" - %s' %
+                    (child.tag, child, self.get_text(child))
+                    )
@@ -1,25 +1,268 @@
+from contextlib import contextmanager
+import functools
 import logging
+import time
+
+from django.apps import apps
+from django.db import connection
+from django.db.models import F
+from haystack import connection_router, connections
+from haystack.exceptions import NotHandled
+from haystack.signals import RealtimeSignalProcessor
+from haystack.utils import get_model_ct
+
+from speeches.models import Section, Speaker, Speech
 
 logger = logging.getLogger(__name__)
 
 
+class SpeakerResolver(object):
+    """Finds an instance's speakers by identifier, from a map of them all
+    loaded on first use, so that it can be shared by the imports of many
+    documents mentioning the same people without a query per person."""
+
+    def __init__(self, instance):
+        self.instance = instance
+        self.speakers = None
+        # Identifiers added since the last import was committed
+        self.uncommitted = []
+
+    def load(self):
+        if self.speakers is None:
+            speakers = Speaker.objects.filter(
+                instance=self.instance, identifiers__isnull=False,
+                ).annotate(identifier=F('identifiers__identifier'))
+            self.speakers = dict((speaker.identifier, speaker) for speaker in speakers)
+
+    def missing(self, identifiers):
+        """Return those of the identifiers that have no speaker in the map."""
+        self.load()
+        return set(identifiers) - set(self.speakers)
+
+    def get(self, identifier):
+        """Return the speaker with the given identifier, or None."""
+        self.load()
+        speaker = self.speakers.get(identifier)
+        if speaker is None:
+            # It may have been created since the map was loaded, by another
+            # process of the same import.
+            speaker = Speaker.objects.filter(
+                instance=self.instance, identifiers__identifier=identifier).first()
+            if speaker is not None:
+                self.speakers[identifier] = speaker
+        return speaker
+
+    def add(self, identifier, speaker):
+        self.load()
+        self.speakers[identifier] = speaker
+        self.uncommitted.append(identifier)
+
+    def committed(self):
+        self.uncommitted = []
+
+    def rolled_back(self):
+        """Forget the speakers added by an import that was rolled back."""
+        for identifier in self.uncommitted:
+            self.speakers.pop(identifier, None)
+        self.uncommitted = []
+
+
+class ImportMetrics(object):
+    """Measurements of an import: how long it took, how many queries it
+    made and how long they took, how much of it was spent writing rows
+    rather than parsing, and how many bytes of the document were read."""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.write_seconds = 0.0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.bytes_read = 0
+        self._writing = 0
+
+    def count_query(self, execute, sql, params, many, context):
+        start = time.time()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.time() - start
+
+    @contextmanager
+    def measure(self):
+        """Time, and count the queries of, whatever is run within it.
+        Queries can only be counted from Django 2.0."""
+        start = time.time()
+        try:
+            if hasattr(connection, 'execute_wrapper'):
+                with connection.execute_wrapper(self.count_query):
+                    yield
+            else:
+                self.queries = self.query_seconds = None
+                yield
+        finally:
+            self.seconds += time.time() - start
+
+    @contextmanager
+    def writing(self):
+        """Count the time spent within it as spent writing."""
+        self._writing += 1
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._writing -= 1
+            if not self._writing:
+                self.write_seconds += time.time() - start
+
+    def as_dict(self, stats=None):
+        return {
+            'seconds': round(self.seconds, 6),
+            'parse_seconds': round(self.seconds - self.write_seconds, 6),
+            'write_seconds': round(self.write_seconds, 6),
+            'queries': self.queries,
+            'query_seconds': round(self.query_seconds, 6) if self.query_seconds is not None else None,
+            'bytes_read': self.bytes_read,
+            'rows': dict((cls.__name__, n) for cls, n in (stats or {}).items()),
+        }
+
+
+def writes(method):
+    """Count the time spent in an importer's method as spent writing."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.metrics.writing():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class ImporterBase(object):
-    def __init__(self, instance=None, commit=True, clobber=None, verify=True, **kwargs):
+    bulk_batch_size = 500
+
+    def __init__(self, instance=None, commit=True, clobber=None, verify=True, bulk=False,
+                 speaker_resolver=None, **kwargs):
         self.instance = instance
         self.commit = commit
         self.clobber = clobber
         self.verify = verify
+        self.bulk = bulk
         self.speakers = {}
+        self.speaker_resolver = speaker_resolver or SpeakerResolver(instance)
 
         self.stats = {}
+        self.metrics = ImportMetrics()
+        self.pending_speeches = []
+        self.bulk_speech_ids = []
 
+    @writes
     def make(self, cls, **kwargs):
         self.stats.setdefault(cls, 0)
         self.stats[cls] += 1
 
         s = cls(instance=self.instance, **kwargs)
-        if self.commit:
+        if self.commit and self.bulk and cls is Speech and s.section_id:
+            # Sections are still saved as they come, as they are needed as
+            # parents and their slugs must be unique among their siblings;
+            # speeches outside a section are placed among all the instance's.
+            self.pending_speeches.append(s)
+            if len(self.pending_speeches) >= self.bulk_batch_size:
+                self.flush()
+        elif self.commit:
             s.save()
         elif s.heading:
             logger.info(s.heading)
         return s
+
+    def lock_speaker_identifiers(self, identifiers):
+        """Before creating speakers for any of the given identifiers that no
+        speaker has yet, wait for any other import (e.g. in another process
+        of the same run) that might be creating them to finish. The locks
+        are held until the end of the current transaction, and are taken in
+        order so that imports waiting on each other can't deadlock."""
+        if not self.commit or connection.vendor != 'postgresql':
+            return
+        with connection.cursor() as cursor:
+            for identifier in sorted(self.speaker_resolver.missing(identifiers)):
+                cursor.execute(
+                    'SELECT pg_advisory_xact_lock(%s, hashtext(%s))', [self.instance.id, identifier])
+
+    @writes
+    def flush(self):
+        """Insert the speeches buffered in bulk mode, and bring the positions
+        and aggregates of their sections up to date, as saving them one at a
+        time would have."""
+        speeches, self.pending_speeches = self.pending_speeches, []
+        if not speeches:
+            return
+
+        Speech.objects.bulk_create(speeches)
+
+        added = {}
+        for speech in speeches:
+            count, start = added.get(speech.section_id, (0, None))
+            starts = [x for x in (start, speech.start_datetime) if x]
+            added[speech.section_id] = (count + 1, min(starts) if starts else None)
+        Speech.objects.rebuild_positions(added)
+        for section_id, (count, start) in added.items():
+            Section.objects.speech_added(section_id, start, count)
+        Section.objects.bump_tree_versions(added)
+        self.bulk_speech_ids.extend(s.id for s in speeches)
+
+    @writes
+    def finish(self):
+        """Called at the end of an import, to flush any buffered speeches and
+        then add those inserted in bulk to the search index in batches, if
+        saving them would have done so."""
+        self.flush()
+        ids, self.bulk_speech_ids = self.bulk_speech_ids, []
+        if not ids:
+            return
+
+        for using, backend, index in self.search_indexes(Speech):
+            for i in range(0, len(ids), self.bulk_batch_size):
+                batch = ids[i:i + self.bulk_batch_size]
+                backend.update(index, index.index_queryset(using=using).filter(id__in=batch))
+
+    @writes
+    def delete_sections(self, sections):
+        """Delete the given sections, and everything within them, all at once,
+        then remove them from the search index if deleting them one at a
+        time would have done so, committing the index only at the end."""
+        self.flush()
+        self.remove_from_index(Section.objects.delete_subtrees(sections))
+
+    @writes
+    def delete_speeches(self, section):
+        """Delete the speeches directly in the given section all at once,
+        then remove them from the search index as delete_sections does."""
+        self.flush()
+        speech_ids = Speech.objects.delete_in_sections([section.id])
+        if speech_ids:
+            Section.objects.refresh_speech_aggregates([section.id])
+            Section.objects.bump_tree_versions([section.id])
+        self.remove_from_index({Speech: speech_ids})
+
+    def remove_from_index(self, deleted):
+        """Remove the objects deleted, a list of IDs by model, from the search
+        index if deleting them one at a time would have done so, committing
+        the index only at the end."""
+        for model, ids in deleted.items():
+            if not ids:
+                continue
+            identifiers = ['%s.%s' % (get_model_ct(model), id) for id in ids]
+            for using, backend, index in self.search_indexes(model):
+                for identifier in identifiers[:-1]:
+                    backend.remove(identifier, commit=False)
+                backend.remove(identifiers[-1])
+
+    def search_indexes(self, model):
+        """Yield the connection alias, backend and index of each search
+        connection that saving or deleting the model would have updated."""
+        if not isinstance(apps.get_app_config('haystack').signal_processor, RealtimeSignalProcessor):
+            return
+        for using in connection_router.for_write():
+            try:
+                index = connections[using].get_unified_index().get_index(model)
+            except NotHandled:
+                continue
+            yield using, connections[using].get_backend(), index
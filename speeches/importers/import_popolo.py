@@ -1,15 +1,19 @@
 import os.path
-import json
-import requests
+import tempfile
+from contextlib import contextmanager
 
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.utils import six
 from django.forms import ValidationError
 from django.utils.translation import ugettext as _
 
 from instances.models import Instance
-from popolo.models import Membership, Organization, Post
+from popolo.models import Identifier, Link, Membership, Organization, OtherName, Post, Source
 
+from speeches.importers.fetcher import Fetcher
 from speeches.models import Speaker
+from speeches.utils.jsonstream import JSONStreamReader
 
 import logging
 logger = logging.getLogger(__name__)
@@ -74,87 +78,209 @@ def update_object(qs, data, extra=False, defaults=None, **kwargs):
     return record, created
 
 
+class GenericRows(object):
+    """The rows of one of the generic relations (e.g. links) of a set of
+    objects, loaded all at once and keyed by object and key_fields, so that
+    the rows wanted can be compared with them in memory, and only those
+    that are new or whose value_fields have changed written, in bulk."""
+
+    batch_size = 500
+
+    def __init__(self, model, content_type, object_ids, key_fields, value_fields=()):
+        self.model = model
+        self.content_type = content_type
+        self.key_fields = key_fields
+        self.value_fields = value_fields
+        self.rows = {}
+        self.created = []
+        self.changed = {}
+        for row in model.objects.filter(content_type=content_type, object_id__in=object_ids).order_by('id'):
+            self.rows.setdefault(self.key(row.object_id, row.__dict__), row)
+
+    def key(self, object_id, values):
+        return (object_id,) + tuple(values[field] for field in self.key_fields)
+
+    def set(self, object_id, **values):
+        """Make sure the object has a row with these values."""
+        key = self.key(object_id, values)
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = self.model(content_type=self.content_type, object_id=object_id, **values)
+            self.created.append(row)
+        elif any(getattr(row, field) != values[field] for field in self.value_fields):
+            for field in self.value_fields:
+                setattr(row, field, values[field])
+            if row.pk is not None:
+                self.changed[row.pk] = row
+
+    def save(self):
+        self.model.objects.bulk_create(self.created, batch_size=self.batch_size)
+        for pk, row in self.changed.items():
+            self.model.objects.filter(pk=pk).update(
+                **dict((field, getattr(row, field)) for field in self.value_fields))
+        self.created = []
+        self.changed = {}
+
+
+def next_page_url(content):
+    """The URL of the page of PopIt results after this one, if any."""
+    reader = JSONStreamReader([content])
+    if reader.peek() == '{':
+        for key in reader.iter_object():
+            if key == 'next_url':
+                return reader.read_value()
+
+
 class PopoloImporterCreationError(ValidationError):
     pass
 
 
 class PopoloImporter(object):
+    """Imports people, organizations, posts and memberships from a Popolo
+    JSON file or URL, or from a PopIt API. The JSON is read incrementally,
+    one item of each collection at a time, so the memory used does not
+    grow with the size of the source."""
+
     popit_meta = None
-    source_data = None
+    persons_only = False
+    chunk_size = 65536
+    batch_size = 500
 
-    def __init__(self, source, instance=None):
+    # Maps from the Popolo ids of organizations, people and posts to the
+    # ids of their records, loaded once per run when first needed
+    organizations = None
+    persons = None
+    posts = None
+
+    def __init__(self, source, instance=None, fetcher=None):
         if instance:
             self.instance = instance
         else:
             self.instance, created = Instance.objects.get_or_create(label='default')
 
         self.source = source
+        self.spool = None
+        self.fetcher = fetcher or Fetcher(cache_dir=getattr(settings, 'POPOLO_CACHE_DIR', None))
 
         try:
             if os.path.exists(self.source):
-                json_src = json.load(open(self.source))
+                pass
             elif self.source.startswith('http'):
-                json_src = requests.get(source).json()
+                # Fetch it only the once, to read each collection from disk
+                self.spool = tempfile.TemporaryFile()
+                self.fetcher.download(source, self.spool, self.chunk_size)
             else:
                 raise PopoloImporterCreationError(
                     _('Either a file path or a URL is needed.'))
+
+            with self.open_source() as reader:
+                start = reader.peek()
+                if start == '{':
+                    # Look for persons key to identify source like
+                    # https://raw.githubusercontent.com/mysociety/pombola/0fd988606c31a31516ac782ebce00b9abfbb0c4d/pombola/south_africa/data/south-africa-popolo.json
+                    meta = None
+                    for key in reader.iter_object():
+                        if key == 'persons':
+                            return
+                        elif key == 'meta':
+                            meta = reader.read_value()
+                elif start == '[':
+                    # Look for a single list, if we find one, assume it's
+                    # a list of persons
+                    self.persons_only = True
+                    return
         except:
             raise PopoloImporterCreationError(
                 _('Failed to decode JSON at %(source)s' % {'source': source}))
 
-        # Look for meta and persons_api to identify popit.
-        if type(json_src) == dict:
-            # Look for persons key to identify source like
-            # https://raw.githubusercontent.com/mysociety/pombola/0fd988606c31a31516ac782ebce00b9abfbb0c4d/pombola/south_africa/data/south-africa-popolo.json
-            if 'persons' in json_src:
-                self.source_data = json_src
-                return
-
-            try:
-                json_src['meta']['persons_api_url']
-
-                # This looks like sayit.
-                self.popit_meta = json_src['meta']
-                return
-            except KeyError:
-                pass
-
-        elif type(json_src) is list:
-            # Look for a single list, if we find one, assume it's
-            # a list of persons
-            self.source_data = {'persons': json_src}
-
-        else:
+        if start != '{':
             raise PopoloImporterCreationError(
                 _('The json must contain either an object or an array'))
 
+        # Look for meta and persons_api to identify popit.
+        if isinstance(meta, dict) and 'persons_api_url' in meta:
+            # This looks like sayit.
+            self.popit_meta = meta
+
+    @contextmanager
+    def open_source(self):
+        """A JSONStreamReader positioned at the start of the source."""
+        if self.spool:
+            self.spool.seek(0)
+            yield JSONStreamReader.from_file(self.spool, self.chunk_size)
+        else:
+            with open(self.source, 'rb') as fp:
+                yield JSONStreamReader.from_file(fp, self.chunk_size)
+
     def get_popit(self, path):
         data_url = self.popit_meta.get('%s_api_url' % path)
+        if not data_url:
+            return
 
-        while data_url:
-            data = requests.get(data_url).json()
-
-            if 'result' in data:
-                data_url = data.get('next_url')
+        for content in self.fetcher.pages(data_url, next_page_url):
+            reader = JSONStreamReader([content])
 
+            if reader.peek() == '{':
                 # Looks like we have paginated data a la PopIt
-                results = data['result']
+                for key in reader.iter_object():
+                    if key == 'result':
+                        for x in reader.items():
+                            yield x
             else:
-                data_url = None
-
                 # Probably we have all the data in a single file.
-                results = data
+                for x in reader.items():
+                    yield x
+
+    def get_source(self, path):
+        with self.open_source() as reader:
+            if self.persons_only:
+                if path == 'persons':
+                    for x in reader.items():
+                        yield x
+                return
 
-            for x in results:
-                yield x
+            for key in reader.iter_object():
+                if key == path:
+                    for x in reader.items():
+                        yield x
+                    return
 
     def get(self, path):
         if self.popit_meta:
             return self.get_popit(path)
         else:
-            return self.source_data.get(path, [])
+            return self.get_source(path)
+
+    def load_identifiers(self, model, objects=None):
+        """A map from the identifiers of objects of model (all of them, or
+        just those in objects) to their ids, the first one given an
+        identifier winning."""
+        content_type = ContentType.objects.get_for_model(model)
+        rows = Identifier.objects.filter(content_type=content_type)
+        if objects is not None:
+            rows = rows.filter(object_id__in=objects.order_by().values('pk'))
+        ids = {}
+        for identifier, object_id in rows.order_by('id').values_list('identifier', 'object_id'):
+            ids.setdefault(identifier, object_id)
+        return ids
+
+    def organization_ids(self):
+        if self.organizations is None:
+            self.organizations = self.load_identifiers(Organization)
+        return self.organizations
+
+    def person_ids(self):
+        if self.persons is None:
+            self.persons = self.load_identifiers(Speaker, Speaker.objects.filter(instance=self.instance))
+        return self.persons
+
+    def post_ids(self):
+        if self.posts is None:
+            self.posts = self.load_identifiers(Post)
+        return self.posts
 
     def import_organizations(self):
+        organizations = self.organization_ids()
         for data in self.get('organizations'):
             # Other fields that could be in defaults:
             # parent dissolution_date founding_date
@@ -164,16 +290,41 @@ class PopoloImporter(object):
                 'name': data['name'][:128],
                 # 'classification': data['classification'],
             }
-            update_object(
+            if data['id'] in organizations:
+                kwargs = {'pk': organizations[data['id']]}
+            else:
+                kwargs = {'identifiers__identifier': data['id']}
+            record, created = update_object(
                 Organization.objects, data, extra=True,
-                identifiers__identifier=data['id'],
-                defaults=defaults
+                defaults=defaults, **kwargs
             )
+            organizations[data['id']] = record.pk
 
     def import_persons(self):
+        """Create or update a speaker for each person, with their sources,
+        links, identifiers and other names. Everything the instance already
+        has is loaded up front and compared with the people in memory, so
+        only what has changed is written, with the related rows in bulk."""
         created_count = 0
         refreshed_count = 0
 
+        speakers = Speaker.objects.filter(instance=self.instance)
+        speaker_ids = speakers.order_by().values('pk')
+        content_type = ContentType.objects.get_for_model(Speaker)
+        identifiers = GenericRows(Identifier, content_type, speaker_ids, ('identifier', 'scheme'))
+        related = (
+            identifiers,
+            GenericRows(OtherName, content_type, speaker_ids, ('name',), ('note',)),
+            GenericRows(Link, content_type, speaker_ids, ('url',), ('note',)),
+            GenericRows(Source, content_type, speaker_ids, ('url',), ('note',)),
+        )
+        other_names, links, sources = related[1:]
+
+        speakers = dict((speaker.pk, speaker) for speaker in speakers)
+        by_identifier = {}
+        for object_id, identifier, scheme in sorted(identifiers.rows):
+            by_identifier.setdefault(identifier, speakers[object_id])
+
         for data in self.get('persons'):
             # Other fields that could be in defaults:
             # additional_name honorific_prefix/suffix patronymic_name
@@ -186,26 +337,49 @@ class PopoloImporter(object):
                 'email': data.get('email'),
                 'image': data.get('image'),
             }
-            record, created = update_object(
-                Speaker.objects, data, extra=True,
-                instance=self.instance, identifiers__identifier=data['id'],
-                defaults=defaults
-            )
 
-            if created:
+            record = by_identifier.get(data['id'])
+            if record is None:
+                record = Speaker(instance=self.instance, **defaults)
+                record.save()
+                by_identifier[data['id']] = record
                 created_count += 1
             else:
+                if any(getattr(record, k) != v for k, v in six.iteritems(defaults)):
+                    for k, v in six.iteritems(defaults):
+                        setattr(record, k, v)
+                    record.save()
                 refreshed_count += 1
 
+            for item in data.get('sources', []):
+                sources.set(record.pk, url=item['url'], note=item.get('note', ''))
+            for item in data.get('links', []):
+                links.set(record.pk, url=item['url'], note=item.get('note', ''))
+            identifiers.set(record.pk, identifier=data['id'], scheme='Popolo')
+            for i in data.get('identifiers', []):
+                identifiers.set(record.pk, identifier=i['identifier'], scheme=i.get('scheme', ''))
+            for name in data.get('other_names', []):
+                other_names.set(record.pk, name=name['name'], note=name.get('note', ''))
+
+        for rows in related:
+            rows.save()
+
+        self.persons = dict((identifier, speaker.pk) for identifier, speaker in by_identifier.items())
         return {'created': created_count, 'refreshed': refreshed_count}
 
     def import_posts(self):
-        self.posts = {}
+        organizations = self.organization_ids()
+        posts = self.post_ids()
         for data in self.get('posts'):
+            if data['organization_id'] not in organizations:
+                logger.info(
+                    'Skipping post %s of unknown organization %s' %
+                    (data.get('id', data['label']), data['organization_id']))
+                continue
+
             defaults = {
                 'role': data['role'],
-                'organization': Organization.objects.get(
-                    identifiers__identifier=data['organization_id']),
+                'organization_id': organizations[data['organization_id']],
                 'start_date': data.get('start_date', None),
                 'end_date': data.get('end_date', None),
             }
@@ -215,10 +389,35 @@ class PopoloImporter(object):
                 defaults=defaults
             )
             if 'id' in data:
-                self.posts[data['id']] = record
+                # Post has no identifiers relation, but the rows are generic
+                # all the same, so later runs can look the post up by its id
+                Identifier.objects.get_or_create(
+                    content_type=ContentType.objects.get_for_model(Post),
+                    object_id=record.pk,
+                    identifier=data['id'],
+                    defaults={'scheme': 'Popolo'},
+                )
+                posts[data['id']] = record.pk
 
     def import_memberships(self):
+        """Create or update each membership. The organizations, people and
+        posts they refer to are looked up in maps loaded once, rather than
+        for each membership, and new memberships are written in batches."""
         skipped_count = 0
+        organizations = self.organization_ids()
+        persons = self.person_ids()
+        posts = self.post_ids()
+
+        # XXX This uniqueness will fail for e.g. someone with multiple
+        # memberships at the same organisation that don't have posts
+        def key(membership):
+            return (membership.person_id, membership.organization_id, membership.post_id)
+
+        memberships = {}
+        for membership in Membership.objects.filter(person__in=set(persons.values())).order_by('id'):
+            memberships.setdefault(key(membership), membership)
+        created = []
+        related = []
 
         for data in self.get('memberships'):
             # Other fields that could be in defaults:
@@ -241,25 +440,70 @@ class PopoloImporter(object):
                 skipped_count += 1
                 continue
 
-            # XXX This uniqueness will fail for e.g. someone with multiple
-            # memberships at the same organisation that don't have posts
-            kwargs = {
-                'organization': Organization.objects.get(
-                    identifiers__identifier=data['organization_id']),
-                'person': Speaker.objects.get(
-                    identifiers__identifier=data['person_id']),
-            }
+            if data['organization_id'] not in organizations or data['person_id'] not in persons:
+                logger.info(
+                    'Skipping membership %s of unknown organization or person' %
+                    data['id'])
+                skipped_count += 1
+                continue
 
-            if data.get('post_id'):
-                kwargs['post'] = self.posts[data['post_id']]
+            if data.get('post_id') and data['post_id'] not in posts:
+                logger.info(
+                    'Skipping membership %s of unknown post %s' %
+                    (data['id'], data['post_id']))
+                skipped_count += 1
+                continue
 
-            update_object(
-                Membership.objects, data,
-                defaults=defaults, **kwargs
+            membership = Membership(
+                organization_id=organizations[data['organization_id']],
+                person_id=persons[data['person_id']],
+                post_id=posts.get(data.get('post_id')),
+                **defaults
             )
+            existing = memberships.get(key(membership))
+            if existing is None:
+                memberships[key(membership)] = membership
+                created.append(membership)
+                if len(created) >= self.batch_size:
+                    self.create_memberships(created, memberships, key)
+                    created = []
+            elif any(getattr(existing, k) != v for k, v in defaults.items()):
+                for k, v in defaults.items():
+                    setattr(existing, k, v)
+                # One still waiting to be created will be with these values
+                if existing.pk is not None:
+                    existing.save()
+
+            if data.get('links') or data.get('sources'):
+                related.append((key(membership), data.get('links', []), data.get('sources', [])))
+
+        self.create_memberships(created, memberships, key)
+
+        if related:
+            content_type = ContentType.objects.get_for_model(Membership)
+            membership_ids = [memberships[k].pk for k, links, sources in related]
+            links = GenericRows(Link, content_type, membership_ids, ('url',), ('note',))
+            sources = GenericRows(Source, content_type, membership_ids, ('url',), ('note',))
+            for k, link_data, source_data in related:
+                for item in link_data:
+                    links.set(memberships[k].pk, url=item['url'], note=item.get('note', ''))
+                for item in source_data:
+                    sources.set(memberships[k].pk, url=item['url'], note=item.get('note', ''))
+            links.save()
+            sources.save()
 
         logger.info(
-            'Skipped %d records for not having an organization' % skipped_count)
+            'Skipped %d records for not having a known organization, person and post' % skipped_count)
+
+    def create_memberships(self, created, memberships, key):
+        Membership.objects.bulk_create(created, batch_size=self.batch_size)
+        if any(membership.pk is None for membership in created):
+            # This database doesn't return the ids of rows inserted in bulk
+            people = set(membership.person_id for membership in created)
+            for membership in Membership.objects.filter(person__in=people).order_by('id'):
+                existing = memberships.get(key(membership))
+                if existing is not None and existing.pk is None:
+                    memberships[key(membership)] = membership
 
     def import_all(self):
         # Organizations, posts, and memberships in django-popolo are
@@ -5,3 +5,9 @@ from speeches.importers.import_akomantoso import ImportAkomaNtoso
 class Command(ImportCommand):
     importer_class = ImportAkomaNtoso
     document_extension = 'xml'
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--stream', action='store_true',
+            help='Import each document as it is parsed, rather than loading it all first')
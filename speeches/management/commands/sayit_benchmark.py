@@ -0,0 +1,146 @@
+import functools
+import shutil
+import tempfile
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+
+from instances.models import Instance
+from speeches.importers.import_akomantoso import ImportAkomaNtoso
+from speeches.importers.import_popolo import PopoloImporter
+from speeches.management.commands.sayit_generate_corpus import Command as GenerateCorpusCommand
+from speeches.models import Section, Speaker
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+
+class Measurement(object):
+    """Times what is run within it, counting the database queries made and
+    how many rows it dealt with, and if trace_memory is set the peak memory
+    allocated. Tracing allocations slows everything down, so times taken
+    with it are not comparable with those taken without."""
+
+    def __init__(self, name, trace_memory=False):
+        self.name = name
+        self.rows = 0
+        self.trace_memory = trace_memory and tracemalloc is not None
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.queries = 0
+        if hasattr(connection, 'execute_wrapper'):
+            self.query_context = connection.execute_wrapper(self.count_query)
+        else:
+            self.query_context = CaptureQueriesContext(connection)
+        self.query_context.__enter__()
+        if self.trace_memory:
+            tracemalloc.start()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.time() - self.start
+        self.peak_memory = None
+        if self.trace_memory:
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.query_context.__exit__(exc_type, exc_value, traceback)
+        if isinstance(self.query_context, CaptureQueriesContext):
+            self.queries = len(self.query_context)
+
+    def __str__(self):
+        return '%-12s %9d rows %9.2fs %11.1f rows/s %8d queries %11s peak' % (
+            self.name, self.rows, self.seconds, self.rows / self.seconds if self.seconds else 0,
+            self.queries, '%.1fMB' % (self.peak_memory / 1024.0 / 1024) if self.peak_memory is not None else '-')
+
+
+class Command(GenerateCorpusCommand):
+    help = 'Time imports of a synthetic corpus, and the pages showing what was imported'
+
+    def add_arguments(self, parser):
+        self.add_corpus_arguments(parser)
+        parser.add_argument(
+            '--instance', default='sayit-benchmark',
+            help='Label of the instance to import into')
+        parser.add_argument(
+            '--pages', type=int, default=5,
+            help='How many section and speaker pages to fetch')
+        parser.add_argument(
+            '--bulk', action='store_true',
+            help='Whether to import speeches in batches, rather than one at a time')
+        parser.add_argument(
+            '--stream', action='store_true',
+            help='Whether to import each debate as it is parsed, rather than loading it all first')
+        parser.add_argument(
+            '--commit', action='store_true',
+            help='Whether to keep what was imported, rather than rolling it back afterwards')
+        parser.add_argument(
+            '--memory', action='store_true',
+            help='Whether to also measure peak memory, which makes everything slower (Python 3 only)')
+
+    def handle(self, *args, **options):
+        corpus_dir = tempfile.mkdtemp(prefix='sayit_corpus')
+        try:
+            popolo_path, paths = self.get_generator(**options).write(corpus_dir)
+            with transaction.atomic():
+                self.instance, _ = Instance.objects.get_or_create(label=options['instance'])
+                for measurement in self.run(popolo_path, paths, **options):
+                    self.stdout.write('%s\n' % measurement)
+                transaction.set_rollback(not options['commit'])
+        finally:
+            shutil.rmtree(corpus_dir)
+
+    def run(self, popolo_path, paths, **options):
+        """Yield a Measurement of each thing timed."""
+        measure = functools.partial(Measurement, trace_memory=options['memory'])
+
+        with measure('popolo') as measurement:
+            result = PopoloImporter(popolo_path, instance=self.instance).import_persons()
+            measurement.rows = result['created'] + result['refreshed']
+        yield measurement
+
+        with measure('akomantoso') as measurement:
+            for path in paths:
+                importer = ImportAkomaNtoso(
+                    instance=self.instance, commit=True, bulk=options['bulk'], stream=options['stream'])
+                measurement.rows += sum(importer.import_document(path).values())
+        yield measurement
+
+        sections = list(Section.objects.filter(instance=self.instance, parent=None)[:options['pages']])
+        with measure('section') as measurement:
+            for section in sections:
+                self.get_page(section.get_absolute_url())
+                measurement.rows += section.subtree_speech_count
+        yield measurement
+
+        speakers = list(Speaker.objects.filter(instance=self.instance)[:options['pages']])
+        with measure('speaker') as measurement:
+            for speaker in speakers:
+                response = self.get_page(speaker.get_absolute_url())
+                measurement.rows += len(response.context_data['page_obj'].object_list)
+        yield measurement
+
+    def get_page(self, path):
+        """Fetch a page as an anonymous visitor, rendering all of it."""
+        request = RequestFactory().get(path)
+        request.instance = self.instance
+        request.is_user_instance = False
+        request.user = AnonymousUser()
+        match = resolve(path)
+        response = match.func(request, *match.args, **match.kwargs)
+        if response.streaming:
+            for chunk in response.streaming_content:
+                pass
+        else:
+            response.render()
+        return response
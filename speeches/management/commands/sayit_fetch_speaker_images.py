@@ -0,0 +1,35 @@
+from django.utils.translation import ugettext_lazy as _
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+
+from instances.models import Instance
+from speeches.models import Speaker
+
+
+class Command(BaseCommand):
+    help = _("Store local copies of speakers' images that have not been fetched yet")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--instance',
+            help='Label of the instance whose speakers to fetch the images of (default: all)')
+        parser.add_argument(
+            '--refresh', action='store_true',
+            help='Also check whether images already fetched have changed')
+
+    def handle(self, *args, **options):
+        speakers = Speaker.objects.exclude(image=None).exclude(image='').select_related('instance')
+        if options['instance']:
+            try:
+                speakers = speakers.filter(instance=Instance.objects.get(label=options['instance']))
+            except Instance.DoesNotExist:
+                raise CommandError('There is no instance with label %s' % options['instance'])
+        if not options['refresh']:
+            speakers = speakers.exclude(image_cache_url=F('image'), image_cache__gt='')
+
+        changed = 0
+        for speaker in speakers.iterator():
+            changed += speaker.fetch_image(refresh=options['refresh'])
+
+        if options['verbosity'] > 1:
+            self.stdout.write('Stored %d new images\n' % changed)
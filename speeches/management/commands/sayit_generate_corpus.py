@@ -0,0 +1,64 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from speeches.utils.corpus import CorpusGenerator
+
+
+class Command(BaseCommand):
+    help = 'Generate synthetic Akoma Ntoso debates, and a Popolo file of their speakers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_dir', help='The directory to write the corpus into')
+        self.add_corpus_arguments(parser)
+
+    def add_corpus_arguments(self, parser):
+        parser.add_argument(
+            '--documents', type=int, default=1,
+            help='How many debates to generate')
+        parser.add_argument(
+            '--depth', type=int, default=2,
+            help='How many levels of sections to nest within each debate')
+        parser.add_argument(
+            '--fan-out', type=int, default=3,
+            help='How many sections to put within each section')
+        parser.add_argument(
+            '--speeches', type=int, default=10,
+            help='How many speeches to put directly within each section')
+        parser.add_argument(
+            '--speakers', type=int, default=50,
+            help='How many people to generate')
+        parser.add_argument(
+            '--paragraphs', type=int, default=2,
+            help='How many paragraphs to put in each speech')
+        parser.add_argument(
+            '--words', type=int, default=40,
+            help='How many words to put in each paragraph')
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='The seed of the random choices; the same seed gives the same corpus')
+
+    def get_generator(self, **options):
+        return CorpusGenerator(
+            documents=options['documents'],
+            depth=options['depth'],
+            fan_out=options['fan_out'],
+            speeches=options['speeches'],
+            speakers=options['speakers'],
+            paragraphs=options['paragraphs'],
+            words=options['words'],
+            seed=options['seed'],
+        )
+
+    def handle(self, *args, **options):
+        output_dir = options['output_dir']
+        if not os.path.isdir(output_dir):
+            raise CommandError('%s is not a directory' % output_dir)
+
+        generator = self.get_generator(**options)
+        popolo_path, paths = generator.write(output_dir)
+        if options['verbosity'] > 0:
+            self.stdout.write(
+                'Wrote %d debates of %d sections and %d speeches each, and %d people in %s\n' % (
+                    len(paths), generator.section_count(), generator.speech_count(),
+                    generator.speakers, popolo_path))
@@ -2,6 +2,7 @@ from django.core.management.base import BaseCommand, CommandError
 
 from instances.models import Instance
 from speeches.importers.import_popolo import PopoloImporter
+from speeches.models import speaker_images
 
 
 class Command(BaseCommand):
@@ -29,3 +30,6 @@ class Command(BaseCommand):
 
         importer = PopoloImporter(base_url, instance=instance)
         importer.import_all()
+
+        # Wait for the speakers' images to be fetched
+        speaker_images.join()
@@ -0,0 +1,17 @@
+from django.utils.translation import ugettext_lazy as _
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from speeches.models import Section, Speech
+
+
+class Command(BaseCommand):
+    help = _('Rebuild the stored tree and slug paths, speech aggregates and positions of all sections and speeches')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            Section.objects.rebuild_tree_paths()
+            Section.objects.rebuild_slug_paths()
+            Section.objects.rebuild_speech_aggregates()
+            Section.objects.rebuild_positions()
+            Speech.objects.rebuild_positions()
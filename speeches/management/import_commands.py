@@ -1,12 +1,15 @@
 import json
 import logging
+import multiprocessing
 import os
+import time
 import traceback
-from optparse import make_option
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
 
 from instances.models import Instance
+from speeches.importers.import_base import SpeakerResolver
 
 logger = logging.getLogger(__name__)
 
@@ -15,39 +18,66 @@ def _stats_pretty(stats):
     return ' '.join(["%s:%d" % (cls.__name__, n) for cls, n in stats.items()])
 
 
+# The command and options each process of an import pool was forked with
+_worker = None
+
+
+def _init_worker(command, options):
+    global _worker
+    _worker = (command, options)
+
+
+def _import_in_worker(paths):
+    command, options = _worker
+    return command.import_batch(paths, **options)
+
+
 class ImportCommand(BaseCommand):
 
     importer_class = None
     document_extension = ''
 
-    option_list = BaseCommand.option_list + (
-        make_option('--commit', action='store_true', help='Whether to commit to the database or not'),
-        make_option('--instance', action='store', help='Label of instance to add data to'),
-        make_option('--file', action='store', help='document to import'),
-        make_option('--dir', action='store', help='directory of documents to import'),
-        make_option(
+    def add_arguments(self, parser):
+        parser.add_argument('--commit', action='store_true', help='Whether to commit to the database or not')
+        parser.add_argument('--instance', action='store', help='Label of instance to add data to')
+        parser.add_argument('--file', action='store', help='document to import')
+        parser.add_argument('--dir', action='store', help='directory of documents to import')
+        parser.add_argument(
             '--no-verify', action='store_false', default=True, dest='verify',
-            help='Whether to verify SSL certificates or not'),
-        make_option(
+            help='Whether to verify SSL certificates or not')
+        parser.add_argument(
             '--start-date', action='store', default='',
-            help='earliest date to process, in yyyy-mm-dd format'),
-        make_option(
+            help='earliest date to process, in yyyy-mm-dd format')
+        parser.add_argument(
             '--dump-users', action='store', default='',
-            help='dump a json list to <file> (only valid with --dir for now)'),
-        make_option(
+            help='dump a json list to <file> (only valid with --dir for now)')
+        parser.add_argument(
             '--clobber-existing', action='store_const', const='replace', dest='clobber',
-            help='Whether to replace sections with the same heading'),
-        make_option(
+            help='Whether to replace sections with the same heading')
+        parser.add_argument(
             '--skip-existing', action='store_const', const='skip', dest='clobber',
-            help='Whether to skip sections with the same heading'),
-        make_option(
+            help='Whether to skip sections with the same heading')
+        parser.add_argument(
             '--merge-existing', action='store_const', const='merge', dest='clobber',
-            help='Whether to merge sections with the same heading'),
-        )
+            help='Whether to merge sections with the same heading')
+        parser.add_argument(
+            '--update-existing', action='store_const', const='update', dest='clobber',
+            help='Whether to skip unchanged documents and sections, and replace changed ones')
+        parser.add_argument(
+            '--bulk', action='store_true',
+            help='Whether to insert speeches in batches, rather than one at a time')
+        parser.add_argument(
+            '--jobs', action='store', type=int, default=1,
+            help='How many documents to import at once, in separate processes (only valid with --dir)')
+        parser.add_argument(
+            '--batch', action='store', type=int, default=1,
+            help='How many documents to import in each transaction, each still imported entirely or not at all '
+                 '(only valid with --dir)')
+        parser.add_argument(
+            '--metrics', action='store', default='',
+            help='write JSON lines of metrics of each document, and of the whole import, to <file> (- for stdout)')
 
     def handle(self, *args, **options):
-        verbosity = int(options['verbosity'])
-
         if options['commit']:
             if not options['instance']:
                 raise CommandError("You must specify an instance")
@@ -55,28 +85,42 @@ class ImportCommand(BaseCommand):
         else:
             instance = Instance(label=options['instance'])
         options['instance'] = instance
+        # Shared by all the documents imported (by each process, with --jobs)
+        options['speaker_resolver'] = SpeakerResolver(instance)
+
+        self.open_metrics(options['metrics'])
+        try:
+            self.import_all(**options)
+        finally:
+            self.close_metrics()
+
+    def import_all(self, **options):
+        verbosity = int(options['verbosity'])
 
         if options['file']:
             filename = os.path.expanduser(options['file'])
-            (stats, speakers) = self.import_document(filename, **options)
+            (stats, speakers, metrics) = self.import_document(filename, **options)
+            self.write_metrics(metrics)
             if verbosity > 1 and stats:
                 logger.info("Imported %s\n\n" % _stats_pretty(stats))
+            self.report_failures()
         elif options['dir']:
             files = sorted(self.document_list(options))
 
             if len(files):
                 speakers = {}
-                for f in files:
-                    (stats, spkrs) = self.import_document(f, **options)
+                for f, (stats, spkrs, metrics) in zip(files, self.import_documents(files, **options)):
+                    self.write_metrics(metrics)
                     speakers.update(spkrs)
 
                     if verbosity > 1 and stats:
                         logger.info("%s: Imported %s\n" % (f, _stats_pretty(stats)))
+                self.report_failures()
 
                 dump_users = os.path.expanduser(options['dump_users'])
                 if dump_users:
                     out = open(dump_users, 'w')
-                    speakers_list = [(k, speakers[k]) for k in speakers]
+                    speakers_list = [(k, speakers[k].name) for k in speakers]
                     out.write(json.dumps(speakers_list, indent=4))
 
                     if verbosity > 1:
@@ -86,6 +130,57 @@ class ImportCommand(BaseCommand):
         else:
             logger.info(self.help)
 
+    def open_metrics(self, path):
+        """Start recording metrics, to be written to the file at path, or to
+        standard output if it is -, or not at all if it is empty."""
+        self.start_time = time.time()
+        self.totals = {'documents': 0, 'failed': 0, 'rows': {}}
+        self.failures = []
+        if path == '-':
+            self.metrics_file = self.stdout
+        elif path:
+            self.metrics_file = open(os.path.expanduser(path), 'w')
+        else:
+            self.metrics_file = None
+
+    def write_metrics(self, metrics):
+        """Add the metrics of a document import to the totals, and write
+        them out as a line of JSON straight away."""
+        self.totals['documents'] += 1
+        if metrics['error']:
+            self.totals['failed'] += 1
+            self.failures.append((metrics['path'], metrics['error']))
+        for key, value in metrics.items():
+            if key == 'rows':
+                for name, n in value.items():
+                    self.totals['rows'][name] = self.totals['rows'].get(name, 0) + n
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.totals[key] = self.totals.get(key, 0) + value
+
+        self.write_metrics_line(dict(metrics, event='document'))
+
+    def write_metrics_line(self, data):
+        if self.metrics_file is None:
+            return
+        self.metrics_file.write(json.dumps(data, sort_keys=True) + '\n')
+        self.metrics_file.flush()
+
+    def report_failures(self):
+        if self.failures:
+            logger.error("Failed to import %d of %d documents, which were rolled back:\n%s\n" % (
+                len(self.failures), self.totals['documents'],
+                '\n'.join('%s: %s' % failure for failure in self.failures)))
+
+    def close_metrics(self):
+        """Write out the totals of the whole import. The time taken is that
+        of the whole import, not the sum of those of the documents, as they
+        may have been imported at once."""
+        self.write_metrics_line(dict(
+            self.totals, event='total', seconds=round(time.time() - self.start_time, 6),
+            document_seconds=round(self.totals.get('seconds', 0), 6)))
+        if self.metrics_file not in (None, self.stdout):
+            self.metrics_file.close()
+
     def document_list(self, options):
         dir = os.path.expanduser(options['dir'])
 
@@ -103,6 +198,40 @@ class ImportCommand(BaseCommand):
                 for filename in files
                 if filename[-4:] == '.%s' % self.document_extension and valid(filename)]
 
+    def import_documents(self, paths, **options):
+        """Import each of the documents, yielding the results of
+        import_document in the same order. They are imported a batch at a
+        time, each batch in one transaction and each document of it in a
+        savepoint, so there are fewer commits but a document that fails
+        still doesn't affect the rest. With more than one job, the batches
+        are shared among a pool of processes."""
+        jobs = options.get('jobs') or 1
+        batch = max(options.get('batch') or 1, 1)
+        batches = [paths[i:i + batch] for i in range(0, len(paths), batch)]
+        if jobs <= 1 or len(batches) <= 1:
+            for paths in batches:
+                for result in self.import_batch(paths, **options):
+                    yield result
+            return
+
+        # The processes must not share the database connection
+        connections.close_all()
+        pool = multiprocessing.Pool(jobs, _init_worker, (self, options))
+        try:
+            for results in pool.imap(_import_in_worker, batches):
+                for result in results:
+                    yield result
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def import_batch(self, paths, **options):
+        """Import the documents in one transaction, returning the results of
+        import_document for each."""
+        with transaction.atomic():
+            return [self.import_document(path, **options) for path in paths]
+
     def document_valid(self, path):
         return os.path.isfile(path)
 
@@ -121,10 +250,18 @@ class ImportCommand(BaseCommand):
         importer = self.importer_class(**options)
 
         try:
-            importer.import_document(path)
+            # Each document is imported entirely or not at all, in its own
+            # transaction, or in a savepoint of that of its batch.
+            with importer.metrics.measure(), transaction.atomic():
+                importer.import_document(path)
         except Exception as e:
+            importer.speaker_resolver.rolled_back()
             logger.error("An exception of type %s occurred, arguments:\n%s\n%s" % (
                 type(e).__name__, e, traceback.format_exc()))
-            return (None, {})
+            # Nothing was created, as it was all rolled back
+            metrics = dict(importer.metrics.as_dict(), path=path, error='%s: %s' % (type(e).__name__, e))
+            return (None, {}, metrics)
 
-        return (importer.stats, importer.speakers)
+        importer.speaker_resolver.committed()
+        metrics = dict(importer.metrics.as_dict(importer.stats), path=path, error=None)
+        return (importer.stats, importer.speakers, metrics)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('speeches', '0002_auto_20151112_2003'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='section',
+            name='tree_path',
+            field=models.TextField(verbose_name='tree path', blank=True, db_index=True, editable=False, default=''),
+            preserve_default=False,
+        ),
+        migrations.RunSQL(
+            """
+            WITH RECURSIVE cte AS (
+                SELECT id, lpad(id::text, 10, '0') || '/' AS tree_path
+                FROM speeches_section WHERE parent_id IS NULL
+                UNION ALL
+                SELECT s.id, cte.tree_path || lpad(s.id::text, 10, '0') || '/'
+                FROM cte JOIN speeches_section s ON s.parent_id = cte.id
+            )
+            UPDATE speeches_section SET tree_path = cte.tree_path
+            FROM cte WHERE speeches_section.id = cte.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
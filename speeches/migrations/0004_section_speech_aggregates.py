@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('speeches', '0003_section_tree_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='section',
+            name='speech_count',
+            field=models.IntegerField(verbose_name='speech count', default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='section',
+            name='subtree_speech_count',
+            field=models.IntegerField(verbose_name='subtree speech count', default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='section',
+            name='subtree_speech_min',
+            field=models.DateTimeField(verbose_name='earliest subtree speech', blank=True, null=True, editable=False),
+        ),
+        migrations.RunSQL(
+            """
+            WITH own AS (
+                SELECT section_id AS id, COUNT(*) AS n,
+                    MIN(start_date + COALESCE(start_time, time '00:00')) AS m
+                FROM speeches_speech WHERE section_id IS NOT NULL GROUP BY section_id
+            ), subtree AS (
+                SELECT a.id, SUM(own.n) AS n, MIN(own.m) AS m
+                FROM own JOIN speeches_section c ON c.id = own.id,
+                    unnest(string_to_array(rtrim(c.tree_path, '/'), '/')::integer[]) AS a(id)
+                GROUP BY a.id
+            )
+            UPDATE speeches_section SET
+                speech_count = COALESCE(own.n, 0),
+                subtree_speech_count = COALESCE(subtree.n, 0),
+                subtree_speech_min = subtree.m
+            FROM speeches_section t
+                LEFT JOIN own ON own.id = t.id
+                LEFT JOIN subtree ON subtree.id = t.id
+            WHERE speeches_section.id = t.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
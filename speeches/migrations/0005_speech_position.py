@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('speeches', '0004_section_speech_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='speech',
+            name='position',
+            field=models.IntegerField(verbose_name='position', default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='speech',
+            index=models.Index(fields=['section', 'position'], name='speeches_sp_section_pos_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='speech',
+            index=models.Index(fields=['instance', 'section', 'position'], name='speeches_sp_inst_sec_pos_idx'),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE speeches_speech SET position = o.position
+            FROM (
+                SELECT id, row_number() OVER (
+                    PARTITION BY instance_id, section_id ORDER BY start_date, start_time, id
+                ) - 1 AS position
+                FROM speeches_speech
+            ) o
+            WHERE speeches_speech.id = o.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('speeches', '0005_speech_position'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='section',
+            name='position',
+            field=models.IntegerField(verbose_name='position', default=0, editable=False),
+        ),
+        migrations.AlterIndexTogether(
+            name='section',
+            index_together=set([('parent', 'position')]),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE speeches_section SET position = o.position
+            FROM (
+                SELECT s.id, row_number() OVER (
+                    PARTITION BY s.parent_id
+                    ORDER BY COALESCE(s.subtree_speech_min, p.subtree_speech_min), s.id
+                ) - 1 AS position
+                FROM speeches_section s JOIN speeches_section p ON p.id = s.parent_id
+            ) o
+            WHERE speeches_section.id = o.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
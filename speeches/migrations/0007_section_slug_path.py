@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('speeches', '0006_section_position'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='section',
+            name='slug_path',
+            field=models.TextField(verbose_name='slug path', blank=True, editable=False),
+        ),
+        migrations.AlterIndexTogether(
+            name='section',
+            index_together=set([('parent', 'position'), ('instance', 'slug_path')]),
+        ),
+        migrations.RunSQL(
+            """
+            WITH RECURSIVE cte AS (
+                SELECT id, slug::text AS slug_path
+                FROM speeches_section WHERE parent_id IS NULL
+                UNION ALL
+                SELECT s.id, cte.slug_path || '/' || s.slug
+                FROM cte JOIN speeches_section s ON s.parent_id = cte.id
+            )
+            UPDATE speeches_section SET slug_path = cte.slug_path
+            FROM cte WHERE speeches_section.id = cte.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('speeches', '0007_section_slug_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='section',
+            name='content_hash',
+            field=models.CharField(verbose_name='content hash', max_length=40, blank=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('speeches', '0008_section_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='speaker',
+            name='image_cache_url',
+            field=models.URLField(verbose_name='image_cache URL', blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='speaker',
+            name='image_etag',
+            field=models.CharField(verbose_name='image_cache ETag', max_length=256, blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='speaker',
+            name='image_hash',
+            field=models.CharField(verbose_name='image_cache hash', max_length=40, blank=True, editable=False),
+        ),
+        # Images already cached were fetched from the current image URL
+        migrations.RunSQL(
+            """
+            UPDATE speeches_speaker SET image_cache_url = popolo_person.image
+            FROM popolo_person
+            WHERE speeches_speaker.person_ptr_id = popolo_person.id
+            AND speeches_speaker.image_cache <> '' AND popolo_person.image IS NOT NULL
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
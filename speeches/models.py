@@ -1,21 +1,32 @@
 import calendar
 import datetime
 import hashlib
+import heapq
 import logging
+import operator
 import os
+import re
+import uuid
+from functools import reduce
+from itertools import islice
+import requests
 from six.moves.urllib.parse import urlsplit
-from six.moves.urllib.request import urlretrieve
-from six.moves.urllib.error import HTTPError
 
+import django
 from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _, ugettext
-from django.db import models
-from django.db.models import Q
+from django.db import connection, models, transaction
+from django.db.models import Case, F, Q, Value, When, prefetch_related_objects
+from django.db.models.functions import Coalesce, Concat, Length, Substr
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.html import strip_tags
 from django.template.defaultfilters import timesince
 from django.conf import settings
+from django.core.cache import caches
 from django.core.files import File
+from django.core.files.base import ContentFile
 from django.core.exceptions import ValidationError
 from django.contrib.contenttypes.fields import GenericRelation
 from django.utils.encoding import python_2_unicode_compatible
@@ -25,6 +36,7 @@ from easy_thumbnails.alias import aliases
 
 from instances.models import InstanceMixin, InstanceManager
 from speeches.utils.audio import AudioHelper
+from speeches.utils.background import BackgroundQueue
 from speeches.utils.text import url_to_unicode
 
 from popolo.models import Person
@@ -43,6 +55,136 @@ max_date = datetime.date(datetime.MAXYEAR, 12, 31)
 max_time = datetime.time(23, 59)
 max_datetime = datetime.datetime.combine(max_date, max_time)
 
+# Each step of a Section's tree_path is its zero-padded ID and a separator, so
+# that ordering by path matches a depth-first, ID-ordered walk of the tree.
+TREE_PATH_STEP = '%010d/'
+TREE_PATH_STEP_LENGTH = 11
+
+REBUILD_TREE_PATHS_SQL = """
+    WITH RECURSIVE cte AS (
+        SELECT id, lpad(id::text, 10, '0') || '/' AS tree_path
+        FROM speeches_section WHERE parent_id IS NULL
+        UNION ALL
+        SELECT s.id, cte.tree_path || lpad(s.id::text, 10, '0') || '/'
+        FROM cte JOIN speeches_section s ON s.parent_id = cte.id
+    )
+    UPDATE speeches_section SET tree_path = cte.tree_path
+    FROM cte WHERE speeches_section.id = cte.id AND speeches_section.tree_path <> cte.tree_path
+"""
+
+
+REBUILD_SLUG_PATHS_SQL = """
+    WITH RECURSIVE cte AS (
+        SELECT id, slug::text AS slug_path
+        FROM speeches_section WHERE parent_id IS NULL
+        UNION ALL
+        SELECT s.id, cte.slug_path || '/' || s.slug
+        FROM cte JOIN speeches_section s ON s.parent_id = cte.id
+    )
+    UPDATE speeches_section SET slug_path = cte.slug_path
+    FROM cte WHERE speeches_section.id = cte.id AND speeches_section.slug_path <> cte.slug_path
+"""
+
+REBUILD_SPEECH_AGGREGATES_SQL = """
+    WITH own AS (
+        SELECT section_id AS id, COUNT(*) AS n,
+            MIN(start_date + COALESCE(start_time, time '00:00')) AS m
+        FROM speeches_speech WHERE section_id IS NOT NULL GROUP BY section_id
+    ), subtree AS (
+        SELECT a.id, SUM(own.n) AS n, MIN(own.m) AS m
+        FROM own JOIN speeches_section c ON c.id = own.id,
+            unnest(string_to_array(rtrim(c.tree_path, '/'), '/')::integer[]) AS a(id)
+        GROUP BY a.id
+    )
+    UPDATE speeches_section SET
+        speech_count = COALESCE(own.n, 0),
+        subtree_speech_count = COALESCE(subtree.n, 0),
+        subtree_speech_min = subtree.m
+    FROM speeches_section t
+        LEFT JOIN own ON own.id = t.id
+        LEFT JOIN subtree ON subtree.id = t.id
+    WHERE speeches_section.id = t.id
+"""
+
+SUBTREE_SPEECH_AGGREGATES_SQL = """
+    SELECT COUNT(*), MIN(sp.start_date + COALESCE(sp.start_time, time '00:00'))
+    FROM speeches_speech sp JOIN speeches_section c ON sp.section_id = c.id
+    WHERE c.tree_path LIKE %s
+"""
+
+REBUILD_SECTION_POSITIONS_SQL = """
+    UPDATE speeches_section SET position = o.position
+    FROM (
+        SELECT s.id, row_number() OVER (
+            PARTITION BY s.parent_id
+            ORDER BY COALESCE(s.subtree_speech_min, p.subtree_speech_min), s.id
+        ) - 1 AS position
+        FROM speeches_section s JOIN speeches_section p ON p.id = s.parent_id
+    ) o
+    WHERE speeches_section.id = o.id AND speeches_section.position <> o.position
+"""
+
+REBUILD_SPEECH_POSITIONS_SQL = """
+    UPDATE speeches_speech SET position = o.position
+    FROM (
+        SELECT id, row_number() OVER (
+            PARTITION BY instance_id, section_id ORDER BY start_date, start_time, id
+        ) - 1 AS position
+        FROM speeches_speech {where}
+    ) o
+    WHERE speeches_speech.id = o.id AND speeches_speech.position <> o.position
+"""
+
+
+def tree_path_ids(tree_path):
+    """Return the list of Section IDs, root first, making up a tree_path."""
+    return [int(x) for x in tree_path.split('/') if x]
+
+
+def section_tree_cache():
+    """Return the cache computed section trees are shared through between
+    requests, if SECTION_TREE_CACHE names one, or None."""
+    alias = getattr(settings, 'SECTION_TREE_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def section_tree_version_key(root_id):
+    return 'sayit-section-tree-version-%d' % root_id
+
+
+def section_tree_version(tree_cache, root_id):
+    """Return the current version stamp of the tree under a root Section,
+    starting a new one if there isn't one yet."""
+    key = section_tree_version_key(root_id)
+    tree_cache.add(key, uuid.uuid4().hex, None)
+    return tree_cache.get(key)
+
+
+def bump_section_tree_versions(tree_paths):
+    """Invalidate the cached trees of the documents containing the given
+    tree_paths, by giving their root Sections new version stamps."""
+    tree_cache = section_tree_cache()
+    if tree_cache is None:
+        return
+    root_ids = set(tree_path_ids(path)[0] for path in tree_paths if path)
+    tree_cache.set_many(dict(
+        (section_tree_version_key(root_id), uuid.uuid4().hex) for root_id in root_ids
+    ), None)
+
+
+def speech_min_to_db(value):
+    """Earliest speech times are naive, so are stored as if in UTC to get
+    them back unchanged when time zone support is on."""
+    if value is not None and settings.USE_TZ:
+        value = timezone.make_aware(value, timezone.utc)
+    return value
+
+
+def speech_min_from_db(value):
+    if value is not None and timezone.is_aware(value):
+        value = timezone.make_naive(value, timezone.utc)
+    return value
+
 
 class cache(object):
     '''Computes attribute value and caches it in the instance.
@@ -119,6 +261,9 @@ class Speaker(InstanceMixin, Person):
         blank=True,
         help_text=_('If image is set, a local copy will be stored here.'),
         )
+    image_cache_url = models.URLField(_('image_cache URL'), blank=True, editable=False)
+    image_etag = models.CharField(_('image_cache ETag'), max_length=256, blank=True, editable=False)
+    image_hash = models.CharField(_('image_cache hash'), max_length=40, blank=True, editable=False)
 
     objects = SpeakerManager()
 
@@ -131,37 +276,72 @@ class Speaker(InstanceMixin, Person):
         return self.name
 
     def save(self, *args, **kwargs):
-        if self.image:
-            try:
-                tmp_filename, headers = urlretrieve(self.image)
-
-                max_filename_length = self.image_cache.field.max_length  # Usually 100
-                template_needs = len(self.image_cache_file_path_template % '')
-
-                # We'll use the actual instance label size rather than the maximum that it could be
-                # instance_label_length = self.instance._meta.get_field_by_name('label')[0].max_length
-                instance_label_length = len(self.instance.label)
-                truncate_to = max_filename_length - template_needs - instance_label_length - 8
-
-                image_filename = os.path.basename(urlsplit(self.image).path)
-                image_filename = url_to_unicode(image_filename)
-                filename_root, extension = os.path.splitext(image_filename)
-
-                truncated_filename = filename_root[:(truncate_to - len(extension))] + extension
-
-                self.image_cache.save(
-                    truncated_filename,
-                    File(open(tmp_filename, 'rb')),
+        super(Speaker, self).save(*args, **kwargs)
+
+        # Fetching the image can be slow, so is left until afterwards, in
+        # the background unless SPEAKER_IMAGES_IN_BACKGROUND is False
+        if self.image and self.image != self.image_cache_url:
+            pk = self.pk
+            if getattr(settings, 'SPEAKER_IMAGES_IN_BACKGROUND', True):
+                transaction.on_commit(lambda: speaker_images.put(fetch_speaker_image, pk))
+            else:
+                transaction.on_commit(lambda: fetch_speaker_image(pk))
+
+    def image_cache_filename(self):
+        max_filename_length = self.image_cache.field.max_length  # Usually 100
+        template_needs = len(self.image_cache_file_path_template % '')
+
+        # We'll use the actual instance label size rather than the maximum that it could be
+        # instance_label_length = self.instance._meta.get_field_by_name('label')[0].max_length
+        instance_label_length = len(self.instance.label)
+        truncate_to = max_filename_length - template_needs - instance_label_length - 8
+
+        image_filename = os.path.basename(urlsplit(self.image).path)
+        image_filename = url_to_unicode(image_filename)
+        filename_root, extension = os.path.splitext(image_filename)
+
+        return filename_root[:(truncate_to - len(extension))] + extension
+
+    def fetch_image(self, refresh=False):
+        """Store a local copy of image in image_cache, if it is not the
+        image already stored. With refresh, also check whether the image
+        already stored has changed, only downloading it if the server says
+        it might have (by its ETag), and only storing it again if its
+        content is different. Returns whether image_cache was changed."""
+        if not self.image:
+            return False
+
+        headers = {}
+        if self.image == self.image_cache_url and self.image_cache:
+            if not refresh:
+                return False
+            if self.image_etag:
+                headers['If-None-Match'] = self.image_etag
 
-                    # Calling save on a FieldFile causes a save on the model instance
-                    # we don't need that as we're about to do it below (without this
-                    # we get an infinite recursion).
-                    save=False,
-                    )
-            except HTTPError:
-                pass
-
-        return super(Speaker, self).save(*args, **kwargs)
+        try:
+            response = requests.get(self.image, headers=headers, timeout=60)
+            if response.status_code == 304:
+                return False
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logger.warning('Could not fetch image of speaker %s: %s', self.pk, e)
+            return False
+
+        updates = {
+            'image_cache_url': self.image,
+            'image_etag': response.headers.get('ETag', '')[:256],
+        }
+        image_hash = hashlib.sha1(response.content).hexdigest()
+        changed = image_hash != self.image_hash or not self.image_cache
+        if changed:
+            self.image_cache.save(self.image_cache_filename(), ContentFile(response.content), save=False)
+            updates.update(image_cache=self.image_cache.name, image_hash=image_hash)
+
+        # Update just these fields, so as not to trigger another fetch
+        for field, value in updates.items():
+            setattr(self, field, value)
+        Speaker.objects.filter(pk=self.pk).update(**updates)
+        return changed
 
     image_cache_file_path_template = 'speakers/%s/'
 
@@ -181,6 +361,15 @@ class Speaker(InstanceMixin, Person):
         return reverse('speeches:speaker-edit', kwargs={'pk': self.person_ptr_id})
 
 
+speaker_images = BackgroundQueue('speaker images')
+
+
+def fetch_speaker_image(pk, refresh=False):
+    """Fetch the image of the speaker with this pk, if they still exist."""
+    for speaker in Speaker.objects.filter(pk=pk).select_related('instance'):
+        speaker.fetch_image(refresh=refresh)
+
+
 @python_2_unicode_compatible
 class Tag(InstanceMixin, AuditedModel):
     name = models.CharField(unique=True, max_length=100)
@@ -211,6 +400,179 @@ class SectionManager(InstanceManager):
 
         return section
 
+    def get_by_slug_path(self, instance, slug_path):
+        """Return the Section of the given instance at slug_path. If that is
+        not its current path, because it contains slugs the section or its
+        ancestors used to have, the Section's slug_path will differ from the
+        one given. Raises DoesNotExist if there is no such Section."""
+        try:
+            return self.get(instance=instance, slug_path=slug_path)
+        except self.model.DoesNotExist:
+            pass
+
+        # Fetch every section with a current or historical slug in the
+        # path, and walk down through them.
+        slugs = slug_path.split('/')
+        candidates = self.filter(instance=instance, slugs__slug__in=set(slugs)).annotate(
+            matched_slug=F('slugs__slug'))
+        by_parent_and_slug = {}
+        for section in candidates:
+            key = (section.parent_id, section.matched_slug)
+            # Prefer a section whose current slug it is
+            if key not in by_parent_and_slug or section.slug == section.matched_slug:
+                by_parent_and_slug[key] = section
+        section = None
+        for slug in slugs:
+            section = by_parent_and_slug.get((section and section.id, slug))
+            if section is None:
+                raise self.model.DoesNotExist('No section at %s' % slug_path)
+        return section
+
+    def rebuild_tree_paths(self):
+        """Recompute the stored tree_path of every Section from the parent
+        links, e.g. after rows have been inserted without calling save()."""
+        with connection.cursor() as cursor:
+            cursor.execute(REBUILD_TREE_PATHS_SQL)
+
+    def rebuild_slug_paths(self):
+        """Recompute the stored slug_path of every Section from the parent
+        links and current slugs, e.g. after slugs have been changed in bulk."""
+        with connection.cursor() as cursor:
+            cursor.execute(REBUILD_SLUG_PATHS_SQL)
+
+    def rebuild_speech_aggregates(self):
+        """Recompute the stored speech aggregates of every Section from scratch."""
+        with connection.cursor() as cursor:
+            cursor.execute(REBUILD_SPEECH_AGGREGATES_SQL)
+
+    def refresh_speech_aggregates(self, section_ids):
+        """Recompute the stored speech aggregates of the given Sections and
+        all their ancestors, e.g. after speeches have been moved in bulk."""
+        ids = set()
+        for tree_path in self.filter(id__in=[x for x in section_ids if x]).values_list('tree_path', flat=True):
+            ids.update(tree_path_ids(tree_path))
+        for id, tree_path in self.filter(id__in=ids).values_list('id', 'tree_path'):
+            count, start = self._subtree_speech_aggregates(tree_path)
+            self.filter(id=id).update(
+                speech_count=Speech.objects.filter(section_id=id).count(),
+                subtree_speech_count=count,
+                subtree_speech_min=speech_min_to_db(start),
+            )
+        self.renumber_children(ids)
+
+    def rebuild_positions(self):
+        """Recompute the stored position of every Section among its siblings."""
+        with connection.cursor() as cursor:
+            cursor.execute(REBUILD_SECTION_POSITIONS_SQL)
+
+    def renumber_children(self, section_ids):
+        """Renumber the positions of the children of the given Sections, in
+        order of their earliest speech (with those without any taking their
+        parent's, as in _get_descendants_by_speech), then ID."""
+        section_ids = [x for x in section_ids if x]
+        for parent_id, parent_min in self.filter(id__in=section_ids).values_list('id', 'subtree_speech_min'):
+            children = self.filter(parent_id=parent_id).values_list('id', 'subtree_speech_min', 'position')
+
+            def key(child):
+                start = child[1] or parent_min
+                return (start is None, start, child[0])
+            for position, (id, start, old_position) in enumerate(sorted(children, key=key)):
+                if position != old_position:
+                    self.filter(id=id).update(position=position)
+
+    def place(self, section):
+        """Give a newly saved Section the position renumber_children would,
+        moving later siblings along, without renumbering them all. Having
+        no speeches yet, it takes its parent's earliest speech, and so comes
+        after those siblings that share it (its ID being the highest) and
+        before any starting later."""
+        siblings = self.filter(parent_id=section.parent_id).exclude(id=section.id)
+        parent_min = self.filter(id=section.parent_id).values_list('subtree_speech_min', flat=True)[0]
+        if parent_min is None:
+            position = siblings.count()
+        else:
+            earlier = Q(subtree_speech_min__isnull=True) | Q(subtree_speech_min__lte=parent_min)
+            position = siblings.filter(earlier).count()
+            siblings.filter(position__gte=position).update(position=F('position') + 1)
+        self.filter(id=section.id).update(position=position)
+        section.position = position
+
+    def bump_tree_versions(self, section_ids):
+        """Invalidate any cached trees containing the given Sections."""
+        if section_tree_cache() is None:
+            return
+        section_ids = [x for x in section_ids if x]
+        bump_section_tree_versions(self.filter(id__in=section_ids).values_list('tree_path', flat=True))
+
+    def delete_subtrees(self, sections):
+        """Delete the given Sections, with all the sections and speeches
+        below them, in a few set-based queries rather than one (and a
+        cascade of signals) per row. Returns the IDs deleted, by model, as
+        anything indexing them won't have been told."""
+        if not sections:
+            return {}
+        subtrees = self.filter(reduce(operator.or_, [Q(tree_path__startswith=s.tree_path) for s in sections]))
+        section_ids = list(subtrees.values_list('id', flat=True))
+        parent_ids = set(s.parent_id for s in sections) - set(section_ids)
+        bump_section_tree_versions([s.tree_path for s in sections])
+
+        # _raw_delete skips the fetching and signals of QuerySet.delete(),
+        # so what they'd have done for related rows is done here.
+        speech_ids = Speech.objects.delete_in_sections(section_ids)
+        slugs = Slug.objects.filter_by_model(Section, object_id__in=section_ids)
+        slugs._raw_delete(slugs.db)
+        subtrees._raw_delete(subtrees.db)
+
+        self.refresh_speech_aggregates(parent_ids)
+        return {Section: section_ids, Speech: speech_ids}
+
+    def _subtree_speech_aggregates(self, tree_path):
+        with connection.cursor() as cursor:
+            cursor.execute(SUBTREE_SPEECH_AGGREGATES_SQL, [tree_path + '%'])
+            return cursor.fetchone()
+
+    def _speech_aggregates_delta(self, section_id, delta):
+        tree_path = self.filter(id=section_id).values_list('tree_path', flat=True).first()
+        if not tree_path:
+            return []
+        ids = tree_path_ids(tree_path)
+        self.filter(id__in=ids).update(
+            speech_count=Case(
+                When(id=section_id, then=F('speech_count') + delta),
+                default=F('speech_count'), output_field=models.IntegerField()),
+            subtree_speech_count=F('subtree_speech_count') + delta,
+        )
+        return ids
+
+    def speech_added(self, section_id, start, count=1):
+        """Update the stored aggregates of a Section and its ancestors for a
+        speech starting at `start` (which may be None) being added to it, or
+        for `count` speeches, the earliest starting at `start`."""
+        ids = self._speech_aggregates_delta(section_id, count)
+        if ids and start:
+            start = speech_min_to_db(start)
+            earlier = self.filter(id__in=ids).filter(
+                Q(subtree_speech_min__isnull=True) | Q(subtree_speech_min__gt=start))
+            changed = list(earlier.values_list('id', 'parent_id'))
+            if changed:
+                self.filter(id__in=[id for id, parent_id in changed]).update(subtree_speech_min=start)
+                self.renumber_children(set(x for pair in changed for x in pair))
+
+    def speech_removed(self, section_id, start):
+        """Update the stored aggregates of a Section and its ancestors for a
+        speech starting at `start` (which may be None) being removed from it."""
+        ids = self._speech_aggregates_delta(section_id, -1)
+        if ids and start:
+            # Only subtrees where this was the earliest speech need their
+            # minimum recomputing.
+            stale = self.filter(id__in=ids, subtree_speech_min__gte=speech_min_to_db(start))
+            changed = set()
+            for id, parent_id, tree_path in stale.values_list('id', 'parent_id', 'tree_path'):
+                count, earliest = self._subtree_speech_aggregates(tree_path)
+                self.filter(id=id).update(subtree_speech_min=speech_min_to_db(earliest))
+                changed.update((id, parent_id))
+            self.renumber_children(changed)
+
 
 @python_2_unicode_compatible
 class Section(AuditedModel, InstanceMixin):
@@ -244,6 +606,30 @@ class Section(AuditedModel, InstanceMixin):
         _('slug'), unique_with=('parent', 'instance'), populate_from='title', always_update=True)
     source_url = models.TextField(_('source URL'), blank=True)
 
+    # The IDs of this section and all its ancestors, root first, maintained
+    # on save so that ancestor and subtree lookups need no recursive query.
+    tree_path = models.TextField(_('tree path'), blank=True, db_index=True, editable=False)
+
+    # Speech aggregates, maintained as speeches are added, moved or removed,
+    # so that ordering and rendering a tree need not aggregate speeches.
+    speech_count = models.IntegerField(_('speech count'), default=0, editable=False)
+    subtree_speech_count = models.IntegerField(_('subtree speech count'), default=0, editable=False)
+    subtree_speech_min = models.DateTimeField(
+        _('earliest subtree speech'), blank=True, null=True, editable=False)
+
+    # The order of the section among its siblings, by earliest speech then
+    # ID, counting from 0; maintained alongside the aggregates above.
+    position = models.IntegerField(_('position'), default=0, editable=False)
+
+    # The current slugs of this section and all its ancestors, root first,
+    # joined by slashes, maintained on save so that a URL can be resolved
+    # in one lookup.
+    slug_path = models.TextField(_('slug path'), blank=True, editable=False)
+
+    # For a section made by an import, a hash of what it was imported from,
+    # so that importing that again can leave it alone.
+    content_hash = models.CharField(_('content hash'), max_length=40, blank=True, editable=False)
+
     slugs = GenericRelation(Slug)
 
     class Meta:
@@ -251,6 +637,10 @@ class Section(AuditedModel, InstanceMixin):
         verbose_name_plural = _('sections')
         ordering = ('id',)
         unique_together = ('parent', 'slug', 'instance')
+        index_together = [
+            ('parent', 'position'),
+            ('instance', 'slug_path'),
+        ]
 
     def __str__(self):
         return self.heading or ugettext('Section')
@@ -267,11 +657,55 @@ class Section(AuditedModel, InstanceMixin):
         if not self.num and not self.heading and not self.subheading:
             raise ValidationError(_('You must specify at least one of num/heading/subheading'))
 
+    def save(self, *args, **kwargs):
+        # Look up the stored paths rather than trusting this instance, as an
+        # ancestor may have been moved or renamed since it was loaded.
+        ids = [x for x in (self.id, self.parent_id) if x]
+        stored = Section.objects.filter(id__in=ids).values_list('id', 'tree_path', 'slug_path') if ids else []
+        paths = dict((id, tree_path) for id, tree_path, slug_path in stored)
+        slug_paths = dict((id, slug_path) for id, tree_path, slug_path in stored)
+        old_path = self.tree_path = paths.get(self.id, '')
+        old_slug_path = self.slug_path = slug_paths.get(self.id, '')
+
+        super(Section, self).save(*args, **kwargs)
+
+        tree_path = paths.get(self.parent_id, '') + TREE_PATH_STEP % self.id
+        if tree_path != old_path:
+            if old_path:
+                # Moved, so rewrite the path prefix of the whole subtree, and
+                # recount the speeches of both the old and new ancestors
+                Section.objects.filter(tree_path__startswith=old_path).update(
+                    tree_path=Concat(
+                        Value(tree_path), Substr('tree_path', len(old_path) + 1),
+                        output_field=models.TextField()))
+                Section.objects.refresh_speech_aggregates(tree_path_ids(old_path)[-2:-1] + [self.parent_id])
+            else:
+                Section.objects.filter(id=self.id).update(tree_path=tree_path)
+                if self.parent_id:
+                    Section.objects.place(self)
+            self.tree_path = tree_path
+            if old_path:
+                self.position = Section.objects.filter(id=self.id).values_list('position', flat=True)[0]
+
+        slug_path = '/'.join(filter(None, (slug_paths.get(self.parent_id), self.slug)))
+        if slug_path != old_slug_path:
+            if old_slug_path:
+                # Moved or renamed, so rewrite the descendants' slug paths
+                Section.objects.filter(tree_path__startswith=tree_path).exclude(id=self.id).update(
+                    slug_path=Concat(
+                        Value(slug_path), Substr('slug_path', len(old_slug_path) + 1),
+                        output_field=models.TextField()))
+            Section.objects.filter(id=self.id).update(slug_path=slug_path)
+            self.slug_path = slug_path
+
     def speech_datetimes(self):
         return (datetime.datetime.combine(s.start_date, s.start_time or datetime.time(0, 0))
                 for s in self.speech_set.all())
 
     def is_leaf_node(self):
+        # Already known for sections from get_descendants_tree
+        if hasattr(self, '_is_leaf'):
+            return self._is_leaf
         return not self.children.exists()
 
     @cache
@@ -295,42 +729,31 @@ class Section(AuditedModel, InstanceMixin):
             # Shortcut when we know there's no parent
             s = [self]
         else:
-            dir = ascending and 'ASC' or 'DESC'
-            s = Section.objects.raw(
-                """WITH RECURSIVE cte AS (
-                    SELECT speeches_section.*, 1 AS l FROM speeches_section WHERE id=%s
-                    UNION ALL
-                    SELECT s.*, l+1 FROM cte JOIN speeches_section s ON cte.parent_id = s.id
-                )
-                SELECT * FROM cte ORDER BY l """ + dir,
-                [self.id]
-            )
+            ids = tree_path_ids(self.tree_path)
+            if ascending:
+                ids.reverse()
+            sections = Section.objects.in_bulk(ids)
+            s = [sections[id] for id in ids if id in sections]
         if not include_self:
             s = ascending and s[1:] or s[:-1]
         return list(s)  # So it's evaluated and will be cached
 
-    def _get_descendants(self, include_self=False, include_count='', include_min='', max_depth=''):
+    def _get_descendants(self, include_self=False, max_depth=''):
         """Return the descendants of the current Section, in depth-first order.
-        Optionally, include speech counts, minimum speech times, and only
-        descend a certain depth."""
-        select = ['*']
-        if include_count:
-            select.append("(SELECT COUNT(*) FROM speeches_speech WHERE section_id = cte.id) AS speech_count")
-        if include_min:
-            select.append("""(SELECT MIN( start_date + COALESCE(start_time, time '00:00') )
-                FROM speeches_speech WHERE section_id = cte.id) AS speech_min""")
+        Optionally, only descend a certain depth. Each returned Section has
+        its level and path (of IDs) relative to this one."""
+        if not self.tree_path:
+            return []
+        s = Section.objects.filter(tree_path__startswith=self.tree_path).order_by('tree_path')
         if max_depth:
-            max_depth = "WHERE array_upper(path, 1) < %d" % (max_depth + 1)
-        s = Section.objects.raw(
-            """WITH RECURSIVE cte AS (
-                SELECT speeches_section.*, 0 AS level, ARRAY[id] AS path FROM speeches_section WHERE id=%s
-                UNION ALL
-                SELECT s.*, level+1, cte.path||s.id FROM cte JOIN speeches_section s ON cte.id = s.parent_id
-            """ + max_depth + """
-            )
-            SELECT """ + ','.join(select) + """ FROM cte ORDER BY path""",
-            [self.id]
-        )
+            s = s.annotate(tree_path_length=Length('tree_path')).filter(
+                tree_path_length__lte=len(self.tree_path) + max_depth * TREE_PATH_STEP_LENGTH)
+
+        depth = len(tree_path_ids(self.tree_path)) - 1
+        s = list(s)
+        for section in s:
+            section.path = tree_path_ids(section.tree_path)[depth:]
+            section.level = len(section.path) - 1
         if not include_self:
             s = s[1:]
         return s
@@ -338,11 +761,16 @@ class Section(AuditedModel, InstanceMixin):
     @cache
     def get_descendants_tree(self):
         """Given a flat list of Sections ordered by speech_min, create a
-        hierarchical structure containing the same information."""
-        d = self._get_descendants_by_speech(include_count=True)
+        hierarchical structure containing the same information. Ancestors
+        are all in that list, so no further queries are needed."""
+        d = self._get_descendants_by_speech()
+        lookup = dict((node.id, node) for node in d)
+        lookup[self.id] = self
+        parent_ids = set(node.parent_id for node in d)
         prev = self
         parents = []
         for node in d:
+            node._is_leaf = node.id not in parent_ids
             if node.level > getattr(prev, 'level', 0):
                 parents.append(prev)
                 prev._childs = []
@@ -352,14 +780,17 @@ class Section(AuditedModel, InstanceMixin):
                 sw = next((i for i in range(len(node.path)) if node.path[i] != prev.path[i]))
                 parents = parents[:sw - node.level]
                 for i in range(sw, node.level):
-                    section = Section.objects.get(id=node.path[i])
+                    section = lookup[node.path[i]]
                     section_copy = Section(
                         num=section.num,
                         heading=section.heading,
                         subheading=section.subheading,
-                        parent=section.parent,
+                        parent_id=section.parent_id,
+                        tree_path=section.tree_path,
+                        slug_path=section.slug_path,
                     )
                     section_copy._childs = []
+                    section_copy._is_leaf = False
                     parents[-1]._childs.append(section_copy)
                     parents.append(section_copy)
             prev = node
@@ -367,6 +798,32 @@ class Section(AuditedModel, InstanceMixin):
         return d
 
     def get_descendants_tree_with_speeches(self, request, all_speeches=False):
+        # Repeat requests for an unchanged document can be served from the
+        # shared cache, if there is one
+        tree_cache = section_tree_cache()
+        if tree_cache is not None and self.tree_path:
+            key = 'sayit-section-tree-%d-%s-%d-%d' % (
+                self.id,
+                section_tree_version(tree_cache, tree_path_ids(self.tree_path)[0]),
+                bool(all_speeches),
+                bool(request.is_user_instance),
+            )
+            tree_final = tree_cache.get(key)
+            if tree_final is None:
+                tree_final = self._get_descendants_tree_with_speeches(request, all_speeches)
+                tree_cache.set(key, tree_final)
+        else:
+            tree_final = self._get_descendants_tree_with_speeches(request, all_speeches)
+
+        # Return an iterator because otherwise passing this down in context to
+        # subtemplates is really slow. I mean, upwards of 30 seconds slow.
+        # As a class so it can be reused after use (e.g. by the tests).
+        class _iterable(object):
+            def __iter__(self):
+                return iter(tree_final)
+        return _iterable()
+
+    def _get_descendants_tree_with_speeches(self, request, all_speeches):
         # Get the descendants tree of sections
         tree = self.get_descendants_tree
 
@@ -409,14 +866,165 @@ class Section(AuditedModel, InstanceMixin):
                     tree_final[-1][1].setdefault('closed_levels', []).append(l)
 
         rec(self, 1)
+        return tree_final
+
+    def iter_descendants_tree_with_speeches(self, request, all_speeches=False, chunk_size=100, after=None):
+        """A generator of the same items as get_descendants_tree_with_speeches,
+        that fetches each section's speeches through a server-side cursor
+        only when it is reached, so the whole transcript is never in memory.
+        If after is a cursor from get_descendants_tree_window, start from
+        the item following the one it points to. Each item's attrs also
+        give its level, 1 for the children of this section."""
+        for node, attrs, steps in self._iter_tree(request, all_speeches, chunk_size, after):
+            attrs['level'] = len(steps)
+            yield node, attrs
+
+    def get_descendants_tree_window(self, request, size, after=None, all_speeches=False):
+        """Return a list of at most size items of the interleaved tree, in
+        the same form as get_descendants_tree_with_speeches, starting after
+        the cursor after (or at the start), and a cursor for the next
+        window, or None if this is the last.
+
+        Each window is markup-complete on its own: the first item of a
+        window re-opens the levels it is nested in, given as
+        reopened_levels, and the last item closes every open level."""
+        items = list(islice(self._iter_tree(request, all_speeches, size, after), size + 1))
+        cursor = None
+        if len(items) > size:
+            items = items[:size]
+            node, attrs, steps = items[-1]
+            attrs['closed_levels'] = list(range(len(steps), 0, -1))
+            cursor = '.'.join(steps)
+        if items and after:
+            node, attrs, steps = items[0]
+            attrs['new_level'] = True
+            attrs['reopened_levels'] = list(range(1, len(steps)))
+        return [(node, attrs) for node, attrs, steps in items], cursor
+
+    def _iter_tree(self, request, all_speeches, chunk_size, after):
+        """Yield (node, attrs, steps) for each item of the interleaved tree,
+        where steps locates the item: the index of each enclosing section
+        among its parent's children, then the item's own index if it is a
+        section, or 's' and its ID if it is a speech."""
+        self.get_descendants_tree
 
-        # Return an iterator because otherwise passing this down in context to
-        # subtemplates is really slow. I mean, upwards of 30 seconds slow.
-        # As a class so it can be reused after use (e.g. by the tests).
-        class _iterable(object):
-            def __iter__(self):
-                return iter(tree_final)
-        return _iterable()
+        speech_type_choices = dict(Speech._meta.get_field('type').choices)
+
+        if after:
+            resume = after.split('.')
+            if not all(re.match(r'^s?\d+$', step) for step in resume):
+                raise ValueError('Invalid tree cursor: %s' % after)
+        else:
+            resume = None
+
+        def speeches(section, after_key=None):
+            if section.id is None or not (all_speeches or section.id == self.id):
+                return
+            speech_list = Speech.objects.filter(section=section).visible(request) \
+                .select_related('speaker').order_by(*Speech.interleave_ordering())
+            if after_key:
+                start_date, start_time = after_key[0].date(), after_key[0].time()
+                later = Q(interleave_date__gt=start_date) | Q(
+                    interleave_date=start_date, interleave_time__gt=start_time)
+                if after_key[1] != float('inf'):
+                    later |= Q(interleave_date=start_date, interleave_time=start_time, id__gt=after_key[1])
+                date_order, time_order = Speech.interleave_ordering()[:2]
+                speech_list = speech_list.annotate(
+                    interleave_date=date_order, interleave_time=time_order).filter(later)
+            if django.VERSION >= (2, 0):
+                speech_iter = speech_list.iterator(chunk_size=chunk_size)
+            else:
+                speech_iter = speech_list.iterator()
+            chunk = []
+            for speech in speech_iter:
+                chunk.append(speech)
+                if len(chunk) == chunk_size:
+                    prefetch_related_objects(chunk, 'tags')
+                    for c in chunk:
+                        yield c
+                    chunk = []
+            prefetch_related_objects(chunk, 'tags')
+            for c in chunk:
+                yield c
+
+        def speech_key(speech):
+            return (
+                datetime.datetime.combine(
+                    speech.start_date or max_date, speech.start_time or max_time
+                ),
+                speech.id
+            )
+
+        def rec(s, level, steps, resume):
+            # The same sorting keys as _interleave_speeches; the speeches
+            # already arrive in order, so the two can be merged as we go.
+            tree_with_key = sorted(
+                (
+                    (
+                        getattr(d, 'speech_min', None) or max_datetime,
+                        float('inf'),  # Always compares greater than speech ID
+                        i
+                    ),
+                    d
+                ) for i, d in enumerate(getattr(s, '_childs', []))
+            )
+
+            # When resuming, carry on inside the section the cursor is in,
+            # then with whatever sorts after it at this level.
+            after_key = None
+            if resume:
+                step = resume[0]
+                if step.startswith('s'):
+                    speech = Speech.objects.filter(section=s, id=step[1:]).first()
+                    if speech is None:
+                        raise ValueError('Invalid tree cursor: speech %s not found' % step[1:])
+                    after_key = speech_key(speech)
+                else:
+                    found = [(key, d) for key, d in tree_with_key if key[2] == int(step)]
+                    if not found:
+                        raise ValueError('Invalid tree cursor: section %s not found' % step)
+                    after_key, child = found[0]
+                    for item in rec(child, level + 1, steps + [step], resume[1:]):
+                        yield item
+                tree_with_key = [(key, d) for key, d in tree_with_key if key > after_key]
+
+            speech_list_with_key = ((speech_key(sp), sp) for sp in speeches(s, after_key))
+            c = None
+            for i, (key, c) in enumerate(heapq.merge(tree_with_key, speech_list_with_key)):
+                attrs = {}
+                if i == 0 and not resume:
+                    attrs['new_level'] = True
+                if isinstance(c, Speech):
+                    attrs['speech'] = True
+
+                    # Anything with an odd type gets it replaced with 'other'
+                    if c.type not in speech_type_choices:
+                        c.type = 'other'
+
+                    yield c, attrs, steps + ['s%d' % c.id]
+                else:
+                    yield c, attrs, steps + [str(key[2])]
+                    for item in rec(c, level + 1, steps + [str(key[2])], None):
+                        yield item
+
+            # A level being resumed was opened in an earlier window
+            if c is not None or resume:
+                yield None, level, None
+
+        # Levels are closed on the last item output within them, so hold
+        # each item back until we know whether that's the case. Closes with
+        # nothing held back belong to the item the cursor points to.
+        prev = None
+        for node, attrs, steps in rec(self, 1, [], resume):
+            if node is None:
+                if prev:
+                    prev[1].setdefault('closed_levels', []).append(attrs)
+                continue
+            if prev:
+                yield prev
+            prev = (node, attrs, steps)
+        if prev:
+            yield prev
 
     def _interleave_speeches(self, section):
         if not hasattr(section, '_childs'):
@@ -460,21 +1068,17 @@ class Section(AuditedModel, InstanceMixin):
         return self._get_descendants_by_speech()
 
     def _get_descendants_by_speech(self, **kwargs):
-        dqs = self._get_descendants(include_min=True, **kwargs)
+        dqs = self._get_descendants(**kwargs)
 
         max_datetime = datetime.datetime(datetime.MAXYEAR, 12, 31)
 
+        # Each stored minimum already covers the section's whole subtree
+        for d in dqs:
+            d.speech_min = speech_min_from_db(d.subtree_speech_min)
+
         lookup = dict((x.id, x) for x in dqs)
         lookup[self.id] = self
-        self.speech_min = max_datetime
-
-        for d in dqs:
-            if not d.speech_min:
-                continue
-            for parent_id in reversed(d.path):
-                parent = lookup[parent_id]
-                if not parent.speech_min or d.speech_min < parent.speech_min:
-                    parent.speech_min = d.speech_min
+        self.speech_min = min([d.speech_min for d in dqs if d.speech_min] or [max_datetime])
 
         # Set the speech_min to all the earliests
         for d in dqs:
@@ -499,23 +1103,32 @@ class Section(AuditedModel, InstanceMixin):
 
     @cache
     def get_path(self):
+        # Stored on save, so only worked out from the ancestors for a
+        # section that hasn't been saved with it yet
+        if self.slug_path:
+            return self.slug_path
         return '/'.join([s.slug for s in self.get_ancestors])
 
     def _get_next_previous_node(self, direction):
-        if not self.parent:
-            return None
-        root = self.get_ancestors[0]
-        tree = root.get_descendants
-        idx = tree.index(self)
-        lvl = tree[idx].level
-        same_level = [s for s in tree if s.level == lvl]
-        idx = same_level.index(self)
-        if direction == -1 and idx == 0:
-            return None
-        try:
-            return same_level[idx + direction]
-        except:
+        if not self.parent_id:
             return None
+        if direction == 1:
+            siblings = self.parent.children.filter(position__gt=self.position).order_by('position')
+        else:
+            siblings = self.parent.children.filter(position__lt=self.position).order_by('-position')
+        node = siblings.first()
+        if node:
+            return node
+
+        # Carry on into the children of the parent's neighbours
+        parent = self.parent
+        while True:
+            parent = parent._get_next_previous_node(direction)
+            if not parent:
+                return None
+            node = parent.children.order_by('position' if direction == 1 else '-position').first()
+            if node:
+                return node
 
     def get_next_node(self):
         """Fetch the next node in the tree, at the same level as this one."""
@@ -527,9 +1140,9 @@ class Section(AuditedModel, InstanceMixin):
 
     def descendant_speeches(self):
         """Return a queryset of all speeches that belong to this section, or any of its descendants."""
-        section_descendants = self._get_descendants(include_self=True)
-        section_descendants_ids = [x.id for x in section_descendants]
-        return Speech.objects.filter(section__in=section_descendants_ids)
+        if not self.tree_path:
+            return Speech.objects.none()
+        return Speech.objects.filter(section__tree_path__startswith=self.tree_path)
 
 
 class AudioMP3Mixin(object):
@@ -567,7 +1180,59 @@ class SpeechQuerySet(models.QuerySet):
         return query
 
 
-SpeechManager = InstanceManager.from_queryset(SpeechQuerySet)
+class SpeechManager(InstanceManager.from_queryset(SpeechQuerySet)):
+
+    def rebuild_positions(self, section_ids=None, instance_id=None):
+        """Renumber the stored positions of the speeches in the given Sections,
+        or of the given instance's speeches without a section, or of all
+        speeches, e.g. after they have been moved in bulk."""
+        with connection.cursor() as cursor:
+            if instance_id is not None:
+                cursor.execute(
+                    REBUILD_SPEECH_POSITIONS_SQL.format(where='WHERE instance_id = %s AND section_id IS NULL'),
+                    [instance_id])
+            elif section_ids is None:
+                cursor.execute(REBUILD_SPEECH_POSITIONS_SQL.format(where=''))
+            else:
+                cursor.execute(
+                    REBUILD_SPEECH_POSITIONS_SQL.format(where='WHERE section_id = ANY(%s)'),
+                    [list(section_ids)])
+
+    def delete_in_sections(self, section_ids):
+        """Delete the speeches directly in the given Sections, in a few
+        set-based queries rather than one (and a cascade of signals) per
+        row, leaving the Sections' stored aggregates alone. Returns the IDs
+        deleted, as anything indexing them won't have been told."""
+        speeches = self.filter(section_id__in=section_ids)
+        speech_ids = list(speeches.values_list('id', flat=True))
+        RecordingTimestamp.objects.filter(speech_id__in=speech_ids).update(speech=None)
+        tags = Speech.tags.through.objects.filter(speech_id__in=speech_ids)
+        tags._raw_delete(tags.db)
+        speeches._raw_delete(speeches.db)
+        return speech_ids
+
+    def place(self, speech):
+        """Give a saved speech the position that puts it in order among the
+        others in its section (or its instance's sectionless speeches),
+        moving later ones along if there isn't a gap for it."""
+        siblings = speech.get_position_siblings().exclude(id=speech.id).only(
+            'start_date', 'start_time', 'position')
+        last = siblings.order_by('-position').first()
+        if last is None:
+            position = 0
+        elif last.position_key < speech.position_key:
+            # The usual case, of speeches being added in order
+            position = last.position + 1
+        else:
+            previous = siblings.filter(speech.earlier_speeches_q()).reverse().first()
+            if previous is None:
+                position = siblings.order_by('position').first().position - 1
+            else:
+                position = previous.position + 1
+                if siblings.filter(position=position).exists():
+                    siblings.filter(position__gte=position).update(position=F('position') + 1)
+        self.filter(id=speech.id).update(position=position)
+        speech.position = position
 
 
 # Speech that a speaker gave
@@ -646,9 +1311,10 @@ class Speech(InstanceMixin, AudioMP3Mixin, AuditedModel):
     public = models.BooleanField(
         _('public'), default=True, help_text=_('Is this speech public?'))
 
-    # What if source material has multiple speeches, same timestamp - need a
-    # way of ordering them?
-    # pos = models.IntegerField()
+    # The order of the speech within its section (or its instance's speeches
+    # without a section), by start date/time/ID, counting from 0 when
+    # renumbered; maintained on save, so it may have gaps.
+    position = models.IntegerField(_('position'), default=0, editable=False)
 
     source_url = models.TextField(_('source URL'), blank=True)
     # source_column? Any other source based things?
@@ -657,10 +1323,43 @@ class Speech(InstanceMixin, AudioMP3Mixin, AuditedModel):
     celery_task_id = models.CharField(
         _('celery task ID'), max_length=256, null=True, blank=True)
 
+    # The (section ID, start datetime) last saved, for Section aggregates,
+    # or None if the speech was loaded without them
+    _aggregate_state = (None, None)
+    # The (section ID, start date, start time) last saved, for positions
+    _position_state = (None, None, None)
+    # For a speech loaded without the above, the section ID last saved,
+    # looked up when it is saved or deleted
+    _stored_section_id = None
+
     class Meta:
         verbose_name = _('speech')
         verbose_name_plural = _('speeches')
         ordering = ('start_date', 'start_time', 'id')
+        indexes = [
+            models.Index(fields=['section', 'position'], name='speeches_sp_section_pos_idx'),
+            models.Index(fields=['instance', 'section', 'position'], name='speeches_sp_inst_sec_pos_idx'),
+        ]
+
+    @staticmethod
+    def interleave_ordering():
+        """The ordering _interleave_speeches sorts a section's speeches
+        into, for asking the database for them in that order."""
+        return (
+            Coalesce('start_date', Value(max_date, output_field=models.DateField())),
+            Coalesce('start_time', Value(max_time, output_field=models.TimeField())),
+            'id',
+        )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Speech, cls).from_db(db, field_names, values)
+        if all(f in instance.__dict__ for f in ('section_id', 'start_date', 'start_time')):
+            instance._aggregate_state = (instance.section_id, instance.start_datetime)
+            instance._position_state = (instance.section_id, instance.start_date, instance.start_time)
+        else:
+            instance._aggregate_state = instance._position_state = None
+        return instance
 
     def __str__(self):
         out = 'Speech'
@@ -718,43 +1417,22 @@ class Speech(InstanceMixin, AudioMP3Mixin, AuditedModel):
     def get_delete_url(self):
         return reverse('speeches:speech-delete', kwargs={'pk': self.id})
 
-    def get_next_speech(self):
-        """Return the next speech to this one in the same section, in a start
-        date/time/ID ordering."""
-        if self.start_date:
-            # A later date, or no date present
-            q1 = Q(start_date__gt=self.start_date) | Q(start_date__isnull=True)
-            # Or, if on the same date...
-            q2 = Q(start_date=self.start_date)
-        else:
-            # No dates later than our unknown
-            q1 = Q()
-            # But in that case...
-            q2 = Q(start_date__isnull=True)
-        if self.start_time:
-            # If the time is later, or not present, or the same with a greater ID
-            q3 = Q(start_time__gt=self.start_time) | Q(start_time__isnull=True) \
-                | Q(start_time=self.start_time, id__gt=self.id)
-        else:
-            # If the time is not present and the ID is greater
-            q3 = Q(start_time__isnull=True, id__gt=self.id)
-        q = q1 | (q2 & q3)
-
-        if self.section:
-            s = list(Speech.objects.filter(q, section=self.section)[:1])
-        else:
-            s = list(Speech.objects.filter(q, instance=self.instance, section__isnull=True)[:1])
-        if s:
-            return s[0]
-        if self.section:
-            next_section = self.section.get_next_node()
-            if next_section:
-                s = next_section.speech_set.all()[:1]
-        return s and s[0] or None
+    @property
+    def position_key(self):
+        """The start date/time/ID this speech is ordered by, with missing
+        dates and times last, as in the database."""
+        # As assigned, these may not yet be of the type they're stored as
+        start_date = self._meta.get_field('start_date').to_python(self.start_date)
+        start_time = self._meta.get_field('start_time').to_python(self.start_time)
+        return (
+            start_date is None, start_date or datetime.date.min,
+            start_time is None, start_time or datetime.time.min,
+            self.id,
+        )
 
-    def get_previous_speech(self):
-        """Return the previous speech to this one in the same section,
-        in a start date/time/ID ordering."""
+    def earlier_speeches_q(self):
+        """Return a Q matching the speeches before this one in a start
+        date/time/ID ordering."""
         if self.start_date:
             # A date less than ours
             q1 = Q(start_date__lt=self.start_date)
@@ -771,18 +1449,36 @@ class Speech(InstanceMixin, AudioMP3Mixin, AuditedModel):
         else:
             # If there is a time, or there isn't but the ID is smaller
             q3 = Q(start_time__isnull=False) | Q(start_time__isnull=True, id__lt=self.id)
-        q = q1 | (q2 & q3)
+        return q1 | (q2 & q3)
 
+    def get_position_siblings(self):
+        """Return the speeches this one's position orders it among."""
+        if self.section_id:
+            return Speech.objects.filter(section_id=self.section_id)
+        return Speech.objects.filter(instance_id=self.instance_id, section__isnull=True)
+
+    def get_next_speech(self):
+        """Return the next speech to this one in the same section, in a start
+        date/time/ID ordering."""
+        s = list(self.get_position_siblings().filter(position__gt=self.position).order_by('position')[:1])
+        if s:
+            return s[0]
         if self.section:
-            s = list(Speech.objects.filter(q, section=self.section).reverse()[:1])
-        else:
-            s = list(Speech.objects.filter(q, instance=self.instance, section__isnull=True).reverse()[:1])
+            next_section = self.section.get_next_node()
+            if next_section:
+                s = next_section.speech_set.order_by('position')[:1]
+        return s and s[0] or None
+
+    def get_previous_speech(self):
+        """Return the previous speech to this one in the same section,
+        in a start date/time/ID ordering."""
+        s = list(self.get_position_siblings().filter(position__lt=self.position).order_by('-position')[:1])
         if s:
             return s[0]
         if self.section:
             prev_section = self.section.get_previous_node()
             if prev_section:
-                s = prev_section.speech_set.all().reverse()[:1]
+                s = prev_section.speech_set.order_by('-position')[:1]
         return s and s[0] or None
 
     def start_transcribing(self):
@@ -831,7 +1527,14 @@ class Recording(InstanceMixin, AudioMP3Mixin, AuditedModel):
         return reverse('speeches:recording-view', kwargs={'pk': self.id})
 
     def add_speeches_to_section(self, section):
-        return Speech.objects.filter(recordingtimestamp__recording=self).update(section=section)
+        speeches = Speech.objects.filter(recordingtimestamp__recording=self)
+        section_ids = set(speeches.values_list('section_id', flat=True))
+        updated = speeches.update(section=section)
+        section_ids.add(section.id)
+        Section.objects.refresh_speech_aggregates(section_ids)
+        Section.objects.bump_tree_versions(section_ids)
+        Speech.objects.rebuild_positions([section.id])
+        return updated
 
     def create_or_update_speeches(self, instance):
         created_speeches = []
@@ -882,3 +1585,127 @@ class Recording(InstanceMixin, AudioMP3Mixin, AuditedModel):
                     timestamp.save()
 
         return created_speeches
+
+
+# The fields a speech's position and section aggregates depend on, as
+# update_fields may name them (a save of a speech loaded with some fields
+# deferred gives attnames)
+SPEECH_STATE_FIELDS = set(('section', 'section_id', 'start_date', 'start_time'))
+
+
+# These are connected before the aggregate receivers below, which move
+# on the section a speech was loaded with.
+@receiver(post_save, sender=Speech)
+@receiver(post_delete, sender=Speech)
+def bump_section_tree_versions_on_speech_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old_section_id = instance._stored_section_id if instance._aggregate_state is None \
+        else instance._aggregate_state[0]
+    Section.objects.bump_tree_versions([instance.section_id, old_section_id])
+
+
+@receiver(post_save, sender=Section)
+@receiver(post_delete, sender=Section)
+def bump_section_tree_versions_on_section_change(sender, instance, raw=False, **kwargs):
+    if raw or section_tree_cache() is None:
+        return
+    # On a move, tree_path is still the old one here
+    bump_section_tree_versions([instance.tree_path])
+    Section.objects.bump_tree_versions([instance.parent_id])
+
+
+@receiver(post_save, sender=Speaker)
+@receiver(pre_delete, sender=Speaker)
+def bump_section_tree_versions_on_speaker_change(sender, instance, created=False, raw=False, **kwargs):
+    # Cached trees hold the speakers of their speeches; a deleted speaker is
+    # looked for before its speeches lose it.
+    if raw or created or section_tree_cache() is None:
+        return
+    sections = Speech.objects.filter(speaker=instance).values('section_id')
+    bump_section_tree_versions(Section.objects.filter(id__in=sections).values_list('tree_path', flat=True))
+
+
+@receiver(m2m_changed, sender=Speech.tags.through)
+def bump_section_tree_versions_on_speech_tags_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if section_tree_cache() is None:
+        return
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            Section.objects.bump_tree_versions([instance.section_id])
+        return
+    # Tag.speech_set; a clear is looked at before the tag leaves its speeches
+    if action in ('post_add', 'post_remove'):
+        speeches = Speech.objects.filter(id__in=pk_set)
+    elif action == 'pre_clear':
+        speeches = Speech.objects.filter(tags=instance)
+    else:
+        return
+    sections = speeches.values('section_id')
+    bump_section_tree_versions(Section.objects.filter(id__in=sections).values_list('tree_path', flat=True))
+
+
+@receiver(post_save, sender=Speech)
+def place_speech_on_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields and not set(update_fields) & SPEECH_STATE_FIELDS:
+        return
+    state = (instance.section_id, instance.start_date, instance.start_time)
+    if created or state != instance._position_state:
+        Speech.objects.place(instance)
+    instance._position_state = state
+
+
+@receiver(pre_save, sender=Speech)
+@receiver(pre_delete, sender=Speech)
+def look_up_section_of_speech_loaded_without(sender, instance, raw=False, update_fields=None, **kwargs):
+    # A speech loaded with its section or start deferred doesn't know what
+    # it was counted towards, so the section it was saved in is looked up
+    if raw or instance._aggregate_state is not None or instance.pk is None:
+        return
+    if update_fields and not set(update_fields) & SPEECH_STATE_FIELDS:
+        return
+    instance._stored_section_id = Speech.objects.filter(pk=instance.pk).values_list(
+        'section_id', flat=True).first()
+
+
+@receiver(post_save, sender=Speech)
+def update_section_aggregates_on_speech_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields and not set(update_fields) & SPEECH_STATE_FIELDS:
+        return
+    old = instance._aggregate_state
+    new = (instance.section_id, instance.start_datetime)
+    if old is None:
+        # Without knowing its start before, recount rather than move it
+        Section.objects.refresh_speech_aggregates([instance._stored_section_id, instance.section_id])
+    elif old != new:
+        if old[0]:
+            Section.objects.speech_removed(*old)
+        if new[0]:
+            Section.objects.speech_added(*new)
+    instance._aggregate_state = new
+
+
+@receiver(post_delete, sender=Speech)
+def update_section_aggregates_on_speech_delete(sender, instance, **kwargs):
+    if instance._aggregate_state is None:
+        Section.objects.refresh_speech_aggregates([instance._stored_section_id])
+    else:
+        section_id, start = instance._aggregate_state
+        if section_id:
+            Section.objects.speech_removed(section_id, start)
+    instance._aggregate_state = (None, None)
+
+
+@receiver(post_delete, sender=Section)
+def update_section_aggregates_on_section_delete(sender, instance, **kwargs):
+    # When a subtree is deleted, only its top section's parent survives to
+    # need refreshing; speeches in the subtree will have lost their section,
+    # without being saved, so their positions need fitting in among the
+    # instance's other speeches without one.
+    if instance.parent_id:
+        Section.objects.refresh_speech_aggregates([instance.parent_id])
+    Speech.objects.rebuild_positions(instance_id=instance.instance_id)
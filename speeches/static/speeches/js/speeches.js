@@ -3,6 +3,7 @@ $(function() {
     sayit_ajax_file_uploads();
     sayit_link_prev_next_keyboard();
     setup_unimportant_sections();
+    sayit_section_tree_more();
     hide_new_speaker_controls();
 
     var audios = $('audio').not('.audio-small');
@@ -130,3 +131,24 @@ function hide_new_speaker_controls() {
         }
     ).change();
 }
+
+function sayit_section_tree_more() {
+    $(document).on('click', '.section-tree-more a', function(e) {
+        var more = $(this).closest('.section-tree-more'),
+            link = $(this);
+        e.preventDefault();
+        if (link.hasClass('disabled')) {
+            return;
+        }
+        link.addClass('disabled');
+        $.getJSON(link.attr('href'), function(data) {
+            more.before(data.html);
+            if (data.cursor) {
+                link.attr('href', link.attr('href').replace(/after=[^&]*/, 'after=' + data.cursor));
+                link.removeClass('disabled');
+            } else {
+                more.remove();
+            }
+        });
+    });
+}
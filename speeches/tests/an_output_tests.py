@@ -1,8 +1,16 @@
+import datetime
+import os
+import shutil
+import tempfile
+
+from django.test import RequestFactory
 import lxml.etree as etree
 from speeches.external.formencode import xml_compare
 
 from speeches.tests import InstanceTestCase
 from speeches.models import Speech, Section, Speaker
+from speeches.exporters.export_akomantoso import ExportAkomaNtoso
+from speeches.importers.import_akomantoso import ImportAkomaNtoso
 
 
 class AkomaNtosoOutputTestCase(InstanceTestCase):
@@ -23,7 +31,7 @@ class AkomaNtosoOutputTestCase(InstanceTestCase):
             )
 
         resp = self.client.get('/test-section.an')
-        output = resp.content
+        output = b''.join(resp.streaming_content)
         lxml1 = etree.fromstring(output)
 
         expected = """
@@ -62,7 +70,7 @@ class AkomaNtosoOutputTestCase(InstanceTestCase):
             )
 
         resp = self.client.get('/test-section.an')
-        output = resp.content
+        output = b''.join(resp.streaming_content)
         lxml1 = etree.fromstring(output)
 
         expected = """
@@ -99,7 +107,7 @@ class AkomaNtosoOutputTestCase(InstanceTestCase):
             )
 
         resp = self.client.get('/test-section.an')
-        output = resp.content
+        output = b''.join(resp.streaming_content)
         lxml1 = etree.fromstring(output)
 
         expected = """
@@ -130,7 +138,7 @@ class AkomaNtosoOutputTestCase(InstanceTestCase):
             heading='Test Section')
 
         resp = self.client.get('/test-section.an')
-        output = resp.content
+        output = b''.join(resp.streaming_content)
         lxml1 = etree.fromstring(output)
 
         expected = """
@@ -163,7 +171,7 @@ class AkomaNtosoOutputTestCase(InstanceTestCase):
             parent=section)
 
         resp = self.client.get('/outer-section.an')
-        output = resp.content
+        output = b''.join(resp.streaming_content)
         lxml1 = etree.fromstring(output)
 
         expected = """
@@ -196,23 +204,136 @@ class AkomaNtosoOutputTestCase(InstanceTestCase):
         inner2 = Section.objects.create(
             instance=self.instance, heading='Inner 2', parent=section)
 
-        resp = self.client.get('/outer-section.an')
-        self.assertSequenceEqual([
-            (inner1, {'new_level': True}),
-            (inner2, {'closed_levels': [1]}),
-            ], list(resp.context['section_tree']))
-
-        speech1 = Speech.objects.create(
+        Speech.objects.create(
             text="A test speech", section=inner1, instance=self.instance)
-        speech2 = Speech.objects.create(
-            text="A test speech", section=inner2, instance=self.instance)
+        Speech.objects.create(
+            text="Another test speech", section=inner2, instance=self.instance)
+        Speech.objects.create(
+            text="A closing speech", section=section, instance=self.instance)
 
         resp = self.client.get('/outer-section.an')
-        self.assertSequenceEqual([
-            (inner1, {'new_level': True}),
-            (speech1,
-                {'closed_levels': [2], 'new_level': True, 'speech': True}),
-            (inner2, {}),
-            (speech2,
-                {'closed_levels': [2, 1], 'new_level': True, 'speech': True}),
-            ], list(resp.context['section_tree']))
+        lxml1 = etree.fromstring(b''.join(resp.streaming_content))
+
+        expected = """
+            <akomaNtoso>
+              <debate>
+                <meta>
+                  <references>
+                  </references>
+                </meta>
+                <debateBody>
+                  <debateSection>
+                    <heading>Outer Section</heading>
+                    <debateSection>
+                      <heading>Inner 1</heading>
+                      <other>A test speech</other>
+                    </debateSection>
+                    <debateSection>
+                      <heading>Inner 2</heading>
+                      <other>Another test speech</other>
+                    </debateSection>
+                    <other>A closing speech</other>
+                  </debateSection>
+                </debateBody>
+              </debate>
+            </akomaNtoso>
+            """
+        lxml2 = etree.fromstring(expected)
+
+        assert xml_compare(lxml1, lxml2)
+
+    def test_interleaved_sections_tree(self):
+        section = Section.objects.create(
+            instance=self.instance, heading='Day')
+        debate_a = Section.objects.create(
+            instance=self.instance, heading='Debate A', parent=section)
+        morning = Section.objects.create(
+            instance=self.instance, heading='A morning', parent=debate_a)
+        afternoon = Section.objects.create(
+            instance=self.instance, heading='A afternoon', parent=debate_a)
+        debate_b = Section.objects.create(
+            instance=self.instance, heading='Debate B', parent=section)
+        midday = Section.objects.create(
+            instance=self.instance, heading='B midday', parent=debate_b)
+
+        for text, parent, hour in (('Morning', morning, 9), ('Midday', midday, 12), ('Afternoon', afternoon, 15)):
+            Speech.objects.create(
+                text=text, section=parent, instance=self.instance,
+                start_date=datetime.date(2013, 4, 1), start_time=datetime.time(hour, 0))
+
+        resp = self.client.get('/day.an')
+        lxml1 = etree.fromstring(b''.join(resp.streaming_content))
+
+        # Debate A is split in two, around Debate B
+        expected = """
+            <akomaNtoso>
+              <debate>
+                <meta>
+                  <references>
+                  </references>
+                </meta>
+                <debateBody>
+                  <debateSection>
+                    <heading>Day</heading>
+                    <debateSection>
+                      <heading>Debate A</heading>
+                      <debateSection>
+                        <heading>A morning</heading>
+                        <other>Morning</other>
+                      </debateSection>
+                    </debateSection>
+                    <debateSection>
+                      <heading>Debate B</heading>
+                      <debateSection>
+                        <heading>B midday</heading>
+                        <other>Midday</other>
+                      </debateSection>
+                    </debateSection>
+                    <debateSection>
+                      <heading>Debate A</heading>
+                      <debateSection>
+                        <heading>A afternoon</heading>
+                        <other>Afternoon</other>
+                      </debateSection>
+                    </debateSection>
+                  </debateSection>
+                </debateBody>
+              </debate>
+            </akomaNtoso>
+            """
+        lxml2 = etree.fromstring(expected)
+
+        assert xml_compare(lxml1, lxml2)
+
+    def test_round_trip(self):
+        ImportAkomaNtoso(instance=self.instance, commit=True).import_document(
+            'speeches/tests/data/fake_http/Debate_Bungeni_1995-10-31.xml')
+        request = RequestFactory().get('/')
+        request.is_user_instance = True
+
+        def exported():
+            documents = []
+            for section in Section.objects.filter(parent=None).order_by('id'):
+                exporter = ExportAkomaNtoso(section, request)
+                exporter.chunk_size = 2
+                documents.append(b''.join(exporter))
+            return documents
+
+        documents = exported()
+        self.assertEqual(len(documents), 6)
+        self.assertIn(b'<TLCPerson href="/ontology/person/testserver/mr-adam" id="mr-adam" showAs="Mr. Adam"/>',
+                      documents[4])
+        self.assertIn(b'<question by="#mr-adam"', documents[4])
+
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        Section.objects.all().delete()
+        Speech.objects.all().delete()
+        Speaker.objects.all().delete()
+        for i, document in enumerate(documents):
+            path = os.path.join(tmp, '%d.xml' % i)
+            with open(path, 'wb') as f:
+                f.write(document)
+            ImportAkomaNtoso(instance=self.instance, commit=True).import_document(path)
+
+        self.assertEqual(exported(), documents)
@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+import six
+from six import StringIO
+
+from speeches.tests import InstanceTestCase
+from speeches.models import Speech, Speaker, Section
+from speeches.importers.import_akomantoso import ImportAkomaNtoso
+from speeches.importers.import_popolo import PopoloImporter
+from speeches.utils.corpus import CorpusGenerator
+
+
+class CorpusTestCase(InstanceTestCase):
+    def setUp(self):
+        super(CorpusTestCase, self).setUp()
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_generate_corpus(self):
+        call_command(
+            'sayit_generate_corpus', self.dir, documents=2, depth=2, fan_out=2, speeches=3, speakers=4,
+            stdout=StringIO())
+        self.assertEqual(sorted(os.listdir(self.dir)), ['debate-0001.xml', 'debate-0002.xml', 'people.json'])
+
+        PopoloImporter(os.path.join(self.dir, 'people.json'), instance=self.instance).import_all()
+        self.assertEqual(Speaker.objects.count(), 4)
+
+        for name in ('debate-0001.xml', 'debate-0002.xml'):
+            ImportAkomaNtoso(instance=self.instance, commit=True).import_document(os.path.join(self.dir, name))
+        self.assertEqual(Section.objects.count(), 2 * 7)
+        self.assertEqual(Section.objects.filter(parent=None).count(), 2)
+        self.assertEqual(Speech.objects.count(), 2 * 7 * 3)
+        # The speeches are by the people imported from Popolo
+        self.assertEqual(Speaker.objects.count(), 4)
+        self.assertFalse(Speech.objects.filter(speaker=None).exists())
+
+    def test_generate_corpus_repeatable(self):
+        def generate(seed):
+            path = tempfile.mkdtemp(dir=self.dir)
+            popolo_path, paths = CorpusGenerator(seed=seed).write(path)
+            return [open(p, 'rb').read() for p in [popolo_path] + paths]
+
+        self.assertEqual(generate(1), generate(1))
+        self.assertNotEqual(generate(1), generate(2))
+
+    def test_benchmark(self):
+        out = StringIO()
+        call_command('sayit_benchmark', depth=1, fan_out=2, speeches=2, speakers=3, pages=2, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split()[0] for line in lines], ['popolo', 'akomantoso', 'section', 'speaker'])
+        self.assertEqual(lines[1].split()[1], str(3 + 3 * 2))
+        self.assertEqual(lines[1].split()[-2], '-')
+
+        if six.PY3:
+            out = StringIO()
+            call_command(
+                'sayit_benchmark', depth=1, fan_out=2, speeches=2, speakers=3, pages=2, memory=True, stdout=out)
+            self.assertTrue(out.getvalue().splitlines()[1].split()[-2].endswith('MB'))
+        # What was imported is rolled back
+        self.assertFalse(Section.objects.exists())
+        self.assertFalse(Speaker.objects.exists())
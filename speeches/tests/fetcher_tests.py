@@ -0,0 +1,115 @@
+import json
+import requests
+import shutil
+import tempfile
+import threading
+
+from django.test import SimpleTestCase
+from six.moves import BaseHTTPServer
+
+from speeches.tests import InstanceTestCase
+from speeches.models import Speaker
+from speeches.importers.fetcher import Fetcher
+from speeches.importers.import_popolo import PopoloImporter, next_page_url
+
+
+class StandInServer(BaseHTTPServer.HTTPServer):
+    """A local HTTP server, serving the responses set for each path in
+    turn, the last one for ever after, and counting the requests made."""
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.responses = {}
+        self.requests = []
+
+    def url(self, path):
+        return 'http://127.0.0.1:%d%s' % (self.server_port, path)
+
+    def set_json(self, path, *bodies):
+        self.responses[path] = [(200, json.dumps(body).encode('utf-8')) for body in bodies]
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        responses = self.server.responses.get(self.path, [(404, b'')])
+        status, body = responses.pop(0) if len(responses) > 1 else responses[0]
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServerMixin(object):
+    def setUp(self):
+        super(StandInServerMixin, self).setUp()
+        self.server = StandInServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def set_pages(self, path, pages):
+        """Serve pages of PopIt results at path, path?page=2 and so on."""
+        for number, page in enumerate(pages, 1):
+            body = {'result': page}
+            if number < len(pages):
+                body['next_url'] = self.server.url('%s?page=%d' % (path, number + 1))
+            self.server.set_json(path if number == 1 else '%s?page=%d' % (path, number), body)
+
+
+class FetcherTestCase(StandInServerMixin, SimpleTestCase):
+    def test_pages(self):
+        self.set_pages('/persons', [[1, 2], [3], [4, 5]])
+        self.server.responses['/persons?page=2'].insert(0, (503, b''))
+
+        for prefetch in (0, 2):
+            fetcher = Fetcher(prefetch=prefetch, backoff_factor=0)
+            pages = fetcher.pages(self.server.url('/persons'), next_page_url)
+            self.assertEqual([json.loads(page.decode('utf-8'))['result'] for page in pages], [[1, 2], [3], [4, 5]])
+
+        self.assertEqual(self.server.requests, [
+            '/persons', '/persons?page=2', '/persons?page=2', '/persons?page=3',
+            '/persons', '/persons?page=2', '/persons?page=3',
+        ])
+
+    def test_pages_error(self):
+        self.set_pages('/persons', [[1, 2], [3]])
+        self.server.responses['/persons?page=2'] = [(500, b'')]
+
+        pages = Fetcher(retries=1, backoff_factor=0).pages(
+            self.server.url('/persons'), next_page_url)
+        self.assertEqual(json.loads(next(pages).decode('utf-8'))['result'], [1, 2])
+        with self.assertRaises(requests.exceptions.HTTPError):
+            next(pages)
+        self.assertEqual(self.server.requests, ['/persons', '/persons?page=2', '/persons?page=2'])
+
+    def test_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.server.set_json('/popolo.json', {'persons': []})
+
+        for i in range(2):
+            fetcher = Fetcher(cache_dir=cache_dir)
+            self.assertEqual(fetcher.get(self.server.url('/popolo.json')), b'{"persons": []}')
+            with tempfile.TemporaryFile() as fp:
+                fetcher.download(self.server.url('/popolo.json'), fp)
+                fp.seek(0)
+                self.assertEqual(fp.read(), b'{"persons": []}')
+        self.assertEqual(self.server.requests, ['/popolo.json'])
+
+
+class PopItFetchTestCase(StandInServerMixin, InstanceTestCase):
+    def test_import_persons(self):
+        self.server.set_json('/', {'meta': {'persons_api_url': self.server.url('/persons')}})
+        self.set_pages('/persons', [
+            [{'id': 'person-%d' % i, 'name': 'Person %d' % i} for i in range(j, j + 3)]
+            for j in range(0, 9, 3)
+        ])
+
+        PopoloImporter(self.server.url('/'), instance=self.instance).import_all()
+        self.assertEqual(Speaker.objects.filter(instance=self.instance).count(), 9)
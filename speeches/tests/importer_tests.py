@@ -1,17 +1,30 @@
 import datetime
 import json
+import os
 import re
 import requests
+import shutil
+import tempfile
+from lxml import objectify
 from mock import patch
+from unittest import skipUnless
 
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from instances.models import Instance
+from popolo.models import Membership
 from speeches.tests import InstanceTestCase
 from speeches.models import Speech, Speaker, Section
-from speeches.importers.import_akomantoso import ImportAkomaNtoso
+from speeches.importers.import_akomantoso import ImportAkomaNtoso, SECTION_TAGS, hash_element
+from speeches.importers.import_base import SpeakerResolver
 from speeches.importers.import_popolo import PopoloImporter
 
 
 class FakeRequestsOutput(object):
-    def __init__(self, source, verify=True):
+    def __init__(self, source, verify=True, stream=False, timeout=None):
         assert source.startswith('http://example.com/')
 
         # We'll put things that would have been served from a url ending
@@ -28,10 +41,18 @@ class FakeRequestsOutput(object):
     def json(self):
         return json.load(open(self.file_path))
 
+    def raise_for_status(self):
+        pass
+
     @property
     def content(self):
         return open(self.file_path, 'rb').read()
 
+    def iter_content(self, chunk_size=1):
+        with open(self.file_path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(chunk_size), b''):
+                yield chunk
+
 
 @patch.object(requests, 'get', FakeRequestsOutput)
 class AkomaNtosoImportTestCase(InstanceTestCase):
@@ -60,6 +81,19 @@ class AkomaNtosoImportTestCase(InstanceTestCase):
              u'narrative']
             )
 
+    def test_construct_datetime(self):
+        # A date on its own leaves the time unknown, rather than midnight,
+        # so that an exported speech without a time imports back the same
+        self.assertEqual(
+            self.importer.construct_datetime('2014-07-01'), (datetime.date(2014, 7, 1), None))
+        self.assertEqual(
+            self.importer.construct_datetime('2014-07-01T00:00:00'),
+            (datetime.date(2014, 7, 1), datetime.time(0, 0)))
+        self.assertEqual(
+            self.importer.construct_datetime('2014-07-01T14:30:00'),
+            (datetime.date(2014, 7, 1), datetime.time(14, 30)))
+        self.assertEqual(self.importer.construct_datetime(''), (None, None))
+
     def test_already_imported(self):
         self.importer.import_document(
             'speeches/fixtures/test_inputs/test_xpath.xml')
@@ -231,6 +265,28 @@ class AkomaNtosoImportTestCase(InstanceTestCase):
             self.assertEqual(speeches[i].speaker, s)
             self.assertEqual(speeches[i].speaker_display, sd)
 
+    def test_speaker_resolver(self):
+        href = '/ontology/person/testing.sayit.dev/speaker'
+        resolver = SpeakerResolver(self.instance)
+        for i in range(2):
+            ImportAkomaNtoso(instance=self.instance, commit=True, speaker_resolver=resolver).import_document(
+                'speeches/fixtures/test_inputs/test_blank_speakers.xml')
+        self.assertEqual(Speaker.objects.count(), 1)
+
+        # Speakers created during the run are known without a query
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.get(href).name, 'Speaker')
+        # And a new run loads them all at once
+        resolver = SpeakerResolver(self.instance)
+        with self.assertNumQueries(1):
+            self.assertEqual(resolver.missing([href, 'unknown']), set(['unknown']))
+            self.assertEqual(resolver.get(href).name, 'Speaker')
+
+        # Speakers from an import that was rolled back are forgotten
+        resolver.add('new', Speaker(instance=self.instance, name='New'))
+        resolver.rolled_back()
+        self.assertEqual(resolver.missing(['new']), set(['new']))
+
     def test_import_remote_file(self):
         self.importer.import_document(
             'http://example.com/Debate_Bungeni_1995-10-31.xml')
@@ -244,6 +300,213 @@ class AkomaNtosoImportTestCase(InstanceTestCase):
              u'narrative']
             )
 
+    def test_import_streamed(self):
+        self.maxDiff = None
+
+        def imported():
+            return (
+                [(s.title, s.parent.title if s.parent else None) for s in Section.objects.all()],
+                [(s.type, s.text, s.speaker_id, s.section.title if s.section else None)
+                 for s in Speech.objects.all()],
+            )
+
+        for path in ('speeches/tests/data/fake_http/Debate_Bungeni_1995-10-31.xml',
+                     'http://example.com/Debate_Bungeni_1995-10-31.xml',
+                     'speeches/fixtures/test_inputs/test_empty_title.xml',
+                     'speeches/fixtures/test_inputs/test_blank_speakers.xml'):
+            ImportAkomaNtoso(instance=self.instance, commit=True).import_document(path)
+            expected = imported()
+            Section.objects.all().delete()
+            Speech.objects.all().delete()
+
+            importer = ImportAkomaNtoso(instance=self.instance, commit=True, stream=True)
+            importer.stream_chunk_size = 512
+            importer.import_document(path)
+            self.assertEqual(imported(), expected)
+            Section.objects.all().delete()
+            Speech.objects.all().delete()
+
+        # Skipped sections, and the speeches within them, stay skipped
+        path = 'speeches/fixtures/test_inputs/test_empty_title.xml'
+        self.importer.import_document(path)
+        expected = imported()
+        ImportAkomaNtoso(instance=self.instance, commit=True, clobber='skip', stream=True).import_document(path)
+        self.assertEqual(imported(), expected)
+
+    def test_import_bulk(self):
+        def imported():
+            return (
+                [(s.title, s.parent_id and s.parent.title, s.slug_path, s.position,
+                  s.speech_count, s.subtree_speech_count, s.subtree_speech_min)
+                 for s in Section.objects.all()],
+                [(s.type, s.text, s.section.title if s.section else None, s.position)
+                 for s in Speech.objects.all()],
+            )
+
+        for path in ('speeches/tests/data/fake_http/Debate_Bungeni_1995-10-31.xml',
+                     'speeches/tests/data/fake_http/test_clobber.xml',
+                     'speeches/fixtures/test_inputs/test_empty_title.xml'):
+            ImportAkomaNtoso(instance=self.instance, commit=True).import_document(path)
+            expected = imported()
+            Section.objects.all().delete()
+            Speech.objects.all().delete()
+
+            importer = ImportAkomaNtoso(instance=self.instance, commit=True, bulk=True)
+            importer.bulk_batch_size = 2
+            importer.import_document(path)
+            self.assertEqual(imported(), expected)
+            Section.objects.all().delete()
+            Speech.objects.all().delete()
+
+    def test_update_existing(self):
+        with open('speeches/tests/data/fake_http/test_clobber.xml') as f:
+            original = f.read()
+        changed = original.replace('Howdy', 'Hello').replace('</debateBody>', '''
+            <debateSection>
+                <heading>Afterword</heading>
+                <speech><p>Later</p></speech>
+            </debateSection>
+        </debateBody>''')
+        path = os.path.join(tempfile.mkdtemp(), 'debate.xml')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+
+        for stream in (False, True):
+            def update(xml):
+                with open(path, 'w') as f:
+                    f.write(xml)
+                importer = ImportAkomaNtoso(instance=self.instance, commit=True, clobber='update', stream=stream)
+                importer.import_document(path)
+                return importer
+
+            update(original)
+            document = Section.objects.get(heading='This is the title')
+            conclusions = Section.objects.get(heading='Conclusions')
+
+            # Unchanged, the document is skipped
+            update(original)
+            self.assertEqual(Section.objects.count(), 2)
+            self.assertEqual(Speech.objects.count(), 2)
+
+            # Changed, unchanged sections are kept, and the rest replaced,
+            # the document being read only once
+            importer = update(changed)
+            self.assertEqual(importer.metrics.bytes_read, os.path.getsize(path))
+            self.assertEqual(Section.objects.get(heading='This is the title').id, document.id)
+            self.assertEqual(Section.objects.get(heading='Conclusions').id, conclusions.id)
+            self.assertEqual(
+                sorted(Speech.objects.values_list('text', flat=True)),
+                ['<p>Bye</p>', '<p>Hello</p>', '<p>Later</p>'])
+            self.assertEqual(Section.objects.get(id=document.id).subtree_speech_count, 3)
+
+            # Sections no longer in the document are removed
+            update(original.replace('Conclusions', 'Summing up'))
+            self.assertEqual(
+                sorted(Section.objects.values_list('heading', flat=True)), ['Summing up', 'This is the title'])
+            self.assertEqual(
+                sorted(Speech.objects.values_list('text', flat=True)), ['<p>Bye</p>', '<p>Howdy</p>'])
+
+            # Streamed, a document without a body has no section to remove
+            # anything from
+            if stream:
+                update('<akomaNtoso><debate><preface/></debate></akomaNtoso>')
+
+            Section.objects.all().delete()
+            Speech.objects.all().delete()
+
+    def test_section_hashes_streamed(self):
+        path = 'speeches/tests/data/fake_http/Debate_Bungeni_1995-10-31.xml'
+        importer = ImportAkomaNtoso(instance=self.instance)
+        importer.stream_chunk_size = 512
+        xml = objectify.parse(path).getroot()
+        body = xml.debate.debateBody
+        hashes = [hash_element(child) for child in body.iterchildren() if importer.get_tag(child) in SECTION_TAGS]
+        self.assertTrue(hashes)
+        self.assertEqual(importer.stream_section_hashes(path), hashes)
+
+
+class AkomaNtosoImportCommandTestCase(TransactionTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for day in range(1, 5):
+            shutil.copy(
+                'speeches/fixtures/test_inputs/test_blank_speakers.xml',
+                os.path.join(self.dir, '2014-07-%02d.xml' % day))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def import_dir(self, **options):
+        call_command(
+            'load_akomantoso', dir=self.dir, commit=True, instance='default',
+            dump_users=os.path.join(self.dir, 'users.json'), verbosity=0, **options)
+        instance = Instance.objects.get(label='default')
+        self.assertEqual(Speech.objects.filter(instance=instance).count(), 16)
+        # The speaker is only created once, however the documents were shared out
+        self.assertEqual([s.name for s in Speaker.objects.filter(instance=instance)], ['Speaker'])
+        with open(os.path.join(self.dir, 'users.json')) as f:
+            self.assertEqual(json.load(f), [['speaker', 'Speaker']])
+
+    def test_import_dir(self):
+        self.import_dir()
+
+    @skipUnless(connection.vendor == 'postgresql', 'the import processes need to share a database')
+    def test_import_dir_in_parallel(self):
+        self.import_dir(jobs=3)
+
+    @skipUnless(connection.vendor == 'postgresql', 'the import processes need to share a database')
+    def test_import_dir_in_parallel_batches(self):
+        self.import_dir(jobs=2, batch=2)
+
+    def test_import_dir_in_batches(self):
+        # A document that fails after creating a speaker, which import_dir
+        # checks is rolled back
+        with open('speeches/fixtures/test_inputs/test_blank_speakers.xml') as f:
+            xml = f.read()
+        xml = xml.replace('</references>', '<TLCPerson id="nobody" href="/nobody"/></references>')
+        with open(os.path.join(self.dir, '2014-07-02a.xml'), 'w') as f:
+            f.write(xml.replace('id="speaker"', 'id="somebody"').replace('/speaker"', '/somebody"'))
+
+        metrics_path = os.path.join(self.dir, 'metrics.jsonl')
+        self.import_dir(batch=2, metrics=metrics_path)
+
+        with open(metrics_path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(
+            [(os.path.basename(line['path']), bool(line['error'])) for line in lines[:-1]],
+            [('2014-07-01.xml', False), ('2014-07-02.xml', False), ('2014-07-02a.xml', True),
+             ('2014-07-03.xml', False), ('2014-07-04.xml', False)])
+        self.assertEqual(lines[-1]['failed'], 1)
+
+    def test_import_metrics(self):
+        with open(os.path.join(self.dir, '2014-07-05.xml'), 'w') as f:
+            f.write('<akomaNtoso><debate>')
+        metrics_path = os.path.join(self.dir, 'metrics.jsonl')
+        call_command(
+            'load_akomantoso', dir=self.dir, commit=True, instance='default', verbosity=0, metrics=metrics_path)
+
+        with open(metrics_path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([line['event'] for line in lines], ['document'] * 5 + ['total'])
+
+        document = lines[0]
+        self.assertEqual(document['path'], os.path.join(self.dir, '2014-07-01.xml'))
+        self.assertIsNone(document['error'])
+        self.assertEqual(document['rows'], {'Speaker': 1, 'Section': 1, 'Speech': 4})
+        self.assertEqual(
+            document['bytes_read'], os.path.getsize('speeches/fixtures/test_inputs/test_blank_speakers.xml'))
+        self.assertTrue(document['queries'] > 0)
+        self.assertAlmostEqual(document['parse_seconds'] + document['write_seconds'], document['seconds'], 5)
+
+        failed = lines[4]
+        self.assertTrue(failed['error'].startswith('XMLSyntaxError'))
+        self.assertEqual(failed['rows'], {})
+
+        total = lines[5]
+        self.assertEqual(total['documents'], 5)
+        self.assertEqual(total['failed'], 1)
+        self.assertEqual(total['rows'], {'Speaker': 1, 'Section': 4, 'Speech': 16})
+        self.assertEqual(total['queries'], sum(line['queries'] for line in lines[:5]))
+
 
 @patch.object(requests, 'get', FakeRequestsOutput)
 class AkomaNtosoImportViewTestCase(InstanceTestCase):
@@ -294,7 +557,7 @@ class AkomaNtosoImportViewTestCase(InstanceTestCase):
         self.assertContains(resp, 'Sorry - something went wrong with the import')
 
 
-@patch.object(requests, 'get', FakeRequestsOutput)
+@patch.object(requests.Session, 'get', FakeRequestsOutput)
 class PopitImportTestCase(InstanceTestCase):
     popit_url = 'http://example.com/welsh_assembly_popit/'
 
@@ -308,7 +571,7 @@ class PopitImportTestCase(InstanceTestCase):
             )
 
 
-@patch.object(requests, 'get', FakeRequestsOutput)
+@patch.object(requests.Session, 'get', FakeRequestsOutput)
 class PopoloImportTestCase(InstanceTestCase):
     popit_url = 'http://example.com/welsh_assembly/persons'
 
@@ -342,8 +605,127 @@ class PopoloImportFromLocalSourceTestCase(InstanceTestCase):
             3,
             )
 
+    def test_import_streamed(self):
+        data = {
+            'meta': {'note': u'Caf\xe9'},
+            'organizations': [{'id': 'org', 'name': 'Assembly', 'extra': [[1, 2.5], {'a': None}]}],
+            'persons': [{'id': 'person-%d' % i, 'name': u'Person \u2603 %d' % i} for i in range(10)],
+            'memberships': [],
+        }
+        path = os.path.join(tempfile.mkdtemp(), 'people.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=1)
+
+        popolo_importer = PopoloImporter(path, instance=self.instance)
+        popolo_importer.chunk_size = 7
+        persons = popolo_importer.get('persons')
+        self.assertEqual(next(persons), data['persons'][0])
+        self.assertEqual(list(persons), data['persons'][1:])
+        self.assertEqual(list(popolo_importer.get('organizations')), data['organizations'])
+        self.assertEqual(list(popolo_importer.get('posts')), [])
 
-@patch.object(requests, 'get', FakeRequestsOutput)
+        popolo_importer.import_all()
+        self.assertEqual(Speaker.objects.filter(instance=self.instance).count(), 10)
+
+    def test_import_persons_changes(self):
+        persons = [
+            {'id': 'person-%d' % i, 'name': 'Person %d' % i,
+             'links': [{'url': 'http://example.org/%d' % i, 'note': 'Homepage'}],
+             'other_names': [{'name': 'P%d' % i}],
+             'identifiers': [{'identifier': 'X%d' % i, 'scheme': 'x'}]}
+            for i in range(20)
+        ]
+        path = os.path.join(tempfile.mkdtemp(), 'persons.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+
+        def import_persons():
+            with open(path, 'w') as f:
+                json.dump(persons, f)
+            return PopoloImporter(path, instance=self.instance).import_persons()
+
+        self.assertEqual(import_persons(), {'created': 20, 'refreshed': 0})
+        speaker = Speaker.objects.get(identifiers__identifier='person-3')
+        self.assertEqual(
+            sorted(speaker.identifiers.values_list('identifier', 'scheme')), [('X3', 'x'), ('person-3', 'Popolo')])
+        self.assertEqual(list(speaker.links.values_list('url', 'note')), [('http://example.org/3', 'Homepage')])
+        self.assertEqual(list(speaker.other_names.values_list('name', flat=True)), ['P3'])
+
+        # Nothing has changed, so nothing is written, however many people
+        with self.assertNumQueries(5):
+            self.assertEqual(import_persons(), {'created': 0, 'refreshed': 20})
+
+        persons[3]['name'] = 'Person Three'
+        persons[3]['links'][0]['note'] = 'Home page'
+        persons[3]['sources'] = [{'url': 'http://example.org/source'}]
+        self.assertEqual(import_persons(), {'created': 0, 'refreshed': 20})
+        speaker = Speaker.objects.get(pk=speaker.pk)
+        self.assertEqual(speaker.name, 'Person Three')
+        self.assertEqual(list(speaker.links.values_list('url', 'note')), [('http://example.org/3', 'Home page')])
+        self.assertEqual(list(speaker.sources.values_list('url', flat=True)), ['http://example.org/source'])
+        self.assertEqual(Speaker.objects.get(identifiers__identifier='person-4').name, 'Person 4')
+
+    def test_import_memberships(self):
+        data = {
+            'organizations': [{'id': 'org-%d' % i, 'name': 'Organization %d' % i} for i in range(2)],
+            'posts': [{'id': 'post-0', 'label': 'Chair', 'role': 'Chair', 'organization_id': 'org-0'}],
+            'persons': [{'id': 'person-%d' % i, 'name': 'Person %d' % i} for i in range(30)],
+            'memberships': [
+                {'id': 'membership-%d' % i, 'person_id': 'person-%d' % i, 'organization_id': 'org-%d' % (i % 2),
+                 'role': 'Member'}
+                for i in range(30)
+            ] + [
+                {'id': 'chair', 'person_id': 'person-0', 'organization_id': 'org-0', 'post_id': 'post-0',
+                 'role': 'Chair', 'links': [{'url': 'http://example.org/chair'}]},
+                {'id': 'unknown', 'person_id': 'nobody', 'organization_id': 'org-0'},
+                {'id': 'unknown-post', 'person_id': 'person-1', 'organization_id': 'org-1', 'post_id': 'post-9'},
+            ],
+        }
+        # The same person, organization and post again, with a new role, in
+        # the same batch
+        data['memberships'].insert(6, {
+            'id': 'membership-again', 'person_id': 'person-5', 'organization_id': 'org-1', 'role': 'Treasurer'})
+        path = os.path.join(tempfile.mkdtemp(), 'popolo.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+
+        def import_popolo():
+            with open(path, 'w') as f:
+                json.dump(data, f)
+            popolo_importer = PopoloImporter(path, instance=self.instance)
+            popolo_importer.import_organizations()
+            popolo_importer.import_persons()
+            popolo_importer.import_posts()
+            popolo_importer.batch_size = 7
+            with CaptureQueriesContext(connection) as queries:
+                popolo_importer.import_memberships()
+            return len(queries)
+
+        created_queries = import_popolo()
+        self.assertEqual(Membership.objects.count(), 31)
+        self.assertEqual(Membership.objects.filter(organization__name='Organization 1').count(), 15)
+        chair = Membership.objects.get(post__label='Chair')
+        self.assertEqual(chair.person.name, 'Person 0')
+        self.assertEqual(list(chair.links.values_list('url', flat=True)), ['http://example.org/chair'])
+        self.assertEqual(Membership.objects.get(person__name='Person 5').role, 'Treasurer')
+        # One of an unknown post doesn't stand in for the post-less one
+        self.assertEqual(Membership.objects.get(person__name='Person 1').role, 'Member')
+
+        # However many memberships there are, they take a few queries
+        self.assertLess(created_queries, 20)
+        data['memberships'][3]['role'] = 'Whip'
+        self.assertLess(import_popolo(), 10)
+        self.assertEqual(Membership.objects.count(), 31)
+        self.assertEqual(Membership.objects.get(person__name='Person 3').role, 'Whip')
+
+        # Posts imported by an earlier run are found again
+        popolo_importer = PopoloImporter(path, instance=self.instance)
+        popolo_importer.import_memberships()
+        self.assertEqual(Membership.objects.count(), 31)
+        self.assertEqual(Membership.objects.get(post__label='Chair').person.name, 'Person 0')
+        self.assertEqual(Membership.objects.get(person__name='Person 0', post=None).role, 'Member')
+
+
+@patch.object(requests.Session, 'get', FakeRequestsOutput)
 class PopoloImportViewsTestCase(InstanceTestCase):
     def test_import_page_smoke_test(self):
         resp = self.client.get('/import/popolo')
@@ -11,13 +11,14 @@ from speeches.tests import InstanceTestCase, OverrideMediaRootMixin
 from speeches.models import Speaker, Speech, Section
 from speeches import models
 
-m = Mock()
-m.return_value = ('speeches/fixtures/test_inputs/Ferdinand_Magellan.jpg', None)
+m = Mock(headers={}, status_code=200)
+with open('speeches/fixtures/test_inputs/Ferdinand_Magellan.jpg', 'rb') as f:
+    m.content = f.read()
 
 
 @override_settings(MEDIA_URL='/uploads/')
 class OpenGraphTests(OverrideMediaRootMixin, InstanceTestCase):
-    @patch.object(models, 'urlretrieve', m)
+    @patch.object(models.requests, 'get', Mock(return_value=m))
     def setUp(self):
         super(OpenGraphTests, self).setUp()
 
@@ -26,6 +27,7 @@ class OpenGraphTests(OverrideMediaRootMixin, InstanceTestCase):
             instance=self.instance,
             image='http://example.com/image.jpg',
             )
+        self.steve.fetch_image()
         self.section = Section.objects.create(
             heading='Test section',
             instance=self.instance,
@@ -1,9 +1,17 @@
+import json
+import os
 import re
+import shutil
+import tempfile
 from datetime import datetime, date, time
 
-from django.test import TestCase
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase
+from django.test.utils import override_settings
 
-from speeches.models import Section, Speech
+from speeches.models import Section, Speaker, Speech, Tag, speech_min_from_db
 from speeches.tests import create_sections
 from instances.models import Instance
 from speeches.tests import InstanceTestCase
@@ -109,6 +117,61 @@ class SectionModelTests(TestCase):
         self.assertEqual(debs[0].get_next_node(), debs[1])
         self.assertEqual(debs[1].get_next_node(), e)
 
+    def test_section_positions_follow_earliest_speech(self):
+        bill = Section.objects.get(heading='Fixed Easter Bill')
+
+        def headings():
+            return [s.heading for s in bill.children.order_by('position')]
+        self.assertEqual(headings(), ['New Clause 1', 'Clause 1', 'Z Clause'])
+
+        z_clause = Section.objects.get(heading='Z Clause')
+        early = Speech.objects.create(
+            section=z_clause, instance=z_clause.instance, text='Early',
+            start_date=date(2013, 3, 29), start_time=time(13, 0))
+        self.assertEqual(headings(), ['Z Clause', 'New Clause 1', 'Clause 1'])
+
+        clause = Section.objects.get(heading='Clause 1')
+        with self.assertNumQueries(2):
+            self.assertEqual(clause.get_previous_node().heading, 'New Clause 1')
+
+        early.delete()
+        self.assertEqual(headings(), ['New Clause 1', 'Clause 1', 'Z Clause'])
+
+    def test_new_section_placed_without_renumbering(self):
+        bill = Section.objects.get(heading='Fixed Easter Bill')
+
+        def children():
+            return list(bill.children.order_by('position').values_list('heading', 'position'))
+        new = Section.objects.create(heading='New', parent=bill, instance=bill.instance)
+        self.assertEqual(new.position, 1)
+        placed = children()
+        Section.objects.renumber_children([bill.id])
+        self.assertEqual(placed, children())
+        self.assertEqual([heading for heading, position in placed], ['New Clause 1', 'New', 'Clause 1', 'Z Clause'])
+
+    def test_delete_subtrees(self):
+        friday = Section.objects.get(heading='Friday 29th March')
+        bill = Section.objects.get(heading='Fixed Easter Bill')
+        clause = Section.objects.get(heading='Clause 1')
+        speech = clause.speech_set.all()[0]
+        speech.tags.add(Tag.objects.create(name='Easter', instance=speech.instance))
+        other = Section.objects.create(heading='Other', parent=friday, instance=friday.instance)
+        Speech.objects.create(
+            section=other, instance=other.instance, start_date=date(2013, 3, 29), start_time=time(16, 0))
+
+        deleted = Section.objects.delete_subtrees([bill])
+        self.assertEqual(len(deleted[Section]), 4)
+        self.assertEqual(len(deleted[Speech]), 8)
+        self.assertFalse(Section.objects.filter(id__in=deleted[Section]).exists())
+        self.assertFalse(Speech.objects.filter(id__in=deleted[Speech]).exists())
+        self.assertFalse(Speech.tags.through.objects.exists())
+        self.assertFalse(Section.objects.get(id=friday.id).slugs.filter(slug='fixed-easter-bill').exists())
+
+        friday = Section.objects.get(id=friday.id)
+        self.assertEqual(friday.subtree_speech_count, 1)
+        self.assertEqual(speech_min_from_db(friday.subtree_speech_min), datetime(2013, 3, 29, 16, 0))
+        self.assertEqual(Section.objects.get(id=other.id).position, 0)
+
     def test_section_speech_next_previous(self):
         first_next = Section.objects.get(heading='Bill on Silly Walks').speech_set.all()[0]
         speeches = Section.objects.get(heading='Oral Answers to Questions - Silly Walks').speech_set.all()
@@ -125,6 +188,48 @@ class SectionModelTests(TestCase):
         self.assertEqual(speeches[0].get_previous_speech(), p)
         self.assertEqual(speeches[0].get_next_speech(), q)
 
+    def test_speech_positions_maintained(self):
+        section = Section.objects.get(heading='Bill on Silly Walks')
+        instance = section.instance
+        for when in (time(11, 0), None, time(13, 0), time(12, 0), time(12, 0)):
+            Speech.objects.create(
+                text='Added', section=section, instance=instance,
+                start_date=date(2013, 3, 25), start_time=when)
+        moved = Speech.objects.create(
+            text='Moved', section=Section.objects.get(heading='Z Clause'), instance=instance,
+            start_date=date(2013, 3, 25), start_time=time(12, 30))
+        moved.section = section
+        moved.save()
+
+        speeches = sorted(section.speech_set.all(), key=lambda s: s.position_key)
+        self.assertEqual(len(speeches), 8)
+        self.assertIsNone(speeches[-1].start_time)
+        self.assertEqual(
+            [s.id for s in speeches],
+            [s.id for s in section.speech_set.order_by('position')])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(speeches[3].get_next_speech(), speeches[4])
+        with self.assertNumQueries(1):
+            self.assertEqual(speeches[3].get_previous_speech(), speeches[2])
+
+    def test_speech_positions_after_section_deleted(self):
+        section = Section.objects.get(heading='Z Clause')
+        instance = section.instance
+        for when in (time(9, 0), time(17, 0)):
+            Speech.objects.create(text='Loose', instance=instance, start_date=date(2013, 3, 29), start_time=when)
+        section.delete()
+
+        speeches = sorted(
+            Speech.objects.filter(instance=instance, section__isnull=True), key=lambda s: s.position_key)
+        self.assertTrue(len(speeches) > 3)
+        self.assertEqual(
+            [s.id for s in speeches],
+            [s.id for s in Speech.objects.filter(instance=instance, section__isnull=True).order_by('position')])
+        for previous, speech in zip(speeches, speeches[1:]):
+            self.assertEqual(previous.get_next_speech(), speech)
+            self.assertEqual(speech.get_previous_speech(), previous)
+
     def test_section_descendant_speeches_queryset(self):
         top_level = Section.objects.get(heading='Government Written Answers')
 
@@ -137,6 +242,199 @@ class SectionModelTests(TestCase):
         on_test_date = speeches.filter(start_date=test_date)
         self.assertEqual(on_test_date.count(), 2)
 
+    def test_section_descendants_max_depth(self):
+        debates = Section.objects.get(heading='Government Debates')
+
+        def levels(**kwargs):
+            return sorted(set(s.level for s in debates._get_descendants(**kwargs)))
+        self.assertEqual(levels(), [1, 2, 3])
+        # max_depth counts levels below the section, down to and including it
+        self.assertEqual(levels(max_depth=1), [1])
+        self.assertEqual(levels(max_depth=2), [1, 2])
+        self.assertEqual(levels(include_self=True, max_depth=2), [0, 1, 2])
+        self.assertIn('Fixed Easter Bill', [s.heading for s in debates._get_descendants(max_depth=2)])
+
+    def test_section_tree_path_maintained_on_move(self):
+        day = Section.objects.get(heading='Friday 29th March')
+        bill = Section.objects.get(heading='Fixed Easter Bill')
+        clause = Section.objects.get(heading='Clause 1')
+        self.assertTrue(clause.tree_path.startswith(bill.tree_path))
+        self.assertEqual([s.heading for s in clause.get_ancestors], [
+            'Government Debates', 'Friday 29th March', 'Fixed Easter Bill', 'Clause 1'])
+
+        # Move the bill, with its clauses, under the other top level section
+        bill.parent = Section.objects.get(heading='Government Written Answers')
+        bill.save()
+
+        clause = Section.objects.get(heading='Clause 1')
+        self.assertEqual([s.heading for s in clause.get_ancestors], [
+            'Government Written Answers', 'Fixed Easter Bill', 'Clause 1'])
+        self.assertEqual(day.get_descendants, [])
+        self.assertEqual(day.descendant_speeches().count(), 0)
+        self.assertEqual(bill.parent.descendant_speeches().count(), 14)
+
+    def test_section_speech_aggregates(self):
+        top_level = Section.objects.get(heading='Government Debates')
+        self.assertEqual(top_level.speech_count, 0)
+        self.assertEqual(top_level.subtree_speech_count, 14)
+
+        clause = Section.objects.get(heading='New Clause 1')
+        self.assertEqual(clause.speech_count, 3)
+        self.assertEqual(clause.subtree_speech_count, 3)
+
+        # An earlier speech elsewhere becomes the earliest of the whole tree
+        early = Speech.objects.create(
+            instance=top_level.instance, section=clause, start_date=date(2013, 3, 1))
+        top_level = Section.objects.get(id=top_level.id)
+        self.assertEqual(top_level.subtree_speech_count, 15)
+        self.assertEqual(speech_min_from_db(top_level.subtree_speech_min), datetime(2013, 3, 1))
+
+        # Moving it out again restores the previous earliest
+        early.section = Section.objects.get(heading='March')
+        early.save()
+        top_level = Section.objects.get(id=top_level.id)
+        self.assertEqual(top_level.subtree_speech_count, 14)
+        self.assertEqual(speech_min_from_db(top_level.subtree_speech_min), datetime(2013, 3, 25, 9, 0))
+
+        early.delete()
+        written = Section.objects.get(heading='Government Written Answers')
+        self.assertEqual(written.subtree_speech_count, 6)
+
+        # And a full rebuild agrees with the incrementally maintained values
+        before = list(Section.objects.values_list('speech_count', 'subtree_speech_count', 'subtree_speech_min'))
+        Section.objects.update(speech_count=0, subtree_speech_count=0, subtree_speech_min=None)
+        call_command('sayit_rebuild_sections')
+        after = list(Section.objects.values_list('speech_count', 'subtree_speech_count', 'subtree_speech_min'))
+        self.assertEqual(before, after)
+
+    def test_section_speech_aggregates_deferred(self):
+        clause = Section.objects.get(heading='New Clause 1')
+        march = Section.objects.get(heading='March')
+        counts = dict(Section.objects.values_list('id', 'subtree_speech_count'))
+
+        def subtree_counts(*sections):
+            return [Section.objects.get(id=s.id).subtree_speech_count for s in sections]
+
+        # Saving a speech loaded without its section or start doesn't count
+        # it twice, whether or not it is moved
+        speech = Speech.objects.only('text').filter(section=clause)[0]
+        speech.text = 'Changed'
+        speech.save()
+        speech = Speech.objects.defer('start_time').filter(section=clause)[0]
+        speech.save()
+        self.assertEqual(dict(Section.objects.values_list('id', 'subtree_speech_count')), counts)
+
+        speech = Speech.objects.only('text').filter(section=clause)[0]
+        speech.section = march
+        speech.save()
+        self.assertEqual(subtree_counts(clause, march), [counts[clause.id] - 1, counts[march.id] + 1])
+
+        Speech.objects.defer('start_date').get(id=speech.id).delete()
+        self.assertEqual(subtree_counts(clause, march), [counts[clause.id] - 1, counts[march.id]])
+
+    def test_section_tree_interleaved_parentage_queries(self):
+        create_sections([
+            {'heading': "Interleaved day", 'subsections': [
+                {'heading': "Debate A", 'subsections': [
+                    {'heading': "A morning", 'speeches': [1, date(2013, 4, 1), time(9, 0)]},
+                    {'heading': "A afternoon", 'speeches': [1, date(2013, 4, 1), time(15, 0)]},
+                ]},
+                {'heading': "Debate B", 'subsections': [
+                    {'heading': "B midday", 'speeches': [1, date(2013, 4, 1), time(12, 0)]},
+                ]},
+            ]},
+        ])
+        day = Section.objects.get(heading='Interleaved day')
+        with self.assertNumQueries(1):
+            tree = day.get_descendants_tree
+        self.assertEqual(len(tree), 5)
+        # Debate A appears again to hold the afternoon, after Debate B
+        self.assertEqual(
+            [s.heading for s in day._childs],
+            ['Debate A', 'Debate B', 'Debate A'])
+        self.assertEqual([s.heading for s in day._childs[2]._childs], ['A afternoon'])
+        self.assertFalse(day._childs[2].is_leaf_node())
+        self.assertTrue(day._childs[2]._childs[0].is_leaf_node())
+
+    def test_section_tree_windows(self):
+        request = RequestFactory().get('/')
+        request.is_user_instance = True
+        section = Section.objects.get(heading='Government Debates')
+        full = [
+            (type(node), node.id, str(node))
+            for node, structure in section.get_descendants_tree_with_speeches(request, all_speeches=True)
+        ]
+        for size in (1, 2, 5):
+            nodes, cursor = [], None
+            while True:
+                section = Section.objects.get(id=section.id)
+                window, cursor = section.get_descendants_tree_window(
+                    request, size, after=cursor, all_speeches=True)
+                self.assertLessEqual(len(window), size)
+                # Each window opens as many levels as it closes
+                opened = sum(
+                    len(structure.get('reopened_levels', [])) + bool(structure.get('new_level'))
+                    for node, structure in window)
+                closed = sum(len(structure.get('closed_levels', [])) for node, structure in window)
+                self.assertEqual(opened, closed)
+                nodes.extend((type(node), node.id, str(node)) for node, structure in window)
+                if not cursor:
+                    break
+            self.assertEqual(nodes, full)
+
+    @override_settings(SECTION_TREE_CACHE='default')
+    def test_section_tree_cache(self):
+        caches['default'].clear()
+        request = RequestFactory().get('/')
+        request.is_user_instance = True
+
+        def texts(section):
+            tree = section.get_descendants_tree_with_speeches(request, all_speeches=True)
+            return [getattr(node, 'text', None) for node, structure in tree]
+
+        debates = Section.objects.get(heading='Government Debates')
+        answers = Section.objects.get(heading='Government Written Answers')
+        first = texts(debates)
+        texts(answers)
+
+        debates = Section.objects.get(id=debates.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(texts(debates), first)
+
+        # A change anywhere in a document invalidates its trees
+        speech = Speech.objects.filter(section__heading='Z Clause')[0]
+        speech.text = 'Changed speech'
+        speech.save()
+        debates = Section.objects.get(id=debates.id)
+        self.assertIn('Changed speech', texts(debates))
+
+        # But not those of other documents
+        answers = Section.objects.get(id=answers.id)
+        with self.assertNumQueries(0):
+            texts(answers)
+
+        # Nor do changes to what speeches show from elsewhere go unseen
+        def details(section):
+            tree = section.get_descendants_tree_with_speeches(request, all_speeches=True)
+            return [(node.speaker.name, [tag.name for tag in node.tags.all()])
+                    for node, structure in tree if getattr(node, 'speaker', None)]
+
+        speaker = Speaker.objects.create(name='Alice', instance=speech.instance)
+        speech.speaker = speaker
+        speech.save()
+        self.assertEqual(details(Section.objects.get(id=debates.id)), [('Alice', [])])
+
+        speaker.name = 'Alicia'
+        speaker.save()
+        self.assertEqual(details(Section.objects.get(id=debates.id)), [('Alicia', [])])
+
+        tag = Tag.objects.create(name='Easter', instance=speech.instance)
+        speech.tags.add(tag)
+        self.assertEqual(details(Section.objects.get(id=debates.id)), [('Alicia', ['Easter'])])
+
+        tag.speech_set.clear()
+        self.assertEqual(details(Section.objects.get(id=debates.id)), [('Alicia', [])])
+
     def test_section_get_or_create_with_parents(self):
 
         instance, _ = Instance.objects.get_or_create(label='get-or-create-with-parents')
@@ -237,6 +535,67 @@ class SectionSiteTests(InstanceTestCase):
             2)
         self.assertContains(resp, 'Next day speech')
 
+    @override_settings(SECTION_STREAMING=True)
+    def test_section_page_streams_speeches(self):
+        section = Section.objects.create(heading='A test section', instance=self.instance)
+
+        resp = self.client.get('/section/%d' % section.id)
+        self.assertTrue(resp.streaming)
+        self.assertIn('This section is empty', b''.join(resp.streaming_content).decode())
+
+        Section.objects.create(heading='A test subsection', parent=section, instance=self.instance)
+
+        for i in range(3):
+            Speech.objects.create(
+                text="Streamed speech %d" % i, section=section, instance=self.instance)
+        resp = self.client.get('/section/%d' % section.id)
+        content = b''.join(resp.streaming_content).decode()
+        self.assertIn('A test subsection', content)
+        for i in range(3):
+            self.assertIn('Streamed speech %d' % i, content)
+        self.assertEqual(content.count('<ul class="section-list">'), 1)
+
+    @override_settings(SECTION_STREAMING=True)
+    def test_section_page_streaming_template_without_placeholder(self):
+        section = Section.objects.create(heading='A test section', instance=self.instance)
+        Speech.objects.create(text='Unstreamed speech', section=section, instance=self.instance)
+
+        templates = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, templates)
+        os.mkdir(os.path.join(templates, 'speeches'))
+        with open(os.path.join(templates, 'speeches', 'section_detail.html'), 'w') as f:
+            f.write('{% for node, structure in section_tree %}{{ node.text }}{% endfor %}')
+        engine = dict(settings.TEMPLATES[0], DIRS=[templates] + settings.TEMPLATES[0]['DIRS'])
+
+        with override_settings(TEMPLATES=[engine]):
+            resp = self.client.get('/section/%d' % section.id)
+        self.assertFalse(resp.streaming)
+        self.assertContains(resp, 'Unstreamed speech')
+
+    @override_settings(SECTION_WINDOW_SIZE=2)
+    def test_section_page_windows(self):
+        section = Section.objects.create(heading='A test section', instance=self.instance)
+        for i in range(3):
+            Speech.objects.create(
+                text="Windowed speech %d" % i, section=section, instance=self.instance,
+                start_date=date(2014, 9, 17), start_time=time(10, i))
+
+        resp = self.client.get('/section/%d' % section.id)
+        self.assertEqual(len(resp.context['section_tree']), 2)
+        self.assertContains(resp, 'Windowed speech 1')
+        self.assertNotContains(resp, 'Windowed speech 2')
+        cursor = resp.context['section_tree_cursor']
+        self.assertContains(resp, '/section/%d/window?after=%s' % (section.id, cursor))
+
+        resp = self.client.get('/section/%d/window' % section.id, {'after': cursor})
+        data = json.loads(resp.content.decode())
+        self.assertIn('Windowed speech 2', data['html'])
+        self.assertNotIn('Windowed speech 1', data['html'])
+        self.assertIsNone(data['cursor'])
+
+        resp = self.client.get('/section/%d/window' % section.id, {'after': 'nonsense'})
+        self.assertEqual(resp.status_code, 404)
+
     def test_section_page_lists_subsections(self):
         section = Section.objects.create(heading='A test section', instance=self.instance)
 
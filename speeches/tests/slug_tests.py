@@ -19,6 +19,38 @@ class SlugTests(InstanceTestCase):
         resp = self.client.get('/different')
         self.assertContains(resp, 'Different')
 
+    def test_nested_section_slug_paths(self):
+        top = Section.objects.create(heading=u'Top', instance=self.instance)
+        middle = Section.objects.create(heading=u'Middle', parent=top, instance=self.instance)
+        bottom = Section.objects.create(heading=u'Bottom', parent=middle, instance=self.instance)
+        self.assertEqual(bottom.slug_path, 'top/middle/bottom')
+
+        # Links to a loaded section don't need its ancestors
+        bottom = Section.objects.get(id=bottom.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(bottom.get_absolute_url(), '/top/middle/bottom')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                Section.objects.get_by_slug_path(self.instance, 'top/middle/bottom'), bottom)
+
+        # Renaming an ancestor updates the paths below it, and the old path
+        # redirects straight to the new one
+        top.heading = u'Renamed'
+        top.save()
+        self.assertEqual(Section.objects.get(id=bottom.id).slug_path, 'renamed/middle/bottom')
+        resp = self.client.get('/top/middle/bottom')
+        self.assertRedirects(resp, '/renamed/middle/bottom')
+        resp = self.client.get('/top/middle/nowhere')
+        self.assertEqual(resp.status_code, 404)
+
+        # As does moving a section
+        middle.parent = None
+        middle.save()
+        self.assertEqual(Section.objects.get(id=bottom.id).slug_path, 'middle/bottom')
+        resp = self.client.get('/middle/bottom')
+        self.assertContains(resp, 'Bottom')
+
     def test_slug_updated_when_name_changes(self):
         speaker = Speaker.objects.create(name=u'Bob', instance=self.instance)
         self.assertEqual(speaker.slug, 'bob')
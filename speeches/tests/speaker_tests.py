@@ -1,29 +1,46 @@
 import hashlib
 import re
+import shutil
+import tempfile
 from datetime import date
 from mock import patch, Mock
-from six.moves.urllib.error import HTTPError
+import requests
 
+from django.conf import settings
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TransactionTestCase
 from django.test.utils import override_settings
 from django.utils.six import assertRegex
 from django.utils.encoding import smart_text
 
 import lxml.html
 
+from instances.models import Instance
 from speeches.tests import InstanceTestCase, OverrideMediaRootMixin
 
 from speeches.models import Speaker, Speech, Section
 from speeches import models
 
 
-def side_effect(url):
+def side_effect(url, headers=None, timeout=None):
+    response = Mock(headers={'ETag': '"magellan"'}, status_code=200)
     if '404' in url:
-        raise HTTPError(url, 404, 'NOT FOUND', None, None)
-    return ('speeches/fixtures/test_inputs/Ferdinand_Magellan.jpg', None)
+        response.status_code = 404
+        response.raise_for_status.side_effect = requests.HTTPError('404 Client Error: NOT FOUND')
+    elif headers and headers.get('If-None-Match') == '"magellan"':
+        response.status_code = 304
+    else:
+        with open('speeches/fixtures/test_inputs/Ferdinand_Magellan.jpg', 'rb') as f:
+            response.content = f.read()
+    return response
+
+
+fake_get = Mock(side_effect=side_effect)
 
 
 @override_settings(MEDIA_URL='/uploads/')
-@patch.object(models, 'urlretrieve', Mock(side_effect=side_effect))
+@patch.object(models.requests, 'get', fake_get)
 class SpeakerTests(OverrideMediaRootMixin, InstanceTestCase):
     """Tests for the speaker functionality"""
     speakers = []
@@ -110,6 +127,7 @@ class SpeakerTests(OverrideMediaRootMixin, InstanceTestCase):
             instance=self.instance,
             summary='movie star',
             image=u'http://example.com/imag%C3%A9.jpg')
+        speaker1.fetch_image()
         self.speakers.append(speaker1)
         speaker2 = Speaker.objects.create(
             name='Salinger', instance=self.instance)
@@ -157,6 +175,8 @@ class SpeakerTests(OverrideMediaRootMixin, InstanceTestCase):
             image=long_image_url,
             )
         self.speakers.extend((s1, s2))
+        s1.fetch_image()
+        s2.fetch_image()
 
         # Note the filename in image_cache has been truncated.
         self.assertEqual(
@@ -181,13 +201,60 @@ class SpeakerTests(OverrideMediaRootMixin, InstanceTestCase):
         self.assertEqual(speaker.name, 'Bob')
 
     def test_add_speaker_with_image_not_found(self):
+        speaker = Speaker.objects.create(
+            name='Not Found',
+            instance=self.instance,
+            image='http://example.com/status/404')
         try:
-            Speaker.objects.create(
-                name='Not Found',
-                instance=self.instance,
-                image='http://httpbin.org/status/404')
-        except HTTPError:
+            self.assertFalse(speaker.fetch_image())
+        except requests.HTTPError:
             self.fail("Speaker unexpectedly raised HTTPError")
+        self.assertFalse(speaker.image_cache)
+
+    def test_speaker_image_fetched_once(self):
+        speaker = Speaker.objects.create(
+            name='Steve', instance=self.instance, image='http://example.com/image.jpg')
+        self.speakers.append(speaker)
+        # Saving doesn't wait for the image to be fetched
+        self.assertFalse(speaker.image_cache)
+
+        self.assertTrue(speaker.fetch_image())
+        filename = speaker.image_cache.name
+        speaker = Speaker.objects.get(pk=speaker.pk)
+        self.assertEqual(speaker.image_cache.name, filename)
+        self.assertEqual(speaker.image_etag, '"magellan"')
+
+        # The same image isn't fetched again
+        fake_get.reset_mock()
+        speaker.save()
+        self.assertFalse(speaker.fetch_image())
+        self.assertFalse(fake_get.called)
+
+        # Unless refreshing, when the server is asked if it has changed
+        self.assertFalse(speaker.fetch_image(refresh=True))
+        fake_get.assert_called_once_with(
+            'http://example.com/image.jpg', headers={'If-None-Match': '"magellan"'}, timeout=60)
+
+        # A new URL is fetched, but the same image isn't stored again
+        speaker.image = 'http://example.com/portrait.jpg'
+        speaker.save()
+        self.assertFalse(speaker.fetch_image())
+        speaker = Speaker.objects.get(pk=speaker.pk)
+        self.assertEqual(speaker.image_cache.name, filename)
+        self.assertEqual(speaker.image_cache_url, 'http://example.com/portrait.jpg')
+
+    def test_fetch_speaker_images_command(self):
+        speaker = Speaker.objects.create(
+            name='Steve', instance=self.instance, image='http://example.com/image.jpg')
+
+        call_command('sayit_fetch_speaker_images')
+        speaker = Speaker.objects.get(pk=speaker.pk)
+        self.assertEqual(speaker.image_cache.name, 'speakers/default/image.jpg')
+        self.speakers.append(speaker)
+
+        fake_get.reset_mock()
+        call_command('sayit_fetch_speaker_images')
+        self.assertFalse(fake_get.called)
 
     def test_speaker_list_ordering(self):
         Speaker.objects.create(name='alice', instance=self.instance)
@@ -197,6 +264,34 @@ class SpeakerTests(OverrideMediaRootMixin, InstanceTestCase):
         assertRegex(self, resp.content.decode(), u'Eve.*alice.*Bob(?s)')
 
 
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='sayit_test'))
+@patch.object(models.requests, 'get', fake_get)
+class SpeakerImageQueueTests(TransactionTestCase):
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT)
+
+    def test_image_fetched_after_commit(self):
+        instance = Instance.objects.create(label='default')
+        with transaction.atomic():
+            speaker = Speaker.objects.create(
+                name='Steve', instance=instance, image='http://example.com/image.jpg')
+            models.speaker_images.join()
+            self.assertFalse(Speaker.objects.get(pk=speaker.pk).image_cache)
+
+        models.speaker_images.join()
+        self.assertEqual(Speaker.objects.get(pk=speaker.pk).image_cache.name, 'speakers/default/image.jpg')
+
+    @override_settings(SPEAKER_IMAGES_IN_BACKGROUND=False)
+    def test_image_fetched_on_commit(self):
+        instance = Instance.objects.create(label='default')
+        with transaction.atomic():
+            speaker = Speaker.objects.create(
+                name='Steve', instance=instance, image='http://example.com/image.jpg')
+            self.assertFalse(Speaker.objects.get(pk=speaker.pk).image_cache)
+
+        self.assertEqual(Speaker.objects.get(pk=speaker.pk).image_cache.name, 'speakers/default/image.jpg')
+
+
 class MergeDeleteSpeakerTests(InstanceTestCase):
     def test_no_speeches(self):
         alice = Speaker.objects.create(name='alice', instance=self.instance)
@@ -5,9 +5,10 @@ from speeches.views import (
     AddAnSRedirectView, SpeechAudioCreate, SpeechCreate, SpeechUpdate,
     SpeechDelete, SpeechView, SpeakerCreate, SpeakerUpdate, SpeakerDelete,
     SpeakerView, SpeakerList, SectionCreate, SectionUpdate, SectionDelete,
-    SectionView, SectionViewAN, ParentlessList, RecordingList, RecordingView,
-    RecordingUpdate, RecordingAPICreate, InstanceView, Select2AutoResponseView,
-    PopoloImportView, AkomaNtosoImportView,
+    SectionView, SectionViewAN, SectionTreeWindow, ParentlessList,
+    RecordingList, RecordingView, RecordingUpdate, RecordingAPICreate,
+    InstanceView, Select2AutoResponseView, PopoloImportView,
+    AkomaNtosoImportView,
     )
 
 from speeches.search import InstanceSearchView
@@ -55,6 +56,7 @@ urlpatterns = [
     url(r'^section/(?P<pk>\d+)$', SectionView.as_view(), name='section-id-view'),
     url(r'^section/(?P<pk>\d+)/edit$', SectionUpdate.as_view(), name='section-edit'),
     url(r'^section/(?P<pk>\d+)/delete$', SectionDelete.as_view(), name='section-delete'),
+    url(r'^section/(?P<pk>\d+)/window$', SectionTreeWindow.as_view(), name='section-window'),
     url(r'^speeches$', ParentlessList.as_view(), name='parentless-list'),
 
     url(r'^recordings$', RecordingList.as_view(), name='recording-list'),
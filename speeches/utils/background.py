@@ -0,0 +1,49 @@
+"""A queue of work to be done in a background thread, so that requests and
+imports need not wait on it."""
+
+import atexit
+import threading
+
+from django.db import connections
+from six.moves import queue
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class BackgroundQueue(object):
+    """Calls the functions put on it one at a time, in a daemon thread
+    started the first time it is needed. As the work is done outside any
+    request, the thread's database connections are closed after each
+    piece of it. Whatever is still queued when the process exits, e.g. at
+    the end of a management command, is done before it does."""
+
+    def __init__(self, name):
+        self.name = name
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        atexit.register(self.join)
+
+    def put(self, func, *args):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.work, name=self.name)
+                self.thread.daemon = True
+                self.thread.start()
+        self.queue.put((func, args))
+
+    def work(self):
+        while True:
+            func, args = self.queue.get()
+            try:
+                func(*args)
+            except Exception:
+                logger.exception('%s: %s%r failed', self.name, func.__name__, args)
+            finally:
+                connections.close_all()
+                self.queue.task_done()
+
+    def join(self):
+        """Wait until everything put on the queue has been done."""
+        self.queue.join()
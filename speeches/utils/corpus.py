@@ -0,0 +1,129 @@
+"""Generation of synthetic transcripts and speakers, for measuring how
+imports and pages cope with data at a realistic scale."""
+
+import datetime
+import io
+import json
+import os
+import random
+
+from lxml import etree
+
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod '
+    'tempor incididunt ut labore et dolore magna aliqua enim ad minim veniam '
+    'quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo '
+    'consequat duis aute irure in reprehenderit voluptate velit esse cillum '
+    'eu fugiat nulla pariatur excepteur sint occaecat cupidatat non proident '
+    'sunt culpa qui officia deserunt mollit anim id est laborum'
+).split()
+
+GIVEN_NAMES = (
+    'Ada', 'Bola', 'Carys', 'Dafydd', 'Esi', 'Femi', 'Gwen', 'Hamid', 'Ines',
+    'Jomo', 'Kofi', 'Lerato', 'Maya', 'Nia', 'Owain', 'Priya', 'Rhys', 'Sipho',
+)
+
+FAMILY_NAMES = (
+    'Adeyemi', 'Brown', 'Davies', 'Evans', 'Kamau', 'Mensah', 'Nkosi', 'Okoro',
+    'Patel', 'Roberts', 'Smith', 'Thomas', 'Wanjiru', 'Williams',
+)
+
+
+class CorpusGenerator(object):
+    """Writes Akoma Ntoso debates, and a Popolo file of the people speaking
+    in them. Each debate has sections nested depth levels deep, fan_out
+    sections within each section, and speeches speeches of paragraphs
+    paragraphs of words words directly in each section. The same seed
+    always gives the same corpus."""
+
+    def __init__(self, documents=1, depth=2, fan_out=3, speeches=10, speakers=50,
+                 paragraphs=2, words=40, seed=0, start_date=datetime.date(2000, 1, 1)):
+        self.documents = documents
+        self.depth = depth
+        self.fan_out = fan_out
+        self.speeches = speeches
+        self.speakers = speakers
+        self.paragraphs = paragraphs
+        self.words = words
+        self.seed = seed
+        self.start_date = start_date
+
+    def people(self):
+        random_ = random.Random(self.seed)
+        return [
+            {
+                'id': 'person-%d' % i,
+                'name': '%s %s' % (random_.choice(GIVEN_NAMES), random_.choice(FAMILY_NAMES)),
+            }
+            for i in range(1, self.speakers + 1)
+        ]
+
+    def section_count(self):
+        """The number of sections in each debate, including its own."""
+        return sum(self.fan_out ** level for level in range(self.depth + 1))
+
+    def speech_count(self):
+        """The number of speeches in each debate."""
+        return self.section_count() * self.speeches
+
+    def write(self, output_dir):
+        """Write the corpus into output_dir, returning the paths of the
+        Popolo file and of each of the debates."""
+        people = self.people()
+        popolo_path = os.path.join(output_dir, 'people.json')
+        with io.open(popolo_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'persons': people}, indent=2, ensure_ascii=False))
+
+        paths = []
+        for number in range(1, self.documents + 1):
+            path = os.path.join(output_dir, 'debate-%04d.xml' % number)
+            self.write_akomantoso(path, number, people)
+            paths.append(path)
+        return popolo_path, paths
+
+    def write_akomantoso(self, path, number, people):
+        random_ = random.Random('%s-%d' % (self.seed, number))
+        date = self.start_date + datetime.timedelta(days=number - 1)
+        self.time = datetime.datetime.combine(date, datetime.time(9, 0))
+
+        with etree.xmlfile(path, encoding='utf-8') as xf:
+            xf.write_declaration()
+            with xf.element('akomaNtoso'), xf.element('debate'):
+                with xf.element('meta'), xf.element('references'):
+                    for person in people:
+                        xf.write(etree.Element('TLCPerson', {
+                            'href': person['id'],
+                            'id': person['id'],
+                            'showAs': person['name'],
+                        }))
+                with xf.element('preface'), xf.element('p'):
+                    title = etree.Element('docTitle')
+                    title.text = 'Debate %d' % number
+                    xf.write(title)
+                    doc_date = etree.Element('docDate', date=date.isoformat())
+                    doc_date.text = date.isoformat()
+                    xf.write(doc_date)
+                with xf.element('debateBody'):
+                    self.write_section_contents(xf, random_, people, 0, [])
+
+    def write_section_contents(self, xf, random_, people, level, numbers):
+        for i in range(self.speeches):
+            person = random_.choice(people)
+            self.time += datetime.timedelta(minutes=1)
+            with xf.element('speech', by='#%s' % person['id'], startTime=self.time.isoformat()):
+                speaker = etree.Element('from')
+                speaker.text = person['name']
+                xf.write(speaker)
+                for p in range(self.paragraphs):
+                    paragraph = etree.Element('p')
+                    paragraph.text = ' '.join(random_.choice(WORDS) for w in range(self.words)).capitalize()
+                    xf.write(paragraph)
+
+        if level == self.depth:
+            return
+        for i in range(1, self.fan_out + 1):
+            with xf.element('debateSection'):
+                heading = etree.Element('heading')
+                heading.text = 'Section %s' % '.'.join(str(n) for n in numbers + [i])
+                xf.write(heading)
+                self.write_section_contents(xf, random_, people, level + 1, numbers + [i])
@@ -0,0 +1,162 @@
+"""Incremental reading of large JSON documents, a value at a time, so that
+the items of a long array can be dealt with without holding all of them in
+memory at once."""
+
+import codecs
+import json
+
+WHITESPACE = ' \t\n\r'
+NUMBER_START = '-0123456789'
+NUMBER_CHARS = NUMBER_START + '+.eE'
+
+
+class JSONStreamReader(object):
+    """Reads JSON from an iterable of chunks of UTF-8 encoded bytes.
+
+    Containers are walked with iter_object(), which yields each key of an
+    object, and iter_array(), which yields at each item of an array; in
+    either case the value there can then be decoded with read_value() or
+    walked in turn. A value that is not read is skipped over, without it
+    being decoded all at once."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = u''
+        self.pos = 0
+        self.offset = 0
+        self.finished = False
+
+    @classmethod
+    def from_file(cls, fp, chunk_size=65536):
+        return cls(iter(lambda: fp.read(chunk_size), b''))
+
+    def tell(self):
+        return self.offset + self.pos
+
+    def fill(self):
+        """Read another chunk into the buffer, dropping what has already
+        been read. Returns False if there is nothing more to read."""
+        if self.finished:
+            return False
+        if self.pos:
+            self.offset += self.pos
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        for chunk in self.chunks:
+            text = self.decoder.decode(chunk)
+            if text:
+                self.buffer += text
+                return True
+        self.finished = True
+        self.buffer += self.decoder.decode(b'', final=True)
+        return False
+
+    def peek(self):
+        """Return the next character that is not whitespace, without
+        consuming it, or an empty string at the end of the document."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expecting %r at character %d' % (char, self.tell()))
+        self.pos += 1
+
+    def read_value(self):
+        """Decode the value at the current position."""
+        start = self.peek()
+        if start and start in NUMBER_START:
+            # Make sure all of a number is in the buffer, as a part of it
+            # would decode too
+            end = self.pos
+            while True:
+                while end < len(self.buffer) and self.buffer[end] in NUMBER_CHARS:
+                    end += 1
+                if end < len(self.buffer):
+                    break
+                end -= self.pos
+                if not self.fill():
+                    break
+                end += self.pos
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if self.fill():
+                    continue
+                raise
+            self.pos = end
+            return value
+
+    def skip_value(self):
+        """Move past the value at the current position."""
+        start = self.peek()
+        if start in ('[', '{'):
+            # Decoding a container is quickest if it is all in the buffer
+            try:
+                self.pos = self.json_decoder.raw_decode(self.buffer, self.pos)[1]
+                return
+            except ValueError:
+                pass
+        if start == '[':
+            for _ in self.iter_array():
+                pass
+        elif start == '{':
+            for _ in self.iter_object():
+                pass
+        else:
+            self.read_value()
+
+    def iter_array(self):
+        """Walk the array at the current position, yielding the index of
+        each item when positioned at it."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        index = 0
+        while True:
+            self.peek()
+            position = self.tell()
+            yield index
+            if self.tell() == position:
+                self.skip_value()
+            if self.peek() == ',':
+                self.pos += 1
+                index += 1
+            else:
+                self.expect(']')
+                return
+
+    def iter_object(self):
+        """Walk the object at the current position, yielding each key when
+        positioned at its value."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                raise ValueError('Expecting property name at character %d' % self.tell())
+            key = self.read_value()
+            self.expect(':')
+            self.peek()
+            position = self.tell()
+            yield key
+            if self.tell() == position:
+                self.skip_value()
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect('}')
+                return
+
+    def items(self):
+        """Yield each item of the array at the current position, decoded."""
+        for _ in self.iter_array():
+            yield self.read_value()
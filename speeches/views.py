@@ -1,8 +1,10 @@
 import datetime
 import json
+from itertools import islice
 from six import string_types
 
-from django.http import HttpResponse, HttpResponseRedirect
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse, Http404
 from django.urls import reverse, reverse_lazy, resolve
 from django.core import serializers
 from django.contrib import messages
@@ -13,9 +15,9 @@ from django.template import loader
 from django.utils.html import strip_tags
 from django.utils.translation import ugettext as _, ungettext
 
+from django.db import transaction
 from django.db.models import Count, Avg
 from django.db.models.functions import Length
-from django.shortcuts import get_object_or_404
 
 from instances.views import InstanceFormMixin, InstanceViewMixin
 
@@ -26,6 +28,7 @@ from speeches.forms import (
     PopoloImportForm, AkomaNtosoImportForm,
     )
 from speeches.models import Speech, Speaker, Section, Recording, Tag
+from speeches.exporters.export_akomantoso import ExportAkomaNtoso
 from speeches.mixins import Base32SingleObjectMixin, UnmatchingSlugException
 from speeches.importers.import_akomantoso import ImportAkomaNtoso
 
@@ -421,6 +424,11 @@ class SectionDelete(SectionMixin, DeleteView):
 class SectionView(NamespaceMixin, InstanceViewMixin, DetailView):
     model = Section
 
+    # When streaming, the page is rendered around this placeholder, and the
+    # section's contents are then rendered in chunks of this many items.
+    stream_placeholder = 'sayit-section-tree-stream'
+    stream_chunk_size = 100
+
     def get(self, request, *args, **kwargs):
         try:
             return super(SectionView, self).get(request, *args, **kwargs)
@@ -432,50 +440,119 @@ class SectionView(NamespaceMixin, InstanceViewMixin, DetailView):
         if pk is not None:
             return super(SectionView, self).get_object(queryset)
         full_slug = self.kwargs.get('full_slug', None)
-        slugs = full_slug.split('/')
-        parent = None
-        for i, slug in enumerate(slugs):
-            obj = get_object_or_404(self.model, instance=self.request.instance, slugs__slug=slug, parent=parent)
-            if slug != obj.slug:
-                new_url = obj.get_absolute_url()
-                if i < len(slugs) - 1:
-                    new_url += '/' + '/'.join(slugs[i + 1:])
-                raise UnmatchingSlugException(new_url)
-            parent = obj
+        try:
+            obj = self.model.objects.get_by_slug_path(self.request.instance, full_slug)
+        except self.model.DoesNotExist:
+            raise Http404
+        if obj.slug_path != full_slug:
+            raise UnmatchingSlugException(obj.get_absolute_url())
         return obj
 
+    def get_streaming(self):
+        """Whether to send the section's contents as they are rendered,
+        rather than the whole page at once; off unless SECTION_STREAMING is set."""
+        return getattr(settings, 'SECTION_STREAMING', False)
+
+    def get_window_size(self):
+        """How many items of the section's contents to show at first, with
+        the rest fetched a window at a time from SectionTreeWindow; all of
+        them unless SECTION_WINDOW_SIZE is set."""
+        return getattr(settings, 'SECTION_WINDOW_SIZE', None)
+
     def get_context_data(self, **kwargs):
         all_speeches = kwargs.pop('all_speeches', False)
         # Call the base implementation first to get a context
         context = super(SectionView, self).get_context_data(**kwargs)
         # Add in a QuerySet of all the speeches in this section
-        context['section_tree'] = kwargs['object'].get_descendants_tree_with_speeches(
-            self.request,
-            all_speeches=all_speeches,
-        )
+        if self.get_streaming():
+            context['section_tree_stream'] = self.stream_placeholder
+        elif self.get_window_size():
+            context['section_tree'], context['section_tree_cursor'] = \
+                kwargs['object'].get_descendants_tree_window(
+                    self.request, self.get_window_size(), all_speeches=all_speeches)
+        else:
+            context['section_tree'] = kwargs['object'].get_descendants_tree_with_speeches(
+                self.request,
+                all_speeches=all_speeches,
+            )
         context['title'] = _('View Section: %(section_title)s') % {'section_title': self.object.title}
         context['speech_template'] = loader.get_template('speeches/speech.html')
         return context
 
+    def render_to_response(self, context, **response_kwargs):
+        response = super(SectionView, self).render_to_response(context, **response_kwargs)
+        if 'section_tree_stream' not in context:
+            return response
+        content = response.rendered_content
+        if self.stream_placeholder not in content:
+            # A section_detail.html overridden without a place marked for
+            # the streamed contents gets them all at once instead
+            logger.warning("The section template has no {{ section_tree_stream }}, so it is not streamed")
+            context = dict(context, section_tree=self.object.get_descendants_tree_with_speeches(self.request))
+            del context['section_tree_stream']
+            return super(SectionView, self).render_to_response(context, **response_kwargs)
+        head, tail = content.split(self.stream_placeholder, 1)
+        return StreamingHttpResponse(
+            self.stream_section_tree(context, head, tail),
+            content_type=response['Content-Type'],
+        )
 
-class SectionViewAN(SectionView):
-    template_name = 'speeches/section_detail.an'
+    def stream_section_tree(self, context, head, tail):
+        yield head
+
+        nodes = self.object.iter_descendants_tree_with_speeches(
+            self.request, chunk_size=self.stream_chunk_size)
+        chunk = list(islice(nodes, self.stream_chunk_size))
+        if not chunk:
+            yield loader.render_to_string('speeches/_section_tree_empty.html', context, self.request)
+        else:
+            yield loader.render_to_string('speeches/_section_tree_start.html', context, self.request)
+            nodes_template = loader.get_template('speeches/_section_tree_nodes.html')
+            while chunk:
+                yield nodes_template.render(dict(context, section_tree=chunk), self.request)
+                chunk = list(islice(nodes, self.stream_chunk_size))
+            yield loader.render_to_string('speeches/_section_tree_end.html', context, self.request)
+
+        yield tail
 
-    def render_to_response(self, context, **response_kwargs):
-        response_kwargs['content_type'] = 'text/xml'
-        return super(SectionView, self).render_to_response(context, **response_kwargs)
+
+class SectionViewAN(SectionView):
+    """A section as an Akoma Ntoso document, streamed as it is written."""
 
     def get_context_data(self, **kwargs):
-        kwargs['all_speeches'] = True
-        context = super(SectionViewAN, self).get_context_data(**kwargs)
-        speakers = set(
-            s[0].speaker
-            for s in context['section_tree']
-            if isinstance(s[0], Speech) and s[0].speaker
+        # The section's contents are fetched as they are written out
+        return super(SectionView, self).get_context_data(**kwargs)
+
+    def render_to_response(self, context, **response_kwargs):
+        return StreamingHttpResponse(
+            ExportAkomaNtoso(self.object, self.request),
+            content_type='text/xml',
         )
-        context['speakers'] = speakers
-        context['server_name'] = self.request.META.get('SERVER_NAME')
-        return context
+
+
+class SectionTreeWindow(JSONResponseMixin, InstanceViewMixin, DetailView):
+    """The next window of a section page's contents, after the cursor given
+    as the `after` parameter, as an HTML fragment and the cursor to ask for
+    the window after that, which is null at the end."""
+    model = Section
+
+    def get_window_size(self):
+        return getattr(settings, 'SECTION_WINDOW_SIZE', None) or SectionView.stream_chunk_size
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        self.request.current_app = resolve(self.request.path).namespace
+        try:
+            section_tree, cursor = self.object.get_descendants_tree_window(
+                request, self.get_window_size(), after=request.GET.get('after'))
+        except ValueError:
+            raise Http404
+        html = loader.render_to_string('speeches/_section_tree_nodes.html', {
+            'section': self.object,
+            'section_tree': section_tree,
+            'speech_template': loader.get_template('speeches/speech.html'),
+        }, request)
+        return self.render_to_response({'html': html, 'cursor': cursor})
 
 
 class BothObjectAndFormMixin(object):
@@ -704,7 +781,9 @@ class AkomaNtosoImportView(NamespaceMixin, InstanceFormMixin, FormView):
                 clobber=form.cleaned_data.get('existing_sections'),
                 )
 
-            stats = importer.import_document(form.cleaned_data['location'])
+            # A document that fails to import leaves nothing behind
+            with transaction.atomic():
+                stats = importer.import_document(form.cleaned_data['location'])
         except:
             form._errors[NON_FIELD_ERRORS] = form.error_class(
                 [_('Sorry - something went wrong with the import')])